@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+# LiteHyperRAM simulation benchmark ------------------------------------------------------------------
+
+# Runs LiteHyperRAMCore against the HyperRAM simulation model for each
+# module in litehyperram.modules, in 1X and 2X mode, through the native
+# port and through the Wishbone (classic, pipelined and cached) and AXI
+# frontends, and reports bandwidth, command to first data latency and
+# HyperBus utilisation as JSON.
+# Workloads are generated from fixed seeds, so results from different
+# commits can be compared with --compare.
+#
+# Usage (from the repository root):
+#
+#   PYTHONPATH=. python3 bench/benchmark.py --output bench.json
+#   PYTHONPATH=. python3 bench/benchmark.py --compare bench.json
+
+import argparse
+import inspect
+import json
+import random
+import subprocess
+import sys
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.axi import AXIInterface
+
+from litehyperram import modules
+from litehyperram.core import LiteHyperRAMCore
+from litehyperram.frontend.axi import LiteHyperRAMAXI2Native
+from litehyperram.frontend.cache import LiteHyperRAMCachedWishbone2Native
+from litehyperram.frontend.wishbone import LiteHyperRAMWishbone2Native
+from litehyperram.frontend.wishbone import LiteHyperRAMPipelinedWishbone2Native
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+# Workloads ----------------------------------------------------------------------------------------
+
+# name: (address pattern, direction, burst lengths)
+workloads = {
+    "seq_read":     ("sequential", "read",  [16]),
+    "seq_write":    ("sequential", "write", [16]),
+    "seq_mixed":    ("sequential", "mixed", [16]),
+    "small_write":  ("sequential", "write", [1]),
+    "random_read":  ("random",     "read",  [1]),
+    "random_write": ("random",     "write", [1]),
+    "random_mixed": ("random",     "mixed", [1]),
+    "burst_mixed":  ("random",     "mixed", [1, 2, 4, 8, 16, 32, 64]),
+    "hot_read":     ("hot",        "read",  [1]),
+    "hot_mixed":    ("hot",        "mixed", [1]),
+}
+
+# Words covered by the "hot" pattern, a small structure accessed repeatedly
+hot_words = 256
+
+def generate_ops(workload, count, nwords, seed=42):
+    pattern, direction, lengths = workloads[workload]
+    rng = random.Random("{}-{}".format(seed, workload))
+    ops = []
+    addr = 0
+    for i in range(count):
+        length = rng.choice(lengths)
+        we = {"read": 0, "write": 1, "mixed": rng.randrange(2)}[direction]
+        if pattern == "random":
+            addr = rng.randrange(nwords - length)
+        elif pattern == "hot":
+            addr = rng.randrange(hot_words - length)
+        elif addr + length > nwords:
+            addr = 0
+        ops.append((we, addr, length))
+        addr += length
+    return ops
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# Bench design -------------------------------------------------------------------------------------
+
+class BenchDesign(Module):
+    def __init__(self, module, double_rate, sys_clk_freq, frontend, coalesce=False,
+                 write_combine=False, **kwargs):
+        self.clock_domains.cd_sys = ClockDomain("sys")
+
+        phy_cls = HyperRAMPHYModel2x if double_rate else HyperRAMPHYModel
+        self.submodules.phy = phy_cls(module, sys_clk_freq)
+        self.submodules.core = LiteHyperRAMCore(self.phy, module, sys_clk_freq, **kwargs)
+        if coalesce or write_combine:
+            self.port = self.core.new_port(coalesce=coalesce, write_combine=write_combine)
+        else:
+            self.port = self.core.get_port()
+        if frontend == "wishbone":
+            self.bus = wishbone.Interface(data_width=32)
+            self.submodules.wishbone = LiteHyperRAMWishbone2Native(self.bus, self.port)
+        elif frontend == "pipelined":
+            self.bus = wishbone.Interface(data_width=32)
+            self.bus.stall = Signal()
+            self.submodules.wishbone = LiteHyperRAMPipelinedWishbone2Native(
+                self.bus, self.port, max_burst=self.core.controller.max_burst)
+        elif frontend == "cached":
+            self.bus = wishbone.Interface(data_width=32)
+            self.submodules.wishbone = LiteHyperRAMCachedWishbone2Native(self.bus, self.port)
+        elif frontend == "axi":
+            self.bus = AXIInterface(data_width=32, address_width=32)
+            self.submodules.axi = LiteHyperRAMAXI2Native(self.bus, self.port)
+
+# Testbenches --------------------------------------------------------------------------------------
+
+class Measurement:
+    def __init__(self):
+        self.cycle = 0
+        self.start = None
+        self.end = None
+        self.latencies = []
+        self.bytes = 0
+        self.data_errors = 0
+        self.expected = {}
+
+    def check(self, addr, data):
+        if self.expected.get(addr, data) != data:
+            self.data_errors += 1
+
+    def clock(self):
+        self.cycle += 1
+        return None
+
+def native_generator(dut, ops, m):
+    port = dut.port
+    dw = port.data_width
+    rng = random.Random(dw)
+    while not (yield dut.core.register_space.setup_done):
+        yield m.clock()
+    m.start = m.cycle
+    m.stats = dict(dut.phy.device.stats)
+    yield port.rdata.ready.eq(1)
+    yield port.wdata.valid.eq(1)
+    yield port.wdata.we.eq(2**(dw//8) - 1)
+    for we, addr, length in ops:
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(we)
+        yield port.cmd.burst_type.eq(1)
+        yield port.cmd.addr.eq(addr)
+        yield port.cmd.length.eq(length if length < 2**port.length_width else 0)
+        yield port.wdata.data.eq(rng.getrandbits(dw))
+        yield port.wdata.last.eq(length == 1)
+        yield port.rdata.last.eq(length == 1)
+        yield m.clock()
+        while not (yield port.cmd.ready):
+            yield m.clock()
+        issued = m.cycle - 1
+        yield port.cmd.valid.eq(0)
+        done = 0
+        while done < length:
+            yield m.clock()
+            if (yield port.wdata.ready if we else port.rdata.valid):
+                if done == 0:
+                    m.latencies.append(m.cycle - 1 - issued)
+                if we:
+                    m.expected[addr + done] = (yield port.wdata.data)
+                else:
+                    m.check(addr + done, (yield port.rdata.data))
+                done += 1
+                yield port.wdata.data.eq(rng.getrandbits(dw))
+                yield port.wdata.last.eq(done == length - 1)
+                yield port.rdata.last.eq(done == length - 1)
+        m.bytes += length * dw // 8
+    m.end = m.cycle
+
+def wishbone_generator(dut, ops, m):
+    bus = dut.bus
+    ratio = len(bus.dat_w) // dut.port.data_width
+    rng = random.Random(len(bus.dat_w))
+    while not (yield dut.core.register_space.setup_done):
+        yield m.clock()
+    m.start = m.cycle
+    m.stats = dict(dut.phy.device.stats)
+    yield bus.sel.eq(2**len(bus.sel) - 1)
+    for we, addr, length in ops:
+        # Lengths are in native words, round up to bus words
+        addr //= ratio
+        length = (length + ratio - 1) // ratio
+        issued = m.cycle
+        for i in range(length):
+            yield bus.cyc.eq(1)
+            yield bus.stb.eq(1)
+            yield bus.we.eq(we)
+            yield bus.adr.eq(addr + i)
+            yield bus.dat_w.eq(rng.getrandbits(len(bus.dat_w)))
+            yield bus.cti.eq(0b010 if i < length - 1 else 0b111)
+            yield m.clock()
+            while not (yield bus.ack):
+                yield m.clock()
+            if we:
+                m.expected[addr + i] = (yield bus.dat_w)
+            else:
+                m.check(addr + i, (yield bus.dat_r))
+            if i == 0:
+                m.latencies.append(m.cycle - 1 - issued)
+        yield bus.cyc.eq(0)
+        yield bus.stb.eq(0)
+        yield m.clock()
+        m.bytes += length * len(bus.dat_w) // 8
+    m.end = m.cycle
+
+def pipelined_wishbone_generator(dut, ops, m):
+    bus = dut.bus
+    ratio = len(bus.dat_w) // dut.port.data_width
+    rng = random.Random(len(bus.dat_w))
+    # Requests are issued without waiting for acks, acks are matched to
+    # requests in order
+    requests = []
+    for we, addr, length in ops:
+        addr //= ratio
+        length = (length + ratio - 1) // ratio
+        for i in range(length):
+            requests.append((we, addr + i, rng.getrandbits(len(bus.dat_w)), i == 0))
+        m.bytes += length * len(bus.dat_w) // 8
+    while not (yield dut.core.register_space.setup_done):
+        yield m.clock()
+    m.start = m.cycle
+    m.stats = dict(dut.phy.device.stats)
+    yield bus.sel.eq(2**len(bus.sel) - 1)
+    yield bus.cyc.eq(1)
+    pending = []
+    issued = 0
+    while issued < len(requests) or pending:
+        if issued < len(requests):
+            we, addr, data, first = requests[issued]
+            yield bus.stb.eq(1)
+            yield bus.we.eq(we)
+            yield bus.adr.eq(addr)
+            yield bus.dat_w.eq(data)
+        else:
+            yield bus.stb.eq(0)
+        yield m.clock()
+        if issued < len(requests) and not (yield bus.stall):
+            pending.append(requests[issued] + (m.cycle - 1,))
+            issued += 1
+        if (yield bus.ack):
+            we, addr, data, first, start = pending.pop(0)
+            if we:
+                m.expected[addr] = data
+            else:
+                m.check(addr, (yield bus.dat_r))
+            if first:
+                m.latencies.append(m.cycle - 1 - start)
+    yield bus.cyc.eq(0)
+    yield bus.stb.eq(0)
+    m.end = m.cycle
+
+def axi_generator(dut, ops, m):
+    bus = dut.bus
+    ratio = len(bus.w.data) // dut.port.data_width
+    rng = random.Random(len(bus.w.data))
+    while not (yield dut.core.register_space.setup_done):
+        yield m.clock()
+    m.start = m.cycle
+    m.stats = dict(dut.phy.device.stats)
+    yield bus.w.strb.eq(2**len(bus.w.strb) - 1)
+    yield bus.b.ready.eq(1)
+    yield bus.r.ready.eq(1)
+    # Bursts are issued one at a time, waiting for the write response
+    for we, addr, length in ops:
+        addr //= ratio
+        length = (length + ratio - 1) // ratio
+        ax = bus.aw if we else bus.ar
+        yield ax.valid.eq(1)
+        yield ax.addr.eq(addr * len(bus.w.data) // 8)
+        yield ax.len.eq(length - 1)
+        yield ax.burst.eq(0b01)
+        yield ax.size.eq(log2_int(len(bus.w.data) // 8))
+        issued = m.cycle
+        done = 0
+        while True:
+            if we and done < length:
+                data = rng.getrandbits(len(bus.w.data))
+                yield bus.w.valid.eq(1)
+                yield bus.w.data.eq(data)
+                yield bus.w.last.eq(done == length - 1)
+            yield m.clock()
+            if (yield ax.ready):
+                yield ax.valid.eq(0)
+            if we:
+                if done < length and (yield bus.w.ready):
+                    m.expected[addr + done] = data
+                    done += 1
+                    if done == length:
+                        yield bus.w.valid.eq(0)
+                # Write data is buffered, so measure up to the response
+                if (yield bus.b.valid):
+                    m.latencies.append(m.cycle - 1 - issued)
+                    break
+            elif (yield bus.r.valid):
+                if done == 0:
+                    m.latencies.append(m.cycle - 1 - issued)
+                m.check(addr + done, (yield bus.r.data))
+                done += 1
+                if done == length:
+                    break
+        m.bytes += length * len(bus.w.data) // 8
+    m.end = m.cycle
+
+generators = {
+    "native":    native_generator,
+    "wishbone":  wishbone_generator,
+    "pipelined": pipelined_wishbone_generator,
+    "cached":    wishbone_generator,
+    "axi":       axi_generator,
+}
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def run_benchmark(module_cls, double_rate, frontend, workload, count,
+                  sys_clk_freq=None, initial_latency=None, coalesce=False,
+                  write_combine=False):
+    module = module_cls()
+    if sys_clk_freq is None:
+        sys_clk_freq = (module.maxclock // 2 if double_rate else
+                        min(module.maxclock, 100000000))
+    ck_freq = 2 * sys_clk_freq if double_rate else sys_clk_freq
+    dut = BenchDesign(module, double_rate, sys_clk_freq, frontend, coalesce,
+                      write_combine, initial_latency=initial_latency)
+    nwords = 2**dut.port.address_width
+    ops = generate_ops(workload, count, nwords)
+    m = Measurement()
+    run_simulation(dut, [generators[frontend](dut, ops, m), dut.phy.generator()])
+
+    device = dut.phy.device
+    beats = device.stats["beats"] - m.stats["beats"]
+    data = device.stats["data"] - m.stats["data"]
+    cycles = m.end - m.start
+    cycle_ns = 1e9 / sys_clk_freq
+    return {
+        "module":          module_cls.__name__,
+        "phy":             "2x" if double_rate else "1x",
+        "frontend":        frontend,
+        "workload":        workload,
+        "sys_clk_freq":    sys_clk_freq,
+        "ck_freq":         ck_freq,
+        "initial_latency": dut.core.controller.initial_latency,
+        "fixed_latency":   dut.core.controller.fixed_latency,
+        "coalesce":        coalesce,
+        "write_combine":   write_combine,
+        "transactions":    len(ops),
+        "bytes":           m.bytes,
+        "cycles":          cycles,
+        "bandwidth_mbps":  round(m.bytes / (cycles * cycle_ns * 1e-9) / 1e6, 3),
+        "latency_avg_ns":  round(sum(m.latencies) / len(m.latencies) * cycle_ns, 3),
+        "latency_p99_ns":  round(percentile(m.latencies, 99) * cycle_ns, 3),
+        "bus_utilization": round(data / beats, 4),
+        "protocol_errors": len(device.errors),
+        "data_errors":     m.data_errors,
+    }
+
+def module_classes():
+    # Aliases (subclasses defining nothing of their own) are skipped
+    return [cls for name, cls in inspect.getmembers(modules, inspect.isclass)
+            if issubclass(cls, modules.HyperRAMModule) and "maxclock" in vars(cls)]
+
+def result_key(result):
+    return (result["module"], result["phy"], result["frontend"], result["workload"])
+
+def compare(old, new):
+    old = { result_key(r): r for r in old["results"] }
+    print("{:<14} {:<3} {:<9} {:<13} {:>10} {:>9} {:>10} {:>9}".format(
+        "module", "phy", "frontend", "workload", "MB/s", "delta", "avg ns", "delta"))
+    for r in new["results"]:
+        o = old.get(result_key(r))
+        delta = lambda field: ("{:+.1f}%".format(100 * (r[field] / o[field] - 1))
+                               if o and o[field] else "n/a")
+        print("{:<14} {:<3} {:<9} {:<13} {:>10.2f} {:>9} {:>10.1f} {:>9}".format(
+            *result_key(r), r["bandwidth_mbps"], delta("bandwidth_mbps"),
+            r["latency_avg_ns"], delta("latency_avg_ns")))
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    module_names = [cls.__name__ for cls in module_classes()]
+    parser = argparse.ArgumentParser(description="LiteHyperRAM simulation benchmark")
+    parser.add_argument("--module",   action="append", choices=module_names,
+                        help="Module(s) to benchmark (default: all)")
+    parser.add_argument("--phy",      action="append", choices=["1x", "2x"],
+                        help="PHY mode(s) to benchmark (default: both)")
+    parser.add_argument("--frontend", action="append", choices=list(generators),
+                        help="Frontend(s) to benchmark (default: all)")
+    parser.add_argument("--workload", action="append", choices=list(workloads),
+                        help="Workload(s) to run (default: all)")
+    parser.add_argument("--count",    type=int, default=32,
+                        help="Number of transactions per workload")
+    parser.add_argument("--sys-clk-freq",    type=int, help="System clock frequency")
+    parser.add_argument("--initial-latency", type=int, help="Controller initial latency")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Coalesce sequential commands on the benchmarked port")
+    parser.add_argument("--write-combine", action="store_true",
+                        help="Combine writes on the benchmarked port")
+    parser.add_argument("--output",   help="Write JSON results to file instead of stdout")
+    parser.add_argument("--compare",  help="Compare results with a previous JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for module_cls in module_classes():
+        if args.module and module_cls.__name__ not in args.module:
+            continue
+        for phy in args.phy or ["1x", "2x"]:
+            for frontend in args.frontend or list(generators):
+                for workload in args.workload or list(workloads):
+                    result = run_benchmark(module_cls, phy == "2x", frontend, workload,
+                                           args.count, args.sys_clk_freq,
+                                           args.initial_latency, args.coalesce,
+                                           args.write_combine)
+                    print("{} {} {} {}: {:.2f} MB/s".format(
+                        *result_key(result), result["bandwidth_mbps"]), file=sys.stderr)
+                    results.append(result)
+
+    report = { "version": 1, "revision": git_revision(), "count": args.count,
+               "results": results }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,13 @@ from migen import *
 
 from litex.soc.interconnect import stream
 
-def cmd_description(address_width):
+def cmd_description(address_width, length_width):
     return [
         ("we",         1),
         ("aspace",     1),
         ("burst_type", 1),
-        ("addr",       address_width)
+        ("addr",       address_width),
+        ("length",     length_width)
     ]
 
 def wdata_description(data_width):
@@ -23,13 +24,15 @@ def rdata_description(data_width):
     return [("data", data_width)]
 
 class LiteHyperRAMNativePort:
-    def __init__(self, address_width, data_width=16):
-        self.cmd   = stream.Endpoint(cmd_description(address_width))
+    def __init__(self, address_width, data_width=16, length_width=8):
+        self.cmd   = stream.Endpoint(cmd_description(address_width, length_width))
         self.wdata = stream.Endpoint(wdata_description(data_width))
         self.rdata = stream.Endpoint(rdata_description(data_width))
         self.address_width = address_width
         self.data_width = data_width
+        self.length_width = length_width
 
     @staticmethod
     def like(other):
-        return LiteHyperRAMNativePort(other.address_width, other.data_width)
+        return LiteHyperRAMNativePort(other.address_width, other.data_width,
+                                      other.length_width)
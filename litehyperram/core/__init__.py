@@ -4,33 +4,114 @@ from litehyperram.common import LiteHyperRAMNativePort
 from litehyperram.core.controller import LiteHyperRAMController
 from litehyperram.core.registerspace import LiteHyperRAMRegisterSpace
 from litehyperram.core.crossbar import LiteHyperRAMCrossbar
+from litehyperram.core.coalescer import LiteHyperRAMCoalescer
+from litehyperram.core.writecombiner import LiteHyperRAMWriteCombiner
+from litehyperram.core.elastic import LiteHyperRAMElasticBuffer
+from litehyperram.core.interleaver import LiteHyperRAMInterleaver
+from litehyperram.core.stats import LiteHyperRAMStatistics
+from litehyperram.core.training import LiteHyperRAMReadTraining
 from litex.soc.interconnect.csr import AutoCSR
 
 class LiteHyperRAMCore(Module, AutoCSR):
-    def __init__(self, phy, module, clk_freq, **kwargs):
+    def __init__(self, phy, module, clk_freq, arbitration="round-robin", burst_length=32,
+                 with_stats=False, with_training=False, **kwargs):
+        if burst_length not in module.burst_lengths:
+            raise ValueError("Burst length not supported by module")
         self.submodules.controller = LiteHyperRAMController(
             phy = phy, module = module, clk_freq = clk_freq, **kwargs)
-        data_port = LiteHyperRAMNativePort.like(self.controller.port)
         reg_port = LiteHyperRAMNativePort.like(self.controller.port)
+        # Wrap size in bytes of wrapped bursts, set in CR0, and in port
+        # words (which span all ganged devices)
+        self.burst_length = burst_length
+        self.wrap_words = burst_length * self.controller.nchips // (reg_port.data_width // 8)
         self.submodules.register_space = LiteHyperRAMRegisterSpace(
             initial_latency = self.controller.initial_latency,
             fixed_latency = self.controller.fixed_latency,
-            nbanks = module.nbanks, port = reg_port)
+            nbanks = module.nbanks, port = reg_port,
+            burst_length = burst_length,
+            max_latency = self.controller.max_latency,
+            variable_latency = self.controller.variable_latency,
+            min_variable_latency = self.controller.min_variable_latency)
+        if self.controller.dynamic_latency:
+            self.comb += [
+                self.controller.latency.eq(self.register_space.latency),
+                self.controller.fixed.eq(self.register_space.fixed_latency)
+            ]
         self.submodules.crossbar = LiteHyperRAMCrossbar(
-            self.controller.port, data_port, reg_port)
+            self.controller.port, reg_port, arbitration)
         self.comb += self.crossbar.lockout.eq(~self.register_space.setup_done)
-        if data_port.data_width == 32:
-            self.data_port = LiteHyperRAMNativePort(data_port.address_width-1,
-                                                    data_port.data_width)
+        if with_stats:
+            self.submodules.stats = LiteHyperRAMStatistics(self.controller, self.crossbar)
+        self._write_combiners = 0
+        self.data_port = self.new_port()
+        if with_training:
+            self.submodules.training = LiteHyperRAMReadTraining(self.new_port(), phy)
+            self.comb += self.training.timeout.eq(self.controller.read_timeout)
+
+    def get_port(self):
+        return self.data_port
+
+    def new_port(self, weight=1, coalesce=False, window=4, write_combine=False,
+                 block_words=16, timeout=64, elastic=False, depth=None):
+        port = self.crossbar.get_port(weight)
+        if self.controller.ratio > 1:
+            # Controller addresses count 16-bit words
+            shift = log2_int(self.controller.ratio)
+            data_port = port
+            port = LiteHyperRAMNativePort(data_port.address_width-shift,
+                                          data_port.data_width,
+                                          data_port.length_width)
             self.comb += [
-               self.data_port.cmd.connect(data_port.cmd, omit=["addr"]),
-               data_port.cmd.addr.eq(Cat(C(0, 1), self.data_port.cmd.addr)),
-               self.data_port.wdata.connect(data_port.wdata),
-               data_port.rdata.connect(self.data_port.rdata, omit=["last"]),
-               data_port.rdata.last.eq(self.data_port.rdata.last)
+               port.cmd.connect(data_port.cmd, omit=["addr"]),
+               data_port.cmd.addr.eq(Cat(C(0, shift), port.cmd.addr)),
+               port.wdata.connect(data_port.wdata),
+               data_port.rdata.connect(port.rdata, omit=["last"]),
+               data_port.rdata.last.eq(port.rdata.last)
             ]
-        else:
-            self.data_port = data_port
+        if coalesce:
+            coalescer = LiteHyperRAMCoalescer(port, self.controller.max_burst, window)
+            self.submodules += coalescer
+            port = coalescer.port
+        if write_combine:
+            combiner = LiteHyperRAMWriteCombiner(port, block_words, timeout)
+            # Named, so that its CSRs are collected
+            setattr(self.submodules, "write_combiner{}".format(self._write_combiners),
+                    combiner)
+            self._write_combiners += 1
+            port = combiner.port
+        if elastic:
+            # Room for a burst to continue while the next one is started
+            if depth is None:
+                depth = 2 * self.controller.access_latency
+            buffer = LiteHyperRAMElasticBuffer(port, depth, self.controller.max_burst,
+                                               self.wrap_words)
+            self.submodules += buffer
+            port = buffer.port
+        return port
+
+# One core per PHY (HyperRAM device on its own bus), with the address space
+# interleaved over the devices in granules of granularity words, by default
+# the wrapped burst length.  Ports are elastic, see LiteHyperRAMInterleaver.
+class LiteHyperRAMMultiCore(Module, AutoCSR):
+    def __init__(self, phys, module, clk_freq, granularity=None, burst_length=32, **kwargs):
+        self.cores = []
+        for i, phy in enumerate(phys):
+            core = LiteHyperRAMCore(phy, module, clk_freq, burst_length=burst_length, **kwargs)
+            # Named, so that its CSRs are collected
+            setattr(self.submodules, "core{}".format(i), core)
+            self.cores.append(core)
+        self.granularity = granularity
+        self.data_port = None
 
     def get_port(self):
+        if self.data_port is None:
+            self.data_port = self.new_port()
         return self.data_port
+
+    def new_port(self, weight=1, depth=None):
+        ports = [core.new_port(weight, elastic=True, depth=depth) for core in self.cores]
+        wrap_words = self.cores[0].wrap_words
+        granularity = wrap_words if self.granularity is None else self.granularity
+        interleaver = LiteHyperRAMInterleaver(ports, granularity, wrap_words)
+        self.submodules += interleaver
+        return interleaver.port
@@ -0,0 +1,147 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from migen.genlib.fifo import SyncFIFO
+
+from litehyperram.common import LiteHyperRAMNativePort
+
+# The coalescer sits between a user port and a crossbar port, and turns
+# commands continuing the current linear burst into an extension of that
+# burst instead of a new HyperBus transaction.  Commands are merged when
+# they are memory accesses with a linear burst, the same direction, a
+# non-zero length, start at the address following the last word of the
+# open burst and fit within max_burst words (which should keep CS# low for
+# less than tCSM).
+#
+# Writes are merged when the next command is valid in the cycle the last
+# word of the previous command is accepted.  The first word of the merged
+# command must then be provided in the next cycle, as for any other word
+# of a burst.
+#
+# Reads are kept open for up to window words after the last word of a
+# command, to give the client time to issue the next one.  These words
+# are stored in a FIFO, and are delivered to the next command if it is
+# merged, or dropped otherwise.  A command that can not be merged closes
+# the burst immediately.  As the FIFO can not be drained faster than it is
+# filled, each wait adds to the delay of the rest of the burst, and the
+# burst is closed once the window is used up in total.
+#
+# Coalesced bursts are sent to the controller with length 0 and ended
+# using last.
+
+class LiteHyperRAMCoalescer(Module):
+    def __init__(self, port, max_burst, window=4):
+        if max_burst < 1:
+            raise ValueError("Invalid maximum burst length")
+        if window < 0:
+            raise ValueError("Invalid window")
+
+        self.port = user = LiteHyperRAMNativePort.like(port)
+
+        dw = port.data_width
+
+        we = Signal()
+        solo = Signal()
+        addr = Signal(port.address_width)
+        remaining = Signal(port.length_width)
+        used = Signal(max=max_burst+1)
+        arrived = Signal(max=max_burst+1)
+        active = Signal()
+        closed = Signal()
+
+        mergeable = Signal()
+        self.comb += mergeable.eq(
+            ~user.cmd.aspace & user.cmd.burst_type & (user.cmd.length != 0))
+
+        # Read data of the open burst beyond the current command.  Words
+        # stored while waiting for the next command delay all following
+        # words of the burst, so up to window words are held, plus one
+        # passing through.
+        self.submodules.fifo = fifo = ResetInserter()(SyncFIFO(dw, max(window + 1, 2)))
+        live = port.rdata.valid
+        deliver = user.rdata.valid
+        end = Signal()
+        match = Signal()
+        merge = Signal()
+        active_next = Signal()
+        level_next = Signal(max=window+2)
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+
+        fsm.act("IDLE",
+                user.cmd.connect(port.cmd, omit={"length"}),
+                port.cmd.length.eq(Mux(mergeable, 0, user.cmd.length)),
+                If(user.cmd.valid & user.cmd.ready,
+                   NextValue(we, user.cmd.we),
+                   NextValue(solo, ~mergeable),
+                   NextValue(addr, user.cmd.addr),
+                   NextValue(remaining, user.cmd.length),
+                   NextValue(used, 0),
+                   NextValue(arrived, 0),
+                   NextValue(active, 1),
+                   NextValue(closed, 0),
+                   If(user.cmd.we,
+                      NextState("WRITE")
+                   ).Else(
+                      NextState("READ")
+                   )))
+
+        fsm.act("WRITE",
+                user.wdata.connect(port.wdata, omit={"last"}),
+                end.eq(Mux(remaining == 0, user.wdata.last, remaining == 1)),
+                match.eq(~solo & user.cmd.valid & user.cmd.we & mergeable &
+                         (user.cmd.addr == addr + 1) &
+                         (used + 1 + user.cmd.length <= max_burst)),
+                merge.eq(port.wdata.ready & end & match),
+                port.wdata.last.eq(end & ~match),
+                user.cmd.ready.eq(merge),
+                If(port.wdata.ready,
+                   NextValue(addr, addr + 1),
+                   If(used != max_burst, NextValue(used, used + 1)),
+                   If(remaining != 0, NextValue(remaining, remaining - 1)),
+                   If(merge,
+                      NextValue(remaining, user.cmd.length)
+                   ).Elif(end,
+                      NextState("IDLE"))))
+
+        fsm.act("READ",
+                # Deliver from the FIFO if it holds data, so that words stay
+                # in order, and pass live data through otherwise
+                If(fifo.readable,
+                   user.rdata.valid.eq(active),
+                   user.rdata.data.eq(fifo.dout),
+                   fifo.re.eq(active)
+                ).Else(
+                   user.rdata.valid.eq(active & live),
+                   user.rdata.data.eq(port.rdata.data)
+                ),
+                fifo.din.eq(port.rdata.data),
+                fifo.we.eq(live & (fifo.readable | ~active)),
+                end.eq(deliver & Mux(remaining == 0, user.rdata.last, remaining == 1)),
+                match.eq(~closed & ~solo & user.cmd.valid & ~user.cmd.we & mergeable &
+                         (user.cmd.addr == addr + deliver) &
+                         (used + deliver + user.cmd.length <= max_burst) &
+                         (level_next <= window)),
+                merge.eq(match & (~active | end)),
+                user.cmd.ready.eq(merge),
+                active_next.eq((active & ~end) | merge),
+                level_next.eq(fifo.level + fifo.we - fifo.re),
+                # End the burst once the window is used up, the burst is as
+                # long as allowed, or a command that can not be merged waits
+                port.rdata.last.eq(live & ~closed & ~active_next &
+                                   (solo | (level_next >= window) |
+                                    (arrived + 1 >= max_burst) | user.cmd.valid)),
+                If(live,
+                   If(arrived != max_burst, NextValue(arrived, arrived + 1)),
+                   If(port.rdata.last, NextValue(closed, 1))),
+                If(deliver,
+                   NextValue(addr, addr + 1),
+                   If(used != max_burst, NextValue(used, used + 1)),
+                   If(remaining != 0, NextValue(remaining, remaining - 1))),
+                If(merge, NextValue(remaining, user.cmd.length)),
+                NextValue(active, active_next),
+                If((closed | (live & port.rdata.last)) & ~active_next,
+                   fifo.reset.eq(1),
+                   NextState("IDLE")))
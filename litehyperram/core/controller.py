@@ -1,6 +1,8 @@
 # This file is Copyright (c) 2021 Marcus Comstedt <marcus@mc.pp.se>
 # License: BSD
 
+from math import ceil
+
 from migen import *
 
 from migen.fhdl.decorators import CEInserter, ResetInserter
@@ -11,15 +13,34 @@ from litehyperram.common import LiteHyperRAMNativePort
 
 class LiteHyperRAMController(Module):
 
-    def __init__(self, phy, module, clk_freq, initial_latency=None, fixed_latency=None):
+    def __init__(self, phy, module, clk_freq, initial_latency=None, fixed_latency=None,
+                 length_width=8, pipelined=True, split_bursts=True, power_up_delay=False,
+                 dynamic_latency=False):
 
-        dw = 32 if hasattr(phy, "dq_dd") else 16
+        # The PHY clocks out ratio CK cycles (two beats each, dq_da first)
+        # per sys cycle.  Ganged devices share CK and CS#, each has its own
+        # DQ/RWDS lane of lane_dw bits per cycle.
+        nbeats = len([b for b in "abcdefgh" if hasattr(phy, "dq_d" + b)])
+        ratio = nbeats // 2
+        if ratio not in (1, 2, 4):
+            raise ValueError("Unsupported PHY ratio")
+        double_rate = ratio == 2
+        quad_rate = ratio == 4
+        nchips = len(phy.rwds_da)
+        lane_dw = 16 * ratio
+        dw = lane_dw * nchips
 
-        out_clk_freq = 2*clk_freq if dw == 32 else clk_freq
+        out_clk_freq = ratio * clk_freq
         if out_clk_freq > module.maxclock:
             raise ValueError("Clock exceeds module max")
 
-        reset_delay = clk_freq // 5000000 + 1
+        cycles = lambda t: ceil(round(t * clk_freq, 6))
+
+        # RESET# is held low for tRP, or tVCS when the device is powered
+        # up together with the FPGA, and CS# kept high for tRPH after it
+        reset_delay = max(1, cycles(module.tVCS if power_up_delay else module.tRP))
+        reset_high = max(1, cycles(module.tRPH))
+
         min_initial_latency = module.min_initial_latency(out_clk_freq)
         if initial_latency is None:
             initial_latency = min_initial_latency
@@ -29,28 +50,105 @@ class LiteHyperRAMController(Module):
             raise ValueError("Too low initial latency for this frequency")
 
         dual_die = module.nbanks > 1
+        ganged = nchips > 1
+        # PHYs capturing read data on RWDS edges (ECP5HYPERRAMPHYDQS) do
+        # not see the latency indicated on RWDS during CA
+        strobed_rx = getattr(phy, "strobed_rx", False)
+        # In 2X mode the latency indicated on RWDS during CA is known in
+        # time for write data only from an initial latency of 4, in 4X mode
+        # not at all
+        min_variable_latency = 4 if double_rate else 3
         if fixed_latency is None:
-            fixed_latency = dw == 32 or dual_die
+            fixed_latency = (dual_die or ganged or strobed_rx or quad_rate or
+                             initial_latency < min_variable_latency)
         if dual_die and not fixed_latency:
             raise ValueError("Must use fixed latency for dual die module")
-        if dw == 32 and not fixed_latency:
-            raise ValueError("Must use fixed latency for 32-bit mode")
+        if ganged and not fixed_latency:
+            raise ValueError("Must use fixed latency for ganged devices")
+        if strobed_rx and not fixed_latency:
+            raise ValueError("Must use fixed latency with strobed read capture")
+        if quad_rate and not fixed_latency:
+            raise ValueError("Must use fixed latency in 4X mode")
+        if not fixed_latency and initial_latency < min_variable_latency:
+            raise ValueError("Too low initial latency for variable latency")
 
         self.initial_latency = initial_latency
         self.fixed_latency = fixed_latency
+        self.pipelined = pipelined
+        self.split_bursts = split_bursts
+        self.dynamic_latency = dynamic_latency
+        self.double_rate = double_rate
+        self.ratio = ratio
+        self.nchips = nchips
+        # Latency modes the device may be switched to at runtime
+        self.variable_latency = not (dual_die or ganged or strobed_rx or quad_rate)
+        self.min_variable_latency = min_variable_latency
+
+        # With dynamic_latency, the initial latency and fixed latency mode
+        # follow the latency and fixed inputs, which must change together
+        # with CR0 (see LiteHyperRAMRegisterSpace).  Timings which depend
+        # on the latency are then computed for max_latency.
+        if dynamic_latency:
+            max_latency = module.max_initial_latency
+            self.latency = latency = Signal(max=max_latency+1, reset=initial_latency)
+            self.fixed = fixed = Signal(reset=fixed_latency)
+            double_latency = lambda rwds: fixed | rwds
+            half_latency = latency[1:]
+            odd_latency = latency[0]
+        else:
+            max_latency = latency = initial_latency
+            double_latency = lambda rwds: 1 if fixed_latency else rwds
+            half_latency = initial_latency // 2
+            odd_latency = initial_latency % 2
+        self.max_latency = max_latency
+
+        # Longest burst (in words) which keeps CS# low for less than tCSM,
+        # allowing for CA, double initial latency and the PHY round trip.
+        # The 8 cycles cover the three CA words and SELECT_OP at 1X (fewer
+        # at 2X and 4X), stopping CK after the last word and a margin for
+        # tCSH and rounding.  tx_latency is counted twice, as CK lags CS#
+        # through the PHY at the start, and cs_hold waits for the PHY to
+        # clock out the last edge before raising CS# at the end.
+        self.max_burst = (int(module.tCSM * clk_freq) - 8 - 2 * max_latency -
+                          2 * phy.tx_latency - phy.rx_latency)
+        if split_bursts and self.max_burst < 1:
+            raise ValueError("Clock too slow to split bursts within tCSM")
+
+        # Cycles from accepting a command to its first data word at most,
+        # with double initial latency
+        self.access_latency = ({1: 5 + 2 * max_latency,
+                                2: 3 + max_latency,
+                                4: 3 + max_latency // 2}[ratio] +
+                               phy.tx_latency + phy.rx_latency)
+
+        # Minimum number of cycles CS# is kept high between transactions.
+        # tRWR is counted from CS# going high to the end of the next
+        # command-address, which comes tx_latency cycles plus 2 CA beats
+        # after CS# goes low again.
+        ca_cycles = {1: 2, 2: 1, 4: 0}[ratio]
+        cs_high = max(2 if not pipelined else 1,
+                      cycles(module.tCSHI),
+                      cycles(module.tRWR) - phy.tx_latency - ca_cycles)
+
+        # CK lags CS# by tx_latency cycles through the PHY, which must
+        # cover tCSS.  After CK is stopped, CS# is raised once the PHY has
+        # clocked out the last edge, plus tCSH.
+        if cycles(module.tCSS) > phy.tx_latency:
+            raise ValueError("PHY latency too low for tCSS")
+        cs_hold = phy.tx_latency + max(0, cycles(module.tCSH) - 1)
 
         ram_reset_b = Signal(reset=0)
         self.comb += phy.reset_n.eq(ram_reset_b)
 
-        dlycnt = Signal(max=max(reset_delay, phy.tx_latency + phy.rx_latency +
-                                2 * initial_latency),
+        dlycnt = Signal(max=max(reset_delay, reset_high, phy.tx_latency + phy.rx_latency +
+                                2 * max_latency, cs_high, cs_hold),
                         reset=reset_delay, reset_less=True)
         self.sync += If(ResetSignal(),
                         dlycnt.eq(reset_delay)
                      ).Elif(dlycnt != 0,
                         dlycnt.eq(dlycnt-1)
                      ).Elif(~ram_reset_b,
-                        dlycnt.eq(reset_delay),
+                        dlycnt.eq(reset_high),
                         If(phy.pll_locked, ram_reset_b.eq(1)))
 
         ck = Signal(reset=0)
@@ -64,66 +162,168 @@ class LiteHyperRAMController(Module):
                      ]
         self.specials += MultiReg(rwds_oe, phy.rwds_oe, n=phy.tx_latency+1)
         self.specials += MultiReg(dq_oe,   phy.dq_oe,   n=phy.tx_latency)
-        if dw == 32:
-            self.comb += [
-                phy.rwds_da.eq(rwds_out[3]),
-                phy.rwds_db.eq(rwds_out[2]),
-                phy.rwds_dc.eq(rwds_out[1]),
-                phy.rwds_dd.eq(rwds_out[0]),
-                phy.dq_da.eq(dq_out[24:32]),
-                phy.dq_db.eq(dq_out[16:24]),
-                phy.dq_dc.eq(dq_out[8:16]),
-                phy.dq_dd.eq(dq_out[0:8])
+        # PHY signals in order of increasing significance within a lane
+        beats = "abcdefgh"[nbeats-1::-1]
+        rwds_d = [getattr(phy, "rwds_d" + b) for b in beats]
+        rwds_q = [getattr(phy, "rwds_q" + b) for b in beats]
+        dq_d = [getattr(phy, "dq_d" + b) for b in beats]
+        dq_q = [getattr(phy, "dq_q" + b) for b in beats]
+        nbytes = lane_dw//8
+        for c in range(nchips):
+            for i in range(nbytes):
+                self.comb += [
+                    rwds_d[i][c].eq(rwds_out[c*nbytes + i]),
+                    dq_d[i][8*c:8*c+8].eq(dq_out[8*(c*nbytes + i):8*(c*nbytes + i + 1)])
+                ]
+        dq_in = Cat(*[dq[8*c:8*c+8] for c in range(nchips) for dq in dq_q])
+        # RWDS of ganged devices is merged: double latency is indicated by
+        # any of them, and read data is valid when all strobe it
+        rwds_in = [Signal() for _ in rwds_q]
+        rwds_strobe = Signal()
+        self.comb += [rwds_in[i].eq(rwds != 0) for i, rwds in enumerate(rwds_q)]
+
+        # Words of n bits per lane made of the last half of prev (first on
+        # the bus) and the first half of new
+        def shift_half(new, prev, n):
+            return Cat(*[Cat(new[c*n + n//2:(c + 1)*n], prev[c*n//2:(c + 1)*n//2])
+                         for c in range(nchips)])
+
+        def last_half(v, n):
+            return Cat(*[v[c*n:c*n + n//2] for c in range(nchips)])
+
+        # In 4X mode, read data with an odd and write data with an even
+        # initial latency starts with the third CK cycle of a sys cycle:
+        # read words are then put together from two cycles, and write words
+        # shifted by half a word
+        if quad_rate:
+            rshift = odd_latency
+            wshift = ~odd_latency if dynamic_latency else 1 - odd_latency
+            rprev_data = Signal(dw//2)
+            rprev_strobe = Signal()
+            self.sync += [
+                rprev_data.eq(last_half(dq_in, lane_dw)),
+                rprev_strobe.eq(rwds_q[-1-ratio] == 2**nchips - 1)
             ]
-            rwds_in = [ phy.rwds_qd, phy.rwds_qc, phy.rwds_qb, phy.rwds_qa ]
-            dq_in = Cat(phy.dq_qd, phy.dq_qc, phy.dq_qb, phy.dq_qa)
-        else:
+            dq_raw = dq_in
+            dq_in = Signal(dw)
             self.comb += [
-                phy.rwds_da.eq(rwds_out[1]),
-                phy.rwds_db.eq(rwds_out[0]),
-                phy.dq_da.eq(dq_out[8:16]),
-                phy.dq_db.eq(dq_out[0:8])
+                dq_in.eq(Mux(rshift, shift_half(dq_raw, rprev_data, lane_dw), dq_raw)),
+                rwds_strobe.eq(Mux(rshift, rprev_strobe, rwds_q[-1] == 2**nchips - 1))
             ]
-            rwds_in = [ phy.rwds_qb, phy.rwds_qa ]
-            dq_in = Cat(phy.dq_qb, phy.dq_qa)
+        else:
+            self.comb += rwds_strobe.eq(rwds_q[-1] == 2**nchips - 1)
+
+        # CA and register values are sent to all ganged devices
+        lanes = lambda v: Cat(*[v] * nchips)
 
-        self.port = port = LiteHyperRAMNativePort(log2_int(module.nbanks * module.nrows * module.ncols), data_width=dw)
+        self.port = port = LiteHyperRAMNativePort(log2_int(module.nbanks * module.nrows * module.ncols), data_width=dw, length_width=length_width)
         self.comb += [ port.rdata.data.eq(dq_in) ]
 
+        # Words left of a burst with a known length, 0 if the burst is
+        # terminated by last instead
+        length = Signal(length_width)
+        wdata_last = Signal()
+        self.comb += wdata_last.eq(port.wdata.last | (length == 1))
+
+        # When the length of a read is known, CK is stopped after the
+        # cycle clocking out the last word instead of when the last word
+        # is received.  Read data is expected 2 CK cycles after the
+        # initial latency, as assumed by the delay in READ_DELAY.
+        ckcnt = Signal(max=2 * max_latency + 2**length_width + 1)
+
         self.submodules.fsm = fsm = ResetInserter()(CEInserter()(FSM(reset_state="END_READ")))
         fsm.ce = dlycnt == 0
         fsm.reset = ~ram_reset_b
 
+        # In 2X mode, RWDS during CA can only be sampled in the cycle after
+        # READ_DELAY/WRITE_DELAY (lat_sample).  For variable latency, reads
+        # then shorten ckcnt and writes start their data, which with an odd
+        # latency begins with the second CK cycle of a word: the write data
+        # is then shifted by half a word (wshift).
+        variable_2x = (double_rate and self.variable_latency and
+                       (dynamic_latency or not fixed_latency))
+        if variable_2x:
+            lat_sample = Signal()
+            single = Signal()
+            self.sync += lat_sample.eq(fsm.ongoing("READ_DELAY") | fsm.ongoing("WRITE_DELAY"))
+            self.comb += single.eq(lat_sample & ~double_latency(rwds_in[0]))
+            wshift = Signal()
+            wait = Signal(max=max_latency-1)
+            self.sync += If(ckcnt != 0,
+                            If(single,
+                               ckcnt.eq(ckcnt-1-half_latency)
+                            ).Else(
+                               ckcnt.eq(ckcnt-1)),
+                            If(ckcnt == 1, ck.eq(0)))
+        else:
+            self.sync += If(ckcnt != 0,
+                            ckcnt.eq(ckcnt-1),
+                            If(ckcnt == 1, ck.eq(0)))
+        shifted_write = variable_2x or quad_rate
+        if shifted_write:
+            wshift_now = Signal()
+            wprev_data = Signal(dw//2)
+            wprev_rwds = Signal(dw//16)
+
         ca = Signal(48)
 
-        fsm.act("CA_WORD0",
-                NextValue(cs_b, 0),
-                NextValue(ck, 1),
-                NextValue(dq_oe, 1),
-                NextValue(dq_out, ca[16:48] if dw == 32 else ca[32:48]),
-                NextValue(rwds_out, ~(C(0, len(rwds_out)))),
-                NextState("CA_WORD1"))
+        # Linear memory bursts are split after max_burst words: CS# goes
+        # high, and the burst continues with a new CA at the following
+        # address, transparently to the port.  Wrapped and register
+        # accesses are not split.
+        burst_cnt = Signal(max=max(self.max_burst, 2))
+        split     = Signal()
+        split_now = Signal()
+        ca_next   = Signal(32)
+        if split_bursts:
+            self.comb += [
+                split_now.eq(~ca[46] & ca[45] & (burst_cnt == self.max_burst - 1)),
+                ca_next.eq(Cat(ca[0:3], ca[16:45]) + self.max_burst * (lane_dw//16))
+            ]
+
+        def split_burst():
+            return [
+                NextValue(split, 1),
+                NextValue(ca[16:45], ca_next[3:32]),
+                NextValue(ca[0:3], ca_next[0:3])
+            ]
 
-        if dw != 32:
-            fsm.act("CA_WORD1",
-                    NextValue(dq_out, ca[16:32]),
-                    NextState("CA_WORD2"))
+        # The last CA word selects the operation; in 4X mode the whole CA
+        # fits in CA_WORD0
+        ca_words = {1: [ca[32:48], ca[16:32], ca[0:16], C(0, 16)],
+                    2: [ca[16:48], Cat(C(0, 16), ca[:16])],
+                    4: [Cat(C(0, 16), ca)]}[ratio]
+        ca_states = ["CA_WORD{}".format(i) for i in range(len(ca_words))]
+        if ratio == 1:
+            ca_states[-1] = "SELECT_OP"
 
-            fsm.act("CA_WORD2",
-                    NextValue(dq_out, ca[0:16]),
-                    NextState("SELECT_OP"))
+        ca_start = [
+            NextValue(cs_b, 0),
+            NextValue(ck, 1),
+            NextValue(burst_cnt, 0),
+            NextValue(dq_oe, 1),
+            NextValue(rwds_out, ~(C(0, len(rwds_out))))
+        ]
+        for i in range(len(ca_words) - 1):
+            fsm.act(ca_states[i],
+                    *(ca_start if i == 0 else []),
+                    NextValue(dq_out, lanes(ca_words[i])),
+                    NextState(ca_states[i+1]))
 
-        fsm.act("CA_WORD1" if dw == 32 else "SELECT_OP",
-                NextValue(dq_out, Cat(C(0, 16), ca[:16]) if dw == 32 else 0),
+        fsm.act(ca_states[-1],
+                *(ca_start if quad_rate else []),
+                NextValue(dq_out, lanes(ca_words[-1])),
                 If(ca[47] == 1,
                    # Read operation
                    NextState("READ_DELAY")
                 ).Elif(ca[46] == 1,
                    # Zero latency write to register
                    NextState("END_WRITE"),
-                   NextValue(dq_out[:16], port.wdata.data),
+                   *[NextValue(dq_out[c*lane_dw:c*lane_dw+16], port.wdata.data[:16])
+                     for c in range(nchips)],
                    port.wdata.ready.eq(1),
-                   If(port.wdata.last == 0, NextState("WRITE_REG"))
+                   If(length != 0, NextValue(length, length-1)),
+                   If(wdata_last == 0, NextState("WRITE_REG"))
                 ).Else(
                    # Normal write, wait for RWDS direction change
                    NextState("WRITE_DELAY")
@@ -132,60 +332,227 @@ class LiteHyperRAMController(Module):
         fsm.act("WRITE_DELAY",
                 NextValue(rwds_oe, 1),
                 NextValue(dq_out, 0),
-                NextValue(dlycnt, initial_latency-1-1) if dw == 32 else
-                If(1 if fixed_latency else rwds_in[1],
-                   NextValue(dlycnt, 2*initial_latency-1-2)
+                NextValue(wprev_rwds, ~(C(0, len(wprev_rwds)))) if shifted_write else [],
+                NextValue(dlycnt, 0) if variable_2x else
+                NextValue(dlycnt, half_latency + odd_latency - 2) if quad_rate else
+                NextValue(dlycnt, latency-1-1) if double_rate else
+                If(double_latency(rwds_in[1]),
+                   NextValue(dlycnt, 2*latency-1-2)
                 ).Else(
-                   NextValue(dlycnt, initial_latency-1-2)
+                   NextValue(dlycnt, latency-1-2)
                 ),
                 NextState("WRITE"))
 
-        fsm.act("WRITE",
-                NextValue(dq_out, port.wdata.data),
-                NextValue(rwds_out, ~port.wdata.we),
-                If(dlycnt == 0, port.wdata.ready.eq(1)),
-                If(port.wdata.last == 1, NextState("END_WRITE")))
+        write_data = [
+            NextValue(dq_out, port.wdata.data),
+            NextValue(rwds_out, ~port.wdata.we)
+        ]
+        end_write = NextState("END_WRITE")
+        if variable_2x:
+            self.comb += [
+                wshift_now.eq(Mux(lat_sample, single & odd_latency, wshift)),
+                # Cycles from lat_sample to the first data word
+                wait.eq(Mux(single, half_latency-2, latency-2))
+            ]
+        elif quad_rate:
+            self.comb += wshift_now.eq(wshift)
+        if shifted_write:
+            write_data = [
+                If(wshift_now,
+                   NextValue(dq_out, shift_half(port.wdata.data, wprev_data, lane_dw)),
+                   NextValue(rwds_out, shift_half(~port.wdata.we, wprev_rwds, nbytes)),
+                   NextValue(wprev_data, last_half(port.wdata.data, lane_dw)),
+                   NextValue(wprev_rwds, last_half(~port.wdata.we, nbytes))
+                ).Else(*write_data)
+            ]
+            end_write = If(wshift_now, NextState("WRITE_TAIL")).Else(end_write)
+
+        write = [
+            *write_data,
+            If(dlycnt == 0, port.wdata.ready.eq(1)),
+            NextValue(burst_cnt, burst_cnt+1),
+            If(length != 0, NextValue(length, length-1)),
+            If(wdata_last == 1,
+               end_write
+            ).Elif(split_now,
+               *split_burst(),
+               end_write)
+        ]
+
+        if variable_2x:
+            fsm.act("WRITE",
+                    If(lat_sample, NextValue(wshift, single & odd_latency)),
+                    If(lat_sample & (wait != 0),
+                       NextValue(dlycnt, wait-1)
+                    ).Else(*write))
+        else:
+            fsm.act("WRITE", *write)
+
+        if shifted_write:
+            # Last half word of a shifted write
+            fsm.act("WRITE_TAIL",
+                    NextValue(dq_out, shift_half(C(0, dw), wprev_data, lane_dw)),
+                    NextValue(rwds_out, shift_half(~C(0, dw//8), wprev_rwds, nbytes)),
+                    NextState("END_WRITE"))
 
         fsm.act("WRITE_REG",
-                NextValue(dq_out, port.wdata.data),
+                NextValue(dq_out, lanes(port.wdata.data[:lane_dw])),
                 port.wdata.ready.eq(1),
-                If(port.wdata.last == 1, NextState("END_WRITE")))
+                If(length != 0, NextValue(length, length-1)),
+                If(wdata_last == 1, NextState("END_WRITE")))
 
         fsm.act("END_WRITE",
                 NextValue(ck, 0),
                 NextValue(rwds_out, ~(C(0, len(rwds_out)))),
                 NextValue(rwds_oe, 0),
-                NextValue(dlycnt, phy.tx_latency),
+                NextValue(dlycnt, cs_hold),
                 NextState("END_READ"))
 
+        # Words clocked out by this burst when the length is known
+        read_length = Signal(length_width)
+        if split_bursts and self.max_burst < 2**length_width - 1:
+            self.comb += read_length.eq(Mux(~ca[46] & ca[45] & (length > self.max_burst),
+                                            self.max_burst, length))
+        else:
+            self.comb += read_length.eq(length)
+
+        # Read watchdog.  The data of a burst must have arrived within its
+        # length (max_burst without a length) plus double the maximum
+        # initial latency, in cycles from the end of READ_DELAY's delay, or
+        # RWDS is not strobing, for example with a read capture delay
+        # outside the eye.  The read is then ended, and the words not
+        # received are returned as they are, so that the client does not
+        # hang, with read_timeout pulsed.  In 1X mode the latency is already
+        # counted by dlycnt.  Unsplit bursts without a length are instead
+        # restarted with each word.
+        self.read_timeout = Signal()
+        latency_cycles = ceil(2 * max_latency / ratio) if ratio > 1 else 0
+        read_slack = latency_cycles + 4
+        watchdog = Signal(max=max(self.max_burst if split_bursts else 1,
+                                  2**length_width) + read_slack + 1)
+
         fsm.act("READ_DELAY",
                 NextValue(dq_oe, 0),
-                NextValue(dlycnt, phy.tx_latency + phy.rx_latency + 1) if dw == 32 else
-                If(1 if fixed_latency else rwds_in[0],
-                   NextValue(dlycnt, 2 * initial_latency + phy.tx_latency + phy.rx_latency)
+                NextValue(watchdog, Mux(length != 0, read_length,
+                                        self.max_burst if split_bursts else 1) + read_slack),
+                NextValue(dlycnt, phy.tx_latency + phy.rx_latency + 1) if ratio > 1 else
+                If(double_latency(rwds_in[0]),
+                   NextValue(dlycnt, 2 * latency + phy.tx_latency + phy.rx_latency)
                 ).Else(
-                   NextValue(dlycnt, initial_latency + phy.tx_latency + phy.rx_latency)
+                   NextValue(dlycnt, latency + phy.tx_latency + phy.rx_latency)
                 ),
+                If(length != 0,
+                   NextValue(ckcnt, half_latency + 1 + read_length) if quad_rate else
+                   NextValue(ckcnt, latency + read_length) if double_rate else
+                   If(double_latency(rwds_in[0]),
+                      NextValue(ckcnt, 2 * latency + read_length)
+                   ).Else(
+                      NextValue(ckcnt, latency + read_length)
+                   )),
                 NextState("READ"))
 
         fsm.act("READ",
-                If(rwds_in[-1],
+                If(watchdog != 0, NextValue(watchdog, watchdog-1)),
+                If(rwds_strobe,
                    If(dlycnt == 0, port.rdata.valid.eq(1)),
-                   If(port.rdata.last == 1,
+                   NextValue(burst_cnt, burst_cnt+1),
+                   If(length == 0, NextValue(watchdog, read_slack)) if not split_bursts else [],
+                   If(length != 0,
+                      # CK is already stopped, end as soon as the last
+                      # word is received
+                      NextValue(length, length-1),
+                      If(length == 1,
+                         NextState("END_READ")
+                      ).Elif(split_now,
+                         *split_burst(),
+                         NextState("END_READ"))
+                   ).Elif(port.rdata.last == 1,
+                      NextValue(ck, 0),
+                      NextValue(dlycnt, cs_hold),
+                      NextState("END_READ")
+                   ).Elif(split_now,
+                      *split_burst(),
                       NextValue(ck, 0),
-                      NextValue(dlycnt, phy.tx_latency),
+                      NextValue(dlycnt, cs_hold),
+                      NextState("END_READ"))
+                ).Elif(watchdog == 0,
+                   self.read_timeout.eq(1),
+                   NextValue(ck, 0),
+                   NextValue(split, 0),
+                   NextValue(dlycnt, cs_hold),
+                   NextState("READ_ABORT")))
+
+        # Return the rest of a timed out read with CS# high
+        fsm.act("READ_ABORT",
+                NextValue(cs_b, 1),
+                If(dlycnt == 0,
+                   port.rdata.valid.eq(1),
+                   If(length != 0,
+                      NextValue(length, length-1),
+                      If(length == 1, NextState("END_READ"))
+                   ).Elif(port.rdata.last == 1,
                       NextState("END_READ"))))
 
+        def accept_cmd():
+            return [
+                NextValue(ca[47], ~port.cmd.we),
+                NextValue(ca[46], port.cmd.aspace),
+                NextValue(ca[45], port.cmd.burst_type),
+                NextValue(ca[16:45], port.cmd.addr[3:32]),
+                NextValue(ca[0:3], port.cmd.addr[0:3]),
+                NextValue(length, port.cmd.length)
+            ]
+
+        # In pipelined mode the next command is accepted while CS# goes
+        # high, so that the CA phase can start as soon as cs_high allows
+        # instead of passing through IDLE
         fsm.act("END_READ",
                 NextValue(cs_b, 1),
-                NextState("IDLE"))
+                port.cmd.ready.eq((dlycnt == 0) & ram_reset_b & ~split if pipelined else 0),
+                If(split,
+                   # Continue a split burst
+                   NextValue(split, 0),
+                   NextValue(dlycnt, cs_high-1),
+                   NextState("CA_WORD0")
+                ).Elif(port.cmd.valid & port.cmd.ready,
+                   *accept_cmd(),
+                   NextValue(dlycnt, cs_high-1),
+                   NextState("CA_WORD0")
+                ).Else(
+                   # Passing through IDLE takes one cycle, wait for the rest
+                   If(ram_reset_b, NextValue(dlycnt, cs_high-2)) if cs_high > 2 else [],
+                   NextState("IDLE")
+                ))
 
         fsm.act("IDLE",
-                port.cmd.ready.eq(1),
+                port.cmd.ready.eq(dlycnt == 0),
                 If(port.cmd.valid,
-                   NextValue(ca[47], ~port.cmd.we),
-                   NextValue(ca[46], port.cmd.aspace),
-                   NextValue(ca[45], port.cmd.burst_type),
-                   NextValue(ca[16:45], port.cmd.addr[3:32]),
-                   NextValue(ca[0:3], port.cmd.addr[0:3]),
+                   *accept_cmd(),
                    NextState("CA_WORD0")))
+
+        # Bus activity for LiteHyperRAMStatistics.  The bus is idle without
+        # a command, in turnaround while CS# is high or being raised between
+        # transactions, and waits for latency while CS# is low without a
+        # data beat (CA and initial latency).  refresh_collision is set
+        # when a device indicates double latency in variable latency mode.
+        self.idle = Signal()
+        self.turnaround = Signal()
+        self.latency_wait = Signal()
+        self.refresh_collision = Signal()
+        self.comb += [
+            self.idle.eq(ram_reset_b & fsm.ongoing("IDLE") & (dlycnt == 0)),
+            self.turnaround.eq(ram_reset_b & ~self.idle &
+                               (cs_b | fsm.ongoing("END_READ") | fsm.ongoing("END_WRITE"))),
+            self.latency_wait.eq(~cs_b & ~port.wdata.ready & ~port.rdata.valid &
+                                 ~self.turnaround)
+        ]
+        if dynamic_latency:
+            variable = ~fixed
+        else:
+            variable = 0 if fixed_latency else 1
+        if variable_2x:
+            self.comb += self.refresh_collision.eq(variable & lat_sample & rwds_in[0])
+        elif ratio == 1:
+            self.comb += self.refresh_collision.eq(variable & (dlycnt == 0) &
+                                                   ((fsm.ongoing("READ_DELAY") & rwds_in[0]) |
+                                                    (fsm.ongoing("WRITE_DELAY") & rwds_in[1])))
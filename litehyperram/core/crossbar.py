@@ -3,34 +3,141 @@
 
 from migen import *
 
+from migen.fhdl.module import FinalizeError
+
+from litehyperram.common import LiteHyperRAMNativePort
+
+# The crossbar connects the register space port and any number of user
+# ports to the controller.  A new command is selected combinationally in
+# the cycle the controller becomes ready, so switching between ports does
+# not cost any cycles.  The wdata/rdata streams follow the port whose
+# command was last accepted.  The register space port is only served when
+# no user port has a command waiting, and while lockout is set only the
+# register space port is served.  stall is set while a user port has a
+# command waiting because of lockout or a register space transaction.
+#
+# Arbitration between the user ports is one of:
+#
+#   round-robin   Ports take turns, starting after the last granted port.
+#   fixed         Ports requested earlier from get_port() have priority,
+#                 which for LiteHyperRAMCore is data_port, followed by
+#                 the ports of new_port() calls in order.
+#   weighted      Each port gets a share of the data beats proportional to
+#                 its weight.  Ports that have used up their share only
+#                 get the bus when no other port with credit remains.
+
 class LiteHyperRAMCrossbar(Module):
-    def __init__(self, controller_port, data_port, reg_port):
+
+    arbitrations = ("round-robin", "fixed", "weighted")
+
+    def __init__(self, controller_port, reg_port, arbitration="round-robin"):
+        if arbitration not in self.arbitrations:
+            raise ValueError("Unknown arbitration scheme")
+
+        self.controller_port = controller_port
+        self.reg_port = reg_port
+        self.arbitration = arbitration
+        self.masters = []
+        self.weights = []
 
         self.lockout = Signal()
-        reg_select = Signal(reset = 1)
+        self.stall = Signal()
 
-        self.sync += [
-            If(~self.lockout & controller_port.cmd.ready & ~reg_port.cmd.valid,
-               reg_select.eq(0)),
-            If(controller_port.cmd.ready & reg_port.cmd.valid & ~data_port.cmd.valid,
-               reg_select.eq(1))
-        ]
+    def get_port(self, weight=1):
+        if self.finalized:
+            raise FinalizeError
+        if weight < 1:
+            raise ValueError("Invalid weight")
+        port = LiteHyperRAMNativePort.like(self.controller_port)
+        self.masters.append(port)
+        self.weights.append(weight)
+        return port
+
+    def do_finalize(self):
+        controller_port = self.controller_port
+        ports = [self.reg_port] + self.masters
+        nmasters = len(self.masters)
+
+        choice = Signal(max=max(len(ports), 2))
+        grant = Signal(max=max(len(ports), 2))
+        accept = Signal()
+        beat = Signal()
 
         self.comb += [
-            If(reg_select,
-               reg_port.cmd.connect(controller_port.cmd),
-               reg_port.wdata.connect(controller_port.wdata),
-               controller_port.rdata.connect(reg_port.rdata, omit=["last"]),
-               controller_port.rdata.last.eq(reg_port.rdata.last),
-               data_port.cmd.ready.eq(0),
-               data_port.wdata.ready.eq(0),
-               data_port.rdata.valid.eq(0)
-            ).Else(
-               data_port.cmd.connect(controller_port.cmd),
-               data_port.wdata.connect(controller_port.wdata),
-               controller_port.rdata.connect(data_port.rdata, omit=["last"]),
-               controller_port.rdata.last.eq(data_port.rdata.last),
-               reg_port.cmd.ready.eq(0),
-               reg_port.wdata.ready.eq(0),
-               reg_port.rdata.valid.eq(0))
+            accept.eq(controller_port.cmd.valid & controller_port.cmd.ready),
+            beat.eq(controller_port.wdata.ready | controller_port.rdata.valid)
         ]
+        self.sync += If(accept, grant.eq(choice))
+
+        # Command and data routing
+        self.comb += Case(choice, {
+            i: port.cmd.connect(controller_port.cmd)
+            for i, port in enumerate(ports)
+        })
+        self.comb += Case(grant, {
+            i: [port.wdata.connect(controller_port.wdata),
+                controller_port.rdata.connect(port.rdata, omit=["last"]),
+                controller_port.rdata.last.eq(port.rdata.last)]
+            for i, port in enumerate(ports)
+        })
+
+        if not nmasters:
+            return
+
+        # Arbitration
+        request = Signal(nmasters)
+        candidates = Signal(nmasters)
+        self.comb += request.eq(Cat(*[port.cmd.valid for port in self.masters]) &
+                                Replicate(~self.lockout, nmasters))
+        self.comb += self.stall.eq((self.lockout | (grant == 0) & ~controller_port.cmd.ready) &
+                                   (Cat(*[port.cmd.valid for port in self.masters]) != 0))
+
+        if self.arbitration == "weighted":
+            credit_min = -2**16
+            credits = [Signal(min=credit_min, max=weight+1, reset=weight)
+                       for weight in self.weights]
+            eligible = Signal(nmasters)
+            refilled = Signal(nmasters)
+            # When a new round starts, the port is chosen among those with
+            # credit after the refill, so that ports in debt wait for it to
+            # be paid back
+            self.comb += [
+                eligible.eq(Cat(*[credit > 0 for credit in credits]) & request),
+                refilled.eq(Cat(*[credit + weight > 0
+                                  for credit, weight in zip(credits, self.weights)]) & request),
+                candidates.eq(Mux(eligible != 0, eligible,
+                                  Mux(refilled != 0, refilled, request)))
+            ]
+            refill = Signal()
+            # Start a new round when all requesting ports are out of credit
+            self.comb += refill.eq(controller_port.cmd.ready & (request != 0) & (eligible == 0))
+            for i, (credit, weight) in enumerate(zip(credits, self.weights)):
+                used = Signal()
+                self.comb += used.eq(beat & (grant == i + 1) & (credit != credit_min))
+                self.sync += If(refill,
+                                If(credit > 0, credit.eq(weight - used)
+                                ).Else(credit.eq(credit + weight - used))
+                             ).Elif(used,
+                                credit.eq(credit - 1))
+        else:
+            self.comb += candidates.eq(request)
+
+        def select(order):
+            stmt = []
+            for i in reversed(order):
+                stmt = [If(candidates[i], choice.eq(i + 1)).Else(*stmt)]
+            return stmt
+
+        if self.arbitration == "fixed":
+            arbiter = select(list(range(nmasters)))
+        else:
+            last = Signal(max=max(nmasters, 2), reset=nmasters-1)
+            self.sync += If(accept & (choice != 0), last.eq(choice - 1))
+            arbiter = Case(last, {
+                j: select([(j + 1 + i) % nmasters for i in range(nmasters)])
+                for j in range(nmasters)
+            })
+
+        self.comb += If(request == 0,
+                        choice.eq(0)
+                     ).Else(arbiter)
@@ -0,0 +1,216 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+
+from litehyperram.common import LiteHyperRAMNativePort, wdata_description, rdata_description
+
+# The elastic buffer sits between a user port and a crossbar port, and
+# adds handshaking to the data streams of the user port: write data is
+# taken when wdata.valid is set, and read data is held until rdata.ready is
+# set.  Data is passed through FIFOs of depth words, and the accesses on
+# the crossbar port follow its fixed timing:
+#
+#   - A write is started once threshold words (default depth/2) or all
+#     remaining data of the command are buffered.  If the write FIFO runs
+#     dry, the burst is ended and the rest is written by a new command at
+#     the following address.
+#   - A read is started once there is room for threshold words or for all
+#     remaining data of the command.  If the read FIFO fills up, the burst
+#     is ended and resumed by a new command once there is room again.
+#
+# Wrapped bursts are resumed at the next address within the wrap of
+# wrap_words words, register space accesses are done one word at a time,
+# and no burst is made longer than max_burst words.  For a read without a
+# length, the client ends the command by setting rdata.last when taking
+# the last word; data read ahead is dropped.
+
+class LiteHyperRAMElasticBuffer(Module):
+    def __init__(self, port, depth, max_burst, wrap_words=16, threshold=None):
+        if depth < 2:
+            raise ValueError("Invalid depth")
+        if threshold is None:
+            threshold = depth//2
+        if threshold < 1 or threshold > depth:
+            raise ValueError("Invalid threshold")
+        max_burst = min(max_burst, 2**port.length_width - 1)
+        if max_burst < 1:
+            raise ValueError("Invalid maximum burst length")
+
+        self.port = user = LiteHyperRAMNativePort.like(port)
+
+        dw = port.data_width
+
+        self.submodules.wfifo = wfifo = stream.SyncFIFO(wdata_description(dw), depth)
+        self.submodules.rfifo = rfifo = ResetInserter()(stream.SyncFIFO(rdata_description(dw), depth))
+
+        we        = Signal()
+        aspace    = Signal()
+        wrap      = Signal()
+        addr      = Signal(port.address_width)
+        length    = Signal(port.length_width)
+        # Words of the command not yet taken from the client (wleft) or
+        # read for it (rleft), unused without a length
+        wleft     = Signal(port.length_width)
+        rleft     = Signal(port.length_width)
+        wopen     = Signal()
+        cancel    = Signal()
+        load      = Signal()
+        # Length of the burst being issued and of the current one
+        exact     = Signal()
+        chunk     = Signal(max=max_burst+1)
+        cur_exact = Signal()
+        cur_chunk = Signal(max=max_burst+1)
+        count     = Signal(max=max_burst+1)
+
+        wrap_mask = wrap_words - 1
+        next_addr = Signal(port.address_width)
+        self.comb += If(aspace,
+                        next_addr.eq(addr)
+                     ).Elif(wrap,
+                        next_addr.eq((addr & ~wrap_mask) | ((addr + 1) & wrap_mask))
+                     ).Else(
+                        next_addr.eq(addr + 1))
+
+        # Client Data ------------------------------------------------------------------------------
+        self.comb += [
+            wfifo.sink.valid.eq(user.wdata.valid & wopen),
+            wfifo.sink.data.eq(user.wdata.data),
+            wfifo.sink.we.eq(user.wdata.we),
+            wfifo.sink.last.eq(Mux(length == 0, user.wdata.last, wleft == 1)),
+            user.wdata.ready.eq(wfifo.sink.ready & wopen),
+
+            user.rdata.valid.eq(rfifo.source.valid & ~cancel),
+            user.rdata.data.eq(rfifo.source.data),
+            rfifo.source.ready.eq(user.rdata.ready),
+        ]
+        self.sync += [
+            If(load,
+               wleft.eq(user.cmd.length),
+               wopen.eq(user.cmd.we),
+               cancel.eq(0)
+            ).Else(
+               If(wfifo.sink.valid & wfifo.sink.ready,
+                  If(length != 0, wleft.eq(wleft - 1)),
+                  If(wfifo.sink.last, wopen.eq(0))),
+               If(user.rdata.valid & user.rdata.ready & user.rdata.last & (length == 0),
+                  cancel.eq(1))
+            )
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        limit  = Signal(max=max_burst+1)
+        rfree  = Signal(max=depth+1)
+        wstart = Signal()
+        rstart = Signal()
+        self.comb += [
+            limit.eq(Mux(aspace, 1, max_burst)),
+            rfree.eq(depth - rfifo.level),
+            # All data buffered, or enough to get going
+            wstart.eq((wfifo.level != 0) & (~wopen | (wfifo.level >= threshold))),
+            rstart.eq(Mux((length != 0) & (rleft < threshold), rfree >= rleft, rfree >= threshold)),
+            port.cmd.we.eq(we),
+            port.cmd.aspace.eq(aspace),
+            port.cmd.burst_type.eq(~wrap),
+            port.cmd.addr.eq(addr),
+            port.cmd.length.eq(Mux(exact, chunk, 0)),
+            port.wdata.data.eq(wfifo.source.data),
+            port.wdata.we.eq(wfifo.source.we),
+            port.rdata.last.eq(0)
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            user.cmd.ready.eq(1),
+            If(user.cmd.valid,
+               load.eq(1),
+               NextValue(we, user.cmd.we),
+               NextValue(aspace, user.cmd.aspace),
+               NextValue(wrap, ~user.cmd.burst_type),
+               NextValue(addr, user.cmd.addr),
+               NextValue(length, user.cmd.length),
+               NextValue(rleft, user.cmd.length),
+               If(user.cmd.we,
+                  NextState("WRITE-CMD")
+               ).Else(
+                  NextState("READ-CMD")
+               )
+            )
+        )
+
+        # Use an exact length when all remaining data of the command fits
+        # in one burst, and end the burst with last otherwise
+        fsm.act("WRITE-CMD",
+            exact.eq(aspace | (~wopen & (wfifo.level <= limit))),
+            chunk.eq(Mux(aspace, 1, wfifo.level)),
+            port.cmd.valid.eq(wstart),
+            If(port.cmd.valid & port.cmd.ready,
+               NextValue(cur_exact, exact),
+               NextValue(cur_chunk, chunk),
+               NextValue(count, 0),
+               NextState("WRITE")
+            )
+        )
+        fsm.act("WRITE",
+            port.wdata.valid.eq(1),
+            If(~cur_exact,
+               port.wdata.last.eq(port.wdata.ready &
+                                  (wfifo.source.last | (wfifo.level == 1) |
+                                   (count == limit - 1)))),
+            wfifo.source.ready.eq(port.wdata.ready),
+            If(port.wdata.ready,
+               NextValue(addr, next_addr),
+               NextValue(count, count + 1),
+               If(Mux(cur_exact, count == cur_chunk - 1, port.wdata.last),
+                  If(wfifo.source.last,
+                     NextState("IDLE")
+                  ).Else(
+                     NextState("WRITE-CMD")
+                  )
+               )
+            )
+        )
+
+        fsm.act("READ-CMD",
+            exact.eq(aspace | ((length != 0) & (rleft <= limit) & (rleft <= rfree))),
+            chunk.eq(Mux(aspace, 1, rleft)),
+            port.cmd.valid.eq(rstart & ~cancel),
+            If(cancel,
+               NextState("READ-DRAIN")
+            ).Elif(port.cmd.valid & port.cmd.ready,
+               NextValue(cur_exact, exact),
+               NextValue(cur_chunk, chunk),
+               NextValue(count, 0),
+               NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            rfifo.sink.valid.eq(port.rdata.valid & ~cancel),
+            rfifo.sink.data.eq(port.rdata.data),
+            If(~cur_exact,
+               port.rdata.last.eq(port.rdata.valid &
+                                  ((rfifo.level >= depth - 1) | (count == limit - 1) |
+                                   ((length != 0) & (rleft == 1)) | cancel))),
+            If(port.rdata.valid,
+               NextValue(addr, next_addr),
+               NextValue(count, count + 1),
+               If(length != 0, NextValue(rleft, rleft - 1)),
+               If(Mux(cur_exact, count == cur_chunk - 1, port.rdata.last),
+                  If(((length != 0) & (rleft == 1)) | cancel,
+                     NextState("READ-DRAIN")
+                  ).Else(
+                     NextState("READ-CMD")
+                  )
+               )
+            )
+        )
+        # Wait until the client has taken all data, or drop what was
+        # read ahead
+        fsm.act("READ-DRAIN",
+            If(cancel | ~rfifo.source.valid,
+               rfifo.reset.eq(1),
+               NextState("IDLE")
+            )
+        )
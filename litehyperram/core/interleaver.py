@@ -0,0 +1,178 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litehyperram.common import LiteHyperRAMNativePort
+
+# The interleaver presents the elastic ports of several channels (one
+# controller and HyperRAM device each) as a single elastic port.  The
+# address space is interleaved in granules of granularity words: word
+# address a is at address Cat(a[:g], a[g+n:]) of channel a[g:g+n], where
+# g = log2(granularity) and n = log2(number of channels).
+#
+# A linear memory command with a length is split into one command per
+# channel, issued in parallel, and the data is passed in order between the
+# client and the channel of the current granule.  Without a length, one
+# granule is transferred at a time, and the command for the next granule
+# is only issued once the client has passed its first granule boundary.
+# Wrapped bursts must lie within a granule (wrap_words <= granularity),
+# and are passed to a single channel, as are register space accesses,
+# which go to the channel given by the topmost address bits.
+
+class LiteHyperRAMInterleaver(Module):
+    def __init__(self, ports, granularity, wrap_words=16):
+        nchannels = len(ports)
+        if nchannels < 2 or nchannels & (nchannels - 1):
+            raise ValueError("Invalid number of channels")
+        if granularity < 1 or granularity & (granularity - 1):
+            raise ValueError("Invalid granularity")
+        if granularity < wrap_words:
+            raise ValueError("Granularity below the wrapped burst length")
+
+        aw = ports[0].address_width
+        lw = ports[0].length_width
+        g  = log2_int(granularity)
+        n  = log2_int(nchannels)
+
+        self.port = user = LiteHyperRAMNativePort(aw + n, ports[0].data_width, lw)
+
+        we      = Signal()
+        aspace  = Signal()
+        wrap    = Signal()
+        active  = Signal()
+        # Data goes to a single channel (single), or the command has a
+        # length and left words remain (exact)
+        single  = Signal()
+        exact   = Signal()
+        left    = Signal(lw)
+        # Channel of the current granule, words left in it, and index of
+        # the next granule
+        ch      = Signal(n)
+        next_ch = Signal(n)
+        gcnt    = Signal(max=granularity+1)
+        gnext   = Signal(aw + n - g)
+        # Commands not yet accepted by the channels
+        pending = Signal(nchannels)
+        caddr   = [Signal(aw) for _ in range(nchannels)]
+        clen    = [Signal(lw) for _ in range(nchannels)]
+
+        for i, port in enumerate(ports):
+            self.comb += [
+                port.cmd.valid.eq(pending[i]),
+                port.cmd.we.eq(we),
+                port.cmd.aspace.eq(aspace),
+                port.cmd.burst_type.eq(~wrap),
+                port.cmd.addr.eq(caddr[i]),
+                port.cmd.length.eq(clen[i])
+            ]
+            self.sync += If(port.cmd.valid & port.cmd.ready, pending[i].eq(0))
+
+        # Command split ----------------------------------------------------------------------------
+        addr   = user.cmd.addr
+        length = user.cmd.length
+        sel    = Signal(n)
+        local  = Signal(aw)
+        offset = Signal(g)
+        # Words from the start of the first granule, in full granules
+        # (per round over all channels, and left over) and a remainder
+        total  = Signal(max(lw, g) + 1)
+        rounds = Signal(lw + 1)
+        extra  = Signal(n)
+        rem    = Signal(g)
+        self.comb += [
+            If(user.cmd.aspace,
+               sel.eq(addr[aw:]),
+               local.eq(addr[:aw])
+            ).Else(
+               sel.eq(addr[g:g+n]),
+               local.eq(Cat(addr[:g], addr[g+n:]))
+            ),
+            offset.eq(addr[:g]),
+            total.eq(offset + length),
+            rounds.eq(total >> (g + n)),
+            extra.eq(total >> g),
+            rem.eq(total)
+        ]
+        words = []
+        start = []
+        for i in range(nchannels):
+            # Position of the channel in the round starting at sel
+            r = Signal(n)
+            w = Signal(lw)
+            s = Signal(aw)
+            self.comb += [
+                r.eq(i - sel),
+                w.eq(Cat(C(0, g), rounds + (r < extra)) + Mux(r == extra, rem, 0) -
+                     Mux(r == 0, offset, 0)),
+                s.eq(Mux(r == 0, local, Cat(C(0, g), (addr[g:] + r)[n:])))
+            ]
+            words.append(w)
+            start.append(s)
+
+        self.comb += user.cmd.ready.eq(~active & (pending == 0))
+        self.sync += If(user.cmd.valid & user.cmd.ready,
+            active.eq(1),
+            we.eq(user.cmd.we),
+            aspace.eq(user.cmd.aspace),
+            wrap.eq(~user.cmd.burst_type),
+            single.eq(user.cmd.aspace | ~user.cmd.burst_type),
+            exact.eq(length != 0),
+            left.eq(length),
+            ch.eq(sel),
+            gcnt.eq(granularity - offset),
+            gnext.eq(addr[g:] + 1),
+            If(~user.cmd.aspace & user.cmd.burst_type & (length != 0),
+               *[[caddr[i].eq(start[i]),
+                  clen[i].eq(words[i]),
+                  pending[i].eq(words[i] != 0)] for i in range(nchannels)]
+            ).Else(
+               Case(sel, {i: [caddr[i].eq(local),
+                              clen[i].eq(length),
+                              pending[i].eq(1)] for i in range(nchannels)})
+            )
+        )
+
+        # Datapath ---------------------------------------------------------------------------------
+        granule_last = Signal()
+        done         = Signal()
+        xfer         = Signal()
+        self.comb += [
+            granule_last.eq(~single & (gcnt == 1)),
+            done.eq(Mux(exact, left == 1, Mux(we, user.wdata.last, user.rdata.last))),
+            xfer.eq(active & Mux(we, user.wdata.valid & user.wdata.ready,
+                                     user.rdata.valid & user.rdata.ready)),
+            next_ch.eq(ch + 1)
+        ]
+        for port in ports:
+            self.comb += [
+                port.wdata.data.eq(user.wdata.data),
+                port.wdata.we.eq(user.wdata.we),
+                port.wdata.last.eq(user.wdata.last | granule_last),
+                port.rdata.last.eq(user.rdata.last | granule_last)
+            ]
+        self.comb += Case(ch, {i: [
+            port.wdata.valid.eq(user.wdata.valid & active & we),
+            user.wdata.ready.eq(port.wdata.ready & active & we),
+            user.rdata.valid.eq(port.rdata.valid & active & ~we),
+            user.rdata.data.eq(port.rdata.data),
+            port.rdata.ready.eq(user.rdata.ready & active & ~we)
+        ] for i, port in enumerate(ports)})
+
+        self.sync += If(xfer,
+            If(exact, left.eq(left - 1)),
+            If(done, active.eq(0)),
+            If(~single,
+               gcnt.eq(gcnt - 1),
+               If(gcnt == 1,
+                  ch.eq(next_ch),
+                  gcnt.eq(granularity),
+                  gnext.eq(gnext + 1),
+                  # Without a length, continue with the next granule
+                  If(~exact & ~done,
+                     Case(next_ch, {i: [caddr[i].eq(Cat(C(0, g), gnext[n:])),
+                                        clen[i].eq(0),
+                                        pending[i].eq(1)] for i in range(nchannels)}))
+               )
+            )
+        )
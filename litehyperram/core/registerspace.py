@@ -8,18 +8,35 @@ from migen import *
 class LiteHyperRAMRegisterSpace(Module, AutoCSR):
 
     il_code = { 3: 0b1110, 4: 0b1111, 5: 0b0000, 6: 0b0001, 7: 0b0010 }
+    bl_code = { 16: 0b10, 32: 0b11, 64: 0b01, 128: 0b00 }
 
-    def __init__(self, initial_latency, fixed_latency, nbanks, port):
+    def __init__(self, initial_latency, fixed_latency, nbanks, port, burst_length=32,
+                 max_latency=None, variable_latency=True, min_variable_latency=3):
 
-        cr0_value = (0x8f07 | (self.il_code[initial_latency] << 4) |
-                     (0x0008 if fixed_latency else 0))
+        if burst_length not in self.bl_code:
+            raise ValueError("Invalid burst length")
+
+        cr0_value = (0x8f04 | (self.il_code[initial_latency] << 4) |
+                     (0x0008 if fixed_latency else 0) | self.bl_code[burst_length])
 
         self.setup_done = Signal(reset = 0)
 
+        # Initial latency and fixed latency mode last written to CR0, for
+        # a controller with dynamic_latency.  Latencies above max_latency
+        # and reserved codes are replaced in CR0 by the latency in use, and
+        # fixed latency is forced in CR0 unless variable_latency is allowed
+        # with at least min_variable_latency.  The controller switches on
+        # the first CR0 write, so with several dies all of them must be
+        # written before the next memory access.
+        if max_latency is None:
+            max_latency = initial_latency
+        self.latency = Signal(max=max_latency+1, reset = initial_latency)
+        self.fixed_latency = Signal(reset = fixed_latency)
+
         idle = Signal()
         decrement_die_nr = Signal()
 
-        self.access = access = CSR(32)
+        self.access = access = CSR(32, name="access")
         access.description= "Register space access control. " + \
             "Can only be written when no operation is in progress."
         access.fields = CSRFieldAggregate([
@@ -45,14 +62,44 @@ class LiteHyperRAMRegisterSpace(Module, AutoCSR):
                 description="Operation in progress (when read as ``1``).")
         ], CSRAccess.ReadWrite)
 
+        cr0_write = Signal()
+        req_latency = Signal(max=max_latency+1)
+        new_latency = Signal(max=max_latency+1)
+        latency_code = Signal(4)
+        force_fixed = Signal()
+        if not variable_latency:
+            self.comb += force_fixed.eq(cr0_write)
+        elif min_variable_latency > 3:
+            self.comb += force_fixed.eq(cr0_write & (new_latency < min_variable_latency))
         self.comb += [
+            cr0_write.eq(access.fields.we & (access.fields.reg_type == 1) &
+                         (access.fields.reg_nr == 0)),
+            Case(access.fields.reg_value[4:8], {
+                code: req_latency.eq(il) for il, code in self.il_code.items()
+                if il <= max_latency
+            }),
+            If(req_latency == 0,
+               new_latency.eq(self.latency),
+               Case(self.latency, {
+                   il: latency_code.eq(code) for il, code in self.il_code.items()
+                   if il <= max_latency
+               })
+            ).Else(
+               new_latency.eq(req_latency),
+               latency_code.eq(access.fields.reg_value[4:8])
+            ),
             port.cmd.we.eq(access.fields.we),
             port.cmd.aspace.eq(1),
             port.cmd.burst_type.eq(1),
             port.cmd.addr.eq(Cat(access.fields.reg_nr, C(0, 8),
                                  access.fields.reg_type, C(0, 3),
                                  access.fields.die_nr)),
-            port.wdata.data.eq(access.fields.reg_value),
+            port.wdata.data.eq(Mux(cr0_write,
+                                   Cat(access.fields.reg_value[:3],
+                                       access.fields.reg_value[3] | force_fixed,
+                                       latency_code,
+                                       access.fields.reg_value[8:16]),
+                                   access.fields.reg_value)),
             port.wdata.last.eq(1),
             port.rdata.last.eq(1),
             access.fields.busy.eq(~idle),
@@ -91,6 +138,9 @@ class LiteHyperRAMRegisterSpace(Module, AutoCSR):
         fsm.act("WAIT_WRITE",
                 port.wdata.valid.eq(1),
                 If(port.wdata.ready,
+                   If(cr0_write,
+                      NextValue(self.latency, new_latency),
+                      NextValue(self.fixed_latency, access.fields.reg_value[3] | force_fixed)),
                    If(~self.setup_done,
                       If(access.fields.die_nr == 0,
                          NextValue(self.setup_done, 1)
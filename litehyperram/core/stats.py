@@ -0,0 +1,96 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus
+
+# LiteHyperRAMStatistics ---------------------------------------------------------------------------
+
+# Performance counters of a controller and its crossbar.  All counters are
+# 32 bits and run freely (wrapping around); writing snapshot latches all of
+# them at once into the status registers, and writing clear resets them.
+#
+# Commands and data beats are counted at the controller, so they include
+# register space accesses.  Each cycle the bus is busy (a data beat, the
+# sum of read_beats and write_beats), idle, in turnaround between
+# transactions, waiting for CA and initial latency, or held in reset.
+# refresh_collisions counts transactions for which the device indicated
+# double latency in variable latency mode, and stall_cycles the cycles a
+# user port waits for the register space port or lockout.
+#
+# The latency from accepting a command to its first data beat is kept in a
+# histogram of nbins bins of bin_width cycles each, the last bin also
+# counting all longer latencies.
+
+class LiteHyperRAMStatistics(Module, AutoCSR):
+    def __init__(self, controller, crossbar, nbins=16, bin_width=4):
+        if nbins < 2:
+            raise ValueError("Invalid number of bins")
+        if bin_width < 1 or bin_width & (bin_width - 1):
+            raise ValueError("Invalid bin width")
+
+        port = controller.port
+
+        self.snapshot = CSR(name="snapshot")
+        self.snapshot.description = "Write to latch all counters into the status registers."
+        self.clear = CSR(name="clear")
+        self.clear.description = "Write to reset all counters."
+
+        accept = Signal()
+        beat   = Signal()
+        self.comb += [
+            accept.eq(port.cmd.valid & port.cmd.ready),
+            beat.eq(port.wdata.ready | port.rdata.valid)
+        ]
+
+        def counter(name, event, description):
+            count  = Signal(32)
+            status = CSRStatus(32, name=name, description=description)
+            setattr(self, name, status)
+            self.sync += [
+                If(self.clear.re,
+                   count.eq(0)
+                ).Elif(event,
+                   count.eq(count + 1)
+                ),
+                If(self.snapshot.re, status.status.eq(count))
+            ]
+            return count
+
+        # Counters ---------------------------------------------------------------------------------
+        counter("cycles",             1,                           "Clock cycles.")
+        counter("reads",              accept & ~port.cmd.we,       "Read commands.")
+        counter("writes",             accept & port.cmd.we,        "Write commands.")
+        counter("read_beats",         port.rdata.valid,            "Data words read.")
+        counter("write_beats",        port.wdata.ready,            "Data words written.")
+        counter("idle_cycles",        controller.idle,             "Cycles without a command.")
+        counter("turnaround_cycles",  controller.turnaround,
+                "Cycles with CS# high or being raised between transactions.")
+        counter("latency_cycles",     controller.latency_wait,
+                "Cycles with CS# low waiting for CA and initial latency.")
+        counter("refresh_collisions", controller.refresh_collision,
+                "Transactions with double latency indicated in variable latency mode.")
+        counter("stall_cycles",       crossbar.stall,
+                "Cycles a user port waits for the register space port or lockout.")
+
+        # Latency histogram ------------------------------------------------------------------------
+        limit   = nbins * bin_width
+        latency = Signal(max=limit+1)
+        pending = Signal()
+        index   = Signal(max=nbins)
+        self.comb += If(latency >= limit,
+                        index.eq(nbins - 1)
+                     ).Else(
+                        index.eq(latency >> log2_int(bin_width)))
+        self.sync += If(accept,
+                        pending.eq(1),
+                        latency.eq(1)
+                     ).Elif(pending & beat,
+                        pending.eq(0)
+                     ).Elif(latency != limit,
+                        latency.eq(latency + 1))
+        for i in range(nbins):
+            high = "or more" if i == nbins - 1 else "to {}".format((i + 1) * bin_width - 1)
+            counter("latency_hist{}".format(i), pending & beat & (index == i),
+                    "Commands with {} {} cycles to first data.".format(i * bin_width, high))
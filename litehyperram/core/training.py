@@ -0,0 +1,183 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
+
+# LiteHyperRAMReadTraining -------------------------------------------------------------------------
+
+# Read capture calibration for PHYs with delay control (ECP5HYPERRAMPHY2x).
+# Writing start writes a pattern of nwords words at address (overwriting
+# what was there), then reads it back with the read capture delay of all
+# devices set to each tap from -taps to taps-1 in turn.  For each device,
+# the longest run of taps reading the pattern correctly is kept in
+# rx_window<n>, and rx_delay<n> is set to its centre.  When no tap passes,
+# rx_delay<n> is left unchanged.  A tap at which RWDS is lost fails for
+# all devices: timeout is the controller's read_timeout, which ends such a
+# read instead of waiting for the data.
+#
+# The rx_delay<n> and ck_delay CSRs hold signed tap offsets from the DELAYF
+# defaults, and can be written to override the training results.
+
+class LiteHyperRAMReadTraining(Module, AutoCSR):
+    def __init__(self, port, phy, address=0, taps=32, nwords=8):
+        if not getattr(phy, "rx_delay", None):
+            raise ValueError("PHY has no delay control")
+        if taps < 1 or taps > 64:
+            raise ValueError("Invalid number of taps")
+        if nwords < 1 or nwords >= 2**port.length_width:
+            raise ValueError("Invalid pattern length")
+
+        nlanes  = len(phy.rx_delay)
+        dw      = port.data_width
+        lane_dw = dw//nlanes
+
+        self.timeout = Signal()
+
+        self.start = CSR(name="start")
+        self.start.description = "Write to start training."
+        self.done  = CSRStatus(name="done", reset=1, description="Training has completed.")
+        self.ck_delay = CSRStorage(8, name="ck_delay", description="CK delay in taps (signed).")
+        self.rx_delay  = []
+        self.rx_window = []
+        for i in range(nlanes):
+            delay = CSRStorage(8, name="rx_delay{}".format(i), write_from_dev=True,
+                               description="Read capture delay of device {} in taps (signed).".format(i))
+            window = CSRStatus(16, name="rx_window{}".format(i),
+                               description="First passing tap (bits 0-7, signed) and number of "
+                                           "passing taps (bits 8-15) of device {}.".format(i))
+            setattr(self, "rx_delay{}".format(i), delay)
+            setattr(self, "rx_window{}".format(i), window)
+            self.rx_delay.append(delay)
+            self.rx_window.append(window)
+
+        # Bytes of all values, so that every DQ line toggles
+        byte_values = [0x00, 0xff, 0x55, 0xaa, 0x33, 0xcc, 0x0f, 0xf0]
+        pattern = Array(Constant(sum(byte_values[(i + j) % 8] << 8*j for j in range(dw//8)), dw)
+                        for i in range(nwords))
+
+        count    = Signal(max=max(nwords, 2))
+        expected = Signal(dw)
+        sweeping = Signal()
+        # Taps are two's complement
+        tap      = Signal(8)
+        passing  = Signal(nlanes)
+
+        for i in range(nlanes):
+            self.comb += phy.rx_delay[i].eq(Mux(sweeping, tap, self.rx_delay[i].storage))
+        if hasattr(phy, "ck_delay"):
+            self.comb += phy.ck_delay.eq(self.ck_delay.storage)
+
+        self.comb += [
+            port.cmd.addr.eq(address),
+            port.cmd.length.eq(nwords),
+            port.cmd.burst_type.eq(1),
+            port.cmd.aspace.eq(0),
+            expected.eq(pattern[count]),
+            port.wdata.data.eq(expected),
+            port.wdata.we.eq(2**(dw//8) - 1),
+            port.rdata.last.eq(0)
+        ]
+
+        # Longest run of passing taps so far, and the current one
+        run_start  = [Signal(8) for _ in range(nlanes)]
+        run_len    = [Signal(8) for _ in range(nlanes)]
+        best_start = [Signal(8) for _ in range(nlanes)]
+        best_len   = [Signal(8) for _ in range(nlanes)]
+
+        compare  = []
+        evaluate = []
+        finish   = []
+        for i in range(nlanes):
+            lane = slice(i*lane_dw, (i + 1)*lane_dw)
+            start  = Signal(8)
+            length = Signal(8)
+            self.comb += [
+                start.eq(Mux(run_len[i] == 0, tap, run_start[i])),
+                length.eq(run_len[i] + 1),
+                self.rx_delay[i].dat_w.eq(best_start[i] + best_len[i][1:]),
+                self.rx_window[i].status.eq(Cat(best_start[i], best_len[i]))
+            ]
+            compare.append(If(port.rdata.data[lane] != expected[lane], NextValue(passing[i], 0)))
+            evaluate.append(
+                If(passing[i],
+                   NextValue(run_start[i], start),
+                   NextValue(run_len[i], length),
+                   If(length > best_len[i],
+                      NextValue(best_start[i], start),
+                      NextValue(best_len[i], length))
+                ).Else(
+                   NextValue(run_len[i], 0)
+                ))
+            finish.append(self.rx_delay[i].we.eq(best_len[i] != 0))
+
+        # Control ----------------------------------------------------------------------------------
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(self.start.re,
+               NextValue(self.done.status, 0),
+               NextState("WRITE-CMD")
+            )
+        )
+        fsm.act("WRITE-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(1),
+            If(port.cmd.ready,
+               NextValue(count, 0),
+               NextState("WRITE")
+            )
+        )
+        fsm.act("WRITE",
+            If(port.wdata.ready,
+               NextValue(count, count + 1),
+               If(count == nwords - 1,
+                  NextValue(sweeping, 1),
+                  NextValue(tap, -taps & 0xff),
+                  *[[NextValue(run_len[i], 0), NextValue(best_len[i], 0)] for i in range(nlanes)],
+                  NextState("SET")
+               )
+            )
+        )
+        # Wait for the taps to be moved
+        fsm.act("SET",
+            If(phy.delay_ready,
+               NextState("READ-CMD")
+            )
+        )
+        fsm.act("READ-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(0),
+            If(port.cmd.ready,
+               NextValue(count, 0),
+               NextValue(passing, 2**nlanes - 1),
+               NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            If(self.timeout,
+               NextValue(passing, 0)
+            ),
+            If(port.rdata.valid,
+               *compare,
+               NextValue(count, count + 1),
+               If(count == nwords - 1,
+                  NextState("EVALUATE")
+               )
+            )
+        )
+        fsm.act("EVALUATE",
+            *evaluate,
+            NextValue(tap, tap + 1),
+            If(tap == (taps - 1) & 0xff,
+               NextState("FINISH")
+            ).Else(
+               NextState("SET")
+            )
+        )
+        fsm.act("FINISH",
+            *finish,
+            NextValue(sweeping, 0),
+            NextValue(self.done.status, 1),
+            NextState("IDLE")
+        )
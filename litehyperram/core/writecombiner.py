@@ -0,0 +1,215 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect.csr import AutoCSR, CSR
+
+from litehyperram.common import LiteHyperRAMNativePort
+
+# The write combiner sits between a user port and a crossbar port, and
+# collects memory writes which lie within one aligned block of block_words
+# words in a buffer, merging their byte enables.  The buffer is written to
+# the HyperRAM as a single linear burst, covering the words written, when
+#
+#   - a write to another block arrives,
+#   - no write has been added for timeout cycles (None to disable),
+#   - the flush CSR is written, or
+#   - any other command overlapping the block arrives.  As the end of a
+#     command without a length is not known, such a command overlaps if it
+#     starts at or below the end of the block.
+#
+# Reads with a length which are entirely covered by fully written words of
+# the buffer are answered from the buffer instead.  Other commands are
+# passed through, and the next command is accepted once their data has
+# been transferred.
+#
+# Write data is taken starting two cycles after the command is accepted,
+# as for the controller.
+
+class LiteHyperRAMWriteCombiner(Module, AutoCSR):
+    def __init__(self, port, block_words=16, timeout=64):
+        if block_words < 2 or block_words & (block_words - 1):
+            raise ValueError("Invalid block size")
+        if block_words > 2**port.length_width - 1:
+            raise ValueError("Block size exceeds maximum command length")
+
+        self.port = user = LiteHyperRAMNativePort.like(port)
+
+        self.flush = CSR(name="flush")
+        self.flush.description = "Write to flush the write combining buffer."
+
+        dw = port.data_width
+        nbytes = dw//8
+        bbits = log2_int(block_words)
+
+        data = Array(Signal(dw) for i in range(block_words))
+        mask = Array(Signal(nbytes) for i in range(block_words))
+        full = Signal(block_words)
+        self.comb += [full[i].eq(mask[i] == 2**nbytes - 1) for i in range(block_words)]
+
+        active = Signal()
+        block  = Signal(port.address_width - bbits)
+        lo     = Signal(bbits)
+        hi     = Signal(bbits)
+        index  = Signal(bbits)
+        remaining = Signal(port.length_width)
+
+        # Command Decoding -------------------------------------------------------------------------
+        cmd = user.cmd
+        cmd_block = cmd.addr[bbits:]
+        cmd_end   = Signal(port.address_width + 1)
+        block_end = Signal(port.address_width + 1)
+        overlap   = Signal()
+        combine   = Signal()
+        forward   = Signal()
+        covered   = Signal()
+        self.comb += [
+            cmd_end.eq(cmd.addr + cmd.length - 1),
+            block_end.eq(Cat(Replicate(1, bbits), block)),
+            overlap.eq(active & ~cmd.aspace & (cmd.addr <= block_end) &
+                       ((cmd.length == 0) | (cmd_end >= Cat(C(0, bbits), block)))),
+            combine.eq(cmd.we & ~cmd.aspace & cmd.burst_type & (cmd.length != 0) &
+                       (cmd_end[bbits:] == cmd_block) &
+                       (~active | (cmd_block == block))),
+            # All words read are fully written in the buffer
+            covered.eq(Cat(*[(i < cmd.addr[:bbits]) | (i > cmd_end[:bbits]) | full[i]
+                             for i in range(block_words)]) == 2**block_words - 1),
+            forward.eq(active & ~cmd.we & ~cmd.aspace & (cmd.length != 0) &
+                       (cmd_block == block) & (cmd_end[bbits:] == block) & covered)
+        ]
+
+        # Flush Requests ---------------------------------------------------------------------------
+        flush_req     = Signal()
+        flush_pending = Signal()
+        flush_done    = Signal()
+        added         = Signal()
+        self.sync += If(self.flush.re,
+                        flush_pending.eq(1)
+                     ).Elif(flush_done | ~active,
+                        flush_pending.eq(0))
+        self.comb += flush_req.eq(flush_pending)
+        if timeout is not None:
+            idle_count = Signal(max=timeout+1)
+            self.sync += If(~active | added,
+                            idle_count.eq(0)
+                         ).Elif(idle_count != timeout,
+                            idle_count.eq(idle_count + 1))
+            self.comb += If(idle_count == timeout, flush_req.eq(1))
+
+        # Buffer -----------------------------------------------------------------------------------
+        collect  = Signal()
+        flushing = Signal()
+        merged  = Signal(dw)
+        self.comb += [
+            merged[8*b:8*(b+1)].eq(Mux(user.wdata.we[b], user.wdata.data[8*b:8*(b+1)],
+                                       data[index][8*b:8*(b+1)]))
+            for b in range(nbytes)
+        ]
+        self.sync += [
+            If(collect,
+               data[index].eq(merged),
+               mask[index].eq(mask[index] | user.wdata.we)
+            ).Elif(flushing & port.wdata.ready,
+               mask[index].eq(0))
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        pass_end = Signal()
+        self.comb += [
+            port.rdata.connect(user.rdata, omit={"last"}),
+            port.rdata.last.eq(user.rdata.last),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1)
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(flush_req & active,
+               NextState("FLUSH")
+            ).Elif(cmd.valid,
+               If(combine,
+                  cmd.ready.eq(1),
+                  added.eq(1),
+                  NextValue(active, 1),
+                  NextValue(block, cmd_block),
+                  If(~active | (cmd.addr[:bbits] < lo), NextValue(lo, cmd.addr[:bbits])),
+                  If(~active | (cmd_end[:bbits] > hi), NextValue(hi, cmd_end[:bbits])),
+                  NextValue(index, cmd.addr[:bbits]),
+                  NextValue(remaining, cmd.length),
+                  NextState("COLLECT-WAIT")
+               ).Elif(forward,
+                  cmd.ready.eq(1),
+                  NextValue(index, cmd.addr[:bbits]),
+                  NextValue(remaining, cmd.length),
+                  NextState("FORWARD")
+               ).Elif(overlap | (cmd.we & active & ~cmd.aspace),
+                  NextState("FLUSH")
+               ).Else(
+                  cmd.connect(port.cmd),
+                  user.wdata.connect(port.wdata),
+                  If(port.cmd.ready,
+                     NextValue(remaining, cmd.length),
+                     If(cmd.we,
+                        NextState("PASS-WRITE")
+                     ).Else(
+                        NextState("PASS-READ")
+                     )
+                  )
+               )
+            )
+        )
+        fsm.act("COLLECT-WAIT",
+            NextState("COLLECT")
+        )
+        fsm.act("COLLECT",
+            user.wdata.ready.eq(1),
+            collect.eq(1),
+            NextValue(index, index + 1),
+            NextValue(remaining, remaining - 1),
+            If(remaining == 1, NextState("IDLE"))
+        )
+        fsm.act("FORWARD",
+            user.rdata.valid.eq(1),
+            user.rdata.data.eq(data[index]),
+            NextValue(index, index + 1),
+            NextValue(remaining, remaining - 1),
+            If(remaining == 1, NextState("IDLE"))
+        )
+        fsm.act("FLUSH",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(1),
+            port.cmd.addr.eq(Cat(lo, block)),
+            port.cmd.length.eq(hi - lo + 1),
+            If(port.cmd.ready,
+               NextValue(index, lo),
+               NextState("FLUSH-DATA"))
+        )
+        fsm.act("FLUSH-DATA",
+            flushing.eq(1),
+            port.wdata.valid.eq(1),
+            port.wdata.data.eq(data[index]),
+            port.wdata.we.eq(mask[index]),
+            port.wdata.last.eq(index == hi),
+            If(port.wdata.ready,
+               NextValue(index, index + 1),
+               If(index == hi,
+                  NextValue(active, 0),
+                  flush_done.eq(1),
+                  NextState("IDLE")))
+        )
+        fsm.act("PASS-WRITE",
+            user.wdata.connect(port.wdata),
+            pass_end.eq(port.wdata.ready &
+                        Mux(remaining == 0, user.wdata.last, remaining == 1)),
+            If(port.wdata.ready & (remaining != 0),
+               NextValue(remaining, remaining - 1)),
+            If(pass_end, NextState("IDLE"))
+        )
+        fsm.act("PASS-READ",
+            pass_end.eq(port.rdata.valid &
+                        Mux(remaining == 0, user.rdata.last, remaining == 1)),
+            If(port.rdata.valid & (remaining != 0),
+               NextValue(remaining, remaining - 1)),
+            If(pass_end, NextState("IDLE"))
+        )
@@ -0,0 +1,251 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.axi import BURST_FIXED, BURST_WRAP, RESP_OKAY
+
+
+# LiteHyperRAMAXI2Native -----------------------------------------------------------------------------
+
+# Connects an AXI4 or AXI-Lite slave interface to a native port.
+#
+# Up to outstanding read and write requests are queued, and served in
+# order, alternating between reads and writes.  Responses are therefore
+# returned in request order, which satisfies the ordering rules for any
+# mix of IDs.
+#
+# INCR bursts are mapped to linear burst commands, split into commands of
+# at most max_burst beats.  WRAP bursts matching the wrapped burst length
+# of the device (wrap_bytes, the burst_length set in CR0) are mapped to a
+# single wrapped burst command, other WRAP bursts are split into linear
+# commands at the wrap boundary.  FIXED bursts are performed
+# one beat at a time.  Only full width transfers are supported.
+#
+# As the native port can not be stalled, write commands are only issued
+# once all their data is buffered, and read commands once there is room
+# for all their data.  max_burst also sets the size of these buffers.
+
+class LiteHyperRAMAXI2Native(Module):
+    def __init__(self, axi, port, base_address=0x00000000, outstanding=4, max_burst=32,
+                 wrap_bytes=32):
+        axi_data_width  = len(axi.w.data)
+        port_data_width = len(port.wdata.data)
+        assert axi_data_width >= port_data_width
+
+        ratio      = axi_data_width//port_data_width
+        axi_bytes  = axi_data_width//8
+        adr_shift  = log2_int(axi_bytes)
+        adr_offset = base_address >> log2_int(port_data_width//8)
+
+        # Each command must fit in the length field
+        max_burst = min(max_burst, (2**port.length_width - 1)//ratio)
+        if max_burst < 1:
+            raise ValueError("Invalid maximum burst length")
+        depth = max(max_burst, 2)
+
+        # Wrapped bursts are done by the device when the wrap boundaries match
+        wrap_beats = wrap_bytes//axi_bytes
+        wrap_direct = (wrap_beats in (2, 4, 8, 16) and wrap_beats <= max_burst and
+                       base_address % wrap_bytes == 0)
+
+        lite     = not hasattr(axi.aw, "len")
+        id_width = len(axi.aw.id) if hasattr(axi.aw, "id") else 1
+
+        # Request Queues ---------------------------------------------------------------------------
+        ax_layout = [
+            ("addr",  len(axi.aw.addr) - adr_shift),
+            ("len",   8),
+            ("burst", 2),
+            ("id",    id_width)
+        ]
+        queues = []
+        for ax in [axi.aw, axi.ar]:
+            queue = stream.SyncFIFO(ax_layout, max(outstanding, 2))
+            self.submodules += queue
+            self.comb += [
+                queue.sink.valid.eq(ax.valid),
+                ax.ready.eq(queue.sink.ready),
+                queue.sink.addr.eq(ax.addr[adr_shift:]),
+            ]
+            if not lite:
+                self.comb += [
+                    queue.sink.len.eq(ax.len),
+                    queue.sink.burst.eq(ax.burst),
+                    queue.sink.id.eq(ax.id)
+                ]
+            else:
+                self.comb += queue.sink.burst.eq(0b01)
+            queues.append(queue)
+        aw_queue, ar_queue = queues
+
+        # Write data and response
+        w_queue = stream.SyncFIFO([("data", axi_data_width), ("strb", axi_bytes)], depth)
+        b_queue = stream.SyncFIFO([("id", id_width)], max(outstanding, 2))
+        self.submodules += w_queue, b_queue
+        self.comb += [
+            axi.w.connect(w_queue.sink, keep={"valid", "ready", "data", "strb"}),
+            axi.b.valid.eq(b_queue.source.valid),
+            axi.b.resp.eq(RESP_OKAY),
+            b_queue.source.ready.eq(axi.b.ready)
+        ]
+        if hasattr(axi.b, "id"):
+            self.comb += axi.b.id.eq(b_queue.source.id)
+
+        # Read data
+        r_queue = stream.SyncFIFO([("data", axi_data_width), ("id", id_width)], depth)
+        self.submodules += r_queue
+        self.comb += [
+            axi.r.valid.eq(r_queue.source.valid),
+            axi.r.data.eq(r_queue.source.data),
+            axi.r.last.eq(r_queue.source.last),
+            axi.r.resp.eq(RESP_OKAY),
+            r_queue.source.ready.eq(axi.r.ready)
+        ]
+        if hasattr(axi.r, "id"):
+            self.comb += axi.r.id.eq(r_queue.source.id)
+
+        # Write Datapath ---------------------------------------------------------------------------
+        wdata_converter = stream.StrideConverter(
+            [("data", axi_data_width),  ("we", axi_bytes)],
+            [("data", port_data_width), ("we", port_data_width//8)],
+        )
+        self.submodules += wdata_converter
+        self.comb += [
+            wdata_converter.sink.data.eq(w_queue.source.data),
+            wdata_converter.sink.we.eq(w_queue.source.strb),
+            wdata_converter.source.connect(port.wdata)
+        ]
+
+        # Read Datapath ----------------------------------------------------------------------------
+        rdata_converter = stream.StrideConverter(
+            [("data", port_data_width)],
+            [("data", axi_data_width)],
+        )
+        self.submodules += rdata_converter
+        self.comb += [
+            port.rdata.connect(rdata_converter.sink, omit={"last"}),
+            rdata_converter.source.connect(r_queue.sink, omit={"last"}),
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        we         = Signal()
+        addr       = Signal(len(axi.aw.addr) - adr_shift)
+        remaining  = Signal(9)
+        burst      = Signal(2)
+        wrap_mask  = Signal(8)
+        direct     = Signal()
+        cur_id     = Signal(id_width)
+        last_write = Signal()
+
+        chunk      = Signal(max=max_burst+1)
+        limit      = Signal(max=max_burst+1)
+        boundary   = Signal(9)
+        cur_chunk  = Signal(max=max_burst+1)
+        last_chunk = Signal()
+        beat       = Signal(max=max_burst+1)
+        # Read data beats issued and not yet taken by the master
+        reserved   = Signal(max=depth+1)
+
+        self.comb += [
+            boundary.eq(wrap_mask + 1 - (addr & wrap_mask)),
+            limit.eq(max_burst),
+            If(burst == BURST_FIXED,
+               limit.eq(1)
+            ).Elif((burst == BURST_WRAP) & ~direct & (boundary < max_burst),
+               limit.eq(boundary)),
+            chunk.eq(Mux(remaining < limit, remaining, limit)),
+            port.cmd.we.eq(we),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(~direct),
+            port.cmd.addr.eq(addr*ratio - adr_offset),
+            port.cmd.length.eq(chunk*ratio),
+            b_queue.sink.id.eq(cur_id),
+            r_queue.sink.id.eq(cur_id),
+            r_queue.sink.last.eq(last_chunk & (beat == cur_chunk - 1))
+        ]
+
+        r_issue = Signal()
+        self.comb += r_issue.eq(port.cmd.valid & port.cmd.ready & ~we)
+        self.sync += reserved.eq(reserved + Mux(r_issue, chunk, 0) -
+                                 (axi.r.valid & axi.r.ready))
+
+        def load(queue, write):
+            head = queue.source
+            return [
+                head.ready.eq(1),
+                NextValue(we, write),
+                NextValue(last_write, write),
+                NextValue(addr, head.addr),
+                NextValue(remaining, head.len + 1),
+                NextValue(burst, head.burst),
+                NextValue(wrap_mask, head.len),
+                NextValue(direct, (head.burst == BURST_WRAP) & (head.len == wrap_beats - 1)
+                          if wrap_direct else 0),
+                NextValue(cur_id, head.id),
+                NextState("CMD")
+            ]
+
+        w_eligible = Signal()
+        r_eligible = Signal()
+        self.comb += [
+            # Write data for the burst has started to arrive
+            w_eligible.eq(aw_queue.source.valid & w_queue.source.valid & b_queue.sink.ready),
+            r_eligible.eq(ar_queue.source.valid)
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(w_eligible & (~r_eligible | ~last_write),
+               *load(aw_queue, 1)
+            ).Elif(r_eligible,
+               *load(ar_queue, 0)
+            )
+        )
+        fsm.act("CMD",
+            port.cmd.valid.eq(Mux(we, w_queue.level >= chunk,
+                                  reserved + chunk <= depth)),
+            If(port.cmd.valid & port.cmd.ready,
+               NextValue(cur_chunk, chunk),
+               NextValue(last_chunk, remaining == chunk),
+               NextValue(beat, 0),
+               NextValue(remaining, remaining - chunk),
+               If(burst == BURST_WRAP,
+                  NextValue(addr, (addr & ~wrap_mask) | ((addr + chunk) & wrap_mask))
+               ).Elif(burst != BURST_FIXED,
+                  NextValue(addr, addr + chunk)),
+               If(we,
+                  NextState("WRITE")
+               ).Else(
+                  NextState("READ")
+               )
+            )
+        )
+        fsm.act("WRITE",
+            wdata_converter.sink.valid.eq(1),
+            w_queue.source.ready.eq(wdata_converter.sink.ready),
+            If(wdata_converter.sink.ready,
+               NextValue(beat, beat + 1),
+               If(beat == cur_chunk - 1,
+                  If(last_chunk,
+                     b_queue.sink.valid.eq(1),
+                     NextState("IDLE")
+                  ).Else(
+                     NextState("CMD")
+                  )
+               )
+            )
+        )
+        fsm.act("READ",
+            If(rdata_converter.source.valid,
+               NextValue(beat, beat + 1),
+               If(beat == cur_chunk - 1,
+                  If(last_chunk,
+                     NextState("IDLE")
+                  ).Else(
+                     NextState("CMD")
+                  )
+               )
+            )
+        )
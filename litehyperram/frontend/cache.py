@@ -0,0 +1,382 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus
+
+
+# LiteHyperRAMCachedWishbone2Native -----------------------------------------------------------------
+
+# Wishbone frontend with a read cache.  The cache has size bytes in ways
+# ways of line_size byte lines, held in block RAM.  Read misses fill the
+# whole line with a single HyperBus burst, and the requested word is
+# acknowledged as soon as it arrives.  Line fills run alongside lookups,
+# so hits in other lines are served while a fill is in progress.  Writes
+# go through to the HyperRAM and update the cached line on a hit, so the
+# cache stays coherent with any access made through this frontend.
+# Accesses through other ports are not seen; write the invalidate CSR
+# after those.
+#
+# Replacement is one of "lru", "round-robin" or "random", with invalid
+# ways always used first.
+#
+# With prefetch enabled, the line after a missed line is filled as soon as
+# the HyperBus is free.  A line filled by prefetch is marked, and the first
+# read hit on it prefetches the line after it.
+
+class LiteHyperRAMCachedWishbone2Native(Module, AutoCSR):
+
+    replacements = ("lru", "round-robin", "random")
+
+    def __init__(self, wishbone, port, base_address=0x00000000, size=4096, line_size=32,
+                 ways=2, replacement="lru", prefetch=True):
+        wishbone_data_width = len(wishbone.dat_w)
+        port_data_width     = len(port.wdata.data)
+        assert wishbone_data_width >= port_data_width
+
+        if replacement not in self.replacements:
+            raise ValueError("Unknown replacement policy")
+
+        ratio      = wishbone_data_width//port_data_width
+        adr_offset = base_address >> log2_int(port.data_width//8)
+        nbytes     = wishbone_data_width//8
+
+        words = line_size//nbytes
+        sets  = size//(line_size*ways)
+        if not all(n >= 1 and n & (n - 1) == 0 for n in (words, sets, ways)):
+            raise ValueError("Cache geometry must be powers of two")
+        if words < 2 or sets < 2:
+            raise ValueError("Cache too small")
+        if words*ratio >= 2**port.length_width:
+            raise ValueError("Line size exceeds maximum command length")
+
+        offset_bits = log2_int(words)
+        set_bits    = log2_int(sets)
+        line_width  = len(wishbone.adr) - offset_bits
+        tag_width   = line_width - set_bits
+        age_bits    = log2_int(ways)
+
+        self.invalidate = CSR(name="invalidate")
+        self.invalidate.description = "Write to invalidate all cache lines."
+        self.hits       = CSRStatus(32, name="hits", description="Number of read hits.")
+        self.misses     = CSRStatus(32, name="misses", description="Number of read misses.")
+        self.prefetches = CSRStatus(32, name="prefetches",
+                                    description="Number of lines filled by prefetch.")
+
+        # Storage ----------------------------------------------------------------------------------
+        # Tag entries are Cat(tag, prefetched, valid)
+        tag_rd, tag_wr, data_rd, data_wr = [], [], [], []
+        for i in range(ways):
+            tag_mem  = Memory(tag_width + 2, sets)
+            data_mem = Memory(wishbone_data_width, sets*words)
+            tag_rd.append(tag_mem.get_port())
+            tag_wr.append(tag_mem.get_port(write_capable=True))
+            data_rd.append(data_mem.get_port())
+            data_wr.append(data_mem.get_port(write_capable=True, we_granularity=8))
+            self.specials += tag_mem, data_mem
+        self.specials += tag_rd, tag_wr, data_rd, data_wr
+
+        # Address Decoding -------------------------------------------------------------------------
+        req_line  = Signal(line_width)
+        req_word  = Signal(offset_bits)
+        cur_line  = Signal(line_width)
+        fill_line = Signal(line_width)
+        pf_line   = Signal(line_width)
+        self.comb += [
+            req_line.eq(wishbone.adr[offset_bits:]),
+            req_word.eq(wishbone.adr[:offset_bits])
+        ]
+
+        self.submodules.fsm      = fsm      = FSM(reset_state="IDLE")
+        self.submodules.fill_fsm = fill_fsm = FSM(reset_state="IDLE")
+        fill_idle = fill_fsm.ongoing("IDLE")
+        filling   = fill_fsm.ongoing("DATA")
+        flushing  = fsm.ongoing("FLUSH")
+
+        # Lookup -----------------------------------------------------------------------------------
+        request     = Signal()
+        prefetching = Signal()
+        pf_take     = Signal()
+        lookup_set  = Signal(set_bits)
+        self.comb += [
+            request.eq(wishbone.cyc & wishbone.stb),
+            lookup_set.eq(Mux(fsm.ongoing("IDLE"),
+                              Mux(pf_take, pf_line[:set_bits], req_line[:set_bits]),
+                              cur_line[:set_bits]))
+        ]
+
+        valid      = Signal(ways)
+        prefetched = Signal(ways)
+        hit        = Signal(ways)
+        hit_way    = Signal(max=max(ways, 2))
+        hit_data   = Signal(wishbone_data_width)
+        for i in range(ways):
+            self.comb += [
+                tag_rd[i].adr.eq(lookup_set),
+                data_rd[i].adr.eq(Cat(req_word, lookup_set)),
+                valid[i].eq(tag_rd[i].dat_r[-1]),
+                prefetched[i].eq(tag_rd[i].dat_r[-2]),
+                hit[i].eq(valid[i] & (tag_rd[i].dat_r[:tag_width] == cur_line[set_bits:])),
+                If(hit[i], hit_way.eq(i), hit_data.eq(data_rd[i].dat_r))
+            ]
+
+        # Tag updates, fills take priority over lookups
+        fill_update   = Signal()
+        fill_way      = Signal(max=max(ways, 2))
+        fill_pf       = Signal()
+        lookup_update = Signal()
+        lookup_entry  = Signal(tag_width + 2)
+        lookup_way    = Signal(max=max(ways, 2))
+        flush_set     = Signal(set_bits)
+
+        tag_adr   = Signal(set_bits)
+        tag_entry = Signal(tag_width + 2)
+        tag_way   = Signal(max=max(ways, 2))
+        tag_we    = Signal()
+        # A lookup reading a set while its tags are written must be retried
+        stale     = Signal()
+        self.comb += [
+            If(fill_update,
+               tag_adr.eq(fill_line[:set_bits]),
+               tag_entry.eq(Cat(fill_line[set_bits:], fill_pf, C(1, 1))),
+               tag_way.eq(fill_way),
+               tag_we.eq(1)
+            ).Elif(flushing,
+               tag_adr.eq(flush_set),
+               tag_we.eq(1)
+            ).Else(
+               tag_adr.eq(cur_line[:set_bits]),
+               tag_entry.eq(lookup_entry),
+               tag_way.eq(lookup_way),
+               tag_we.eq(lookup_update)
+            ),
+            [[tag_wr[i].adr.eq(tag_adr),
+              tag_wr[i].dat_w.eq(tag_entry),
+              tag_wr[i].we.eq(tag_we & (flushing | (tag_way == i)))]
+             for i in range(ways)]
+        ]
+        self.sync += stale.eq(tag_we & (tag_adr == lookup_set))
+
+        # Replacement ------------------------------------------------------------------------------
+        victim = Signal(max=max(ways, 2))
+        policy = Signal(max=max(ways, 2))
+
+        if ways > 1 and replacement == "lru":
+            # Each way has an age, 0 for the most recently used
+            lru_mem = Memory(ways*age_bits, sets,
+                             init=[sum(i << (i*age_bits) for i in range(ways))]*sets)
+            lru_rd = lru_mem.get_port()
+            # Ages of the set being updated, which is the fill set on fills
+            lru_upd = lru_mem.get_port(async_read=True)
+            lru_wr = lru_mem.get_port(write_capable=True)
+            self.specials += lru_mem, lru_rd, lru_upd, lru_wr
+            ages = [lru_rd.dat_r[i*age_bits:(i+1)*age_bits] for i in range(ways)]
+            upd_ages = [lru_upd.dat_r[i*age_bits:(i+1)*age_bits] for i in range(ways)]
+            touched = Signal(age_bits)
+            self.comb += [
+                lru_rd.adr.eq(lookup_set),
+                lru_upd.adr.eq(tag_adr),
+                lru_wr.adr.eq(tag_adr),
+                lru_wr.we.eq(tag_we & ~flushing),
+                touched.eq(Array(upd_ages)[tag_way]),
+                lru_wr.dat_w.eq(Cat(*[Mux(tag_way == i, 0,
+                                          Mux(age < touched, age + 1, age))[:age_bits]
+                                      for i, age in enumerate(upd_ages)])),
+                [If(age == ways - 1, policy.eq(i)) for i, age in enumerate(ages)]
+            ]
+        elif ways > 1 and replacement == "round-robin":
+            self.sync += If(fill_update, policy.eq(policy + 1))
+        elif ways > 1:
+            lfsr = Signal(16, reset=1)
+            self.sync += lfsr.eq(Cat(lfsr[1:], lfsr[0] ^ lfsr[2] ^ lfsr[3] ^ lfsr[5]))
+            self.comb += policy.eq(lfsr)
+
+        self.comb += [
+            victim.eq(policy),
+            # Invalid ways are used first
+            [If(~valid[i], victim.eq(i)) for i in reversed(range(ways))]
+        ]
+
+        # Write Datapath ---------------------------------------------------------------------------
+        wdata_converter = stream.StrideConverter(
+            [("data", wishbone_data_width), ("we", nbytes)],
+            [("data", port_data_width),     ("we", port_data_width//8)],
+        )
+        self.submodules += wdata_converter
+        self.comb += [
+            wdata_converter.sink.data.eq(wishbone.dat_w),
+            wdata_converter.sink.we.eq(wishbone.sel),
+            wdata_converter.sink.last.eq(1),
+            wdata_converter.source.connect(port.wdata)
+        ]
+
+        # Read Datapath ----------------------------------------------------------------------------
+        rdata_converter = stream.StrideConverter(
+            [("data", port_data_width)],
+            [("data", wishbone_data_width)],
+        )
+        self.submodules += rdata_converter
+        fill_data = rdata_converter.source
+        self.comb += [
+            port.rdata.connect(rdata_converter.sink, omit={"last"}),
+            fill_data.ready.eq(1),
+        ]
+
+        # Lines are written by fills, and by write hits
+        fill_count = Signal(offset_bits)
+        write_hit  = Signal()
+        for i in range(ways):
+            self.comb += [
+                data_wr[i].adr.eq(Mux(filling, Cat(fill_count, fill_line[:set_bits]),
+                                      Cat(req_word, cur_line[:set_bits]))),
+                data_wr[i].dat_w.eq(Mux(filling, fill_data.data, wishbone.dat_w)),
+                data_wr[i].we.eq(Mux(filling,
+                    Replicate(fill_data.valid & (fill_way == i), nbytes),
+                    Replicate(write_hit & hit[i], nbytes) & wishbone.sel))
+            ]
+
+        # Command Port -----------------------------------------------------------------------------
+        fill_cmd  = fill_fsm.ongoing("CMD")
+        write_cmd = Signal()
+        self.comb += [
+            port.cmd.valid.eq(fill_cmd | write_cmd),
+            port.cmd.we.eq(~fill_cmd),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            port.cmd.addr.eq(Mux(fill_cmd, Cat(C(0, offset_bits), fill_line),
+                                 wishbone.adr)*ratio - adr_offset),
+            port.cmd.length.eq(Mux(fill_cmd, words*ratio, ratio))
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        fill_start  = Signal()
+        pf_pending  = Signal()
+        pf_next     = Signal()
+        inv_pending = Signal()
+        forward     = Signal()
+        hit_count   = Signal()
+        miss_count  = Signal()
+
+        self.sync += [
+            If(self.invalidate.re,
+               inv_pending.eq(1)
+            ).Elif(flushing,
+               inv_pending.eq(0)),
+            If(fill_update & ~fill_pf & prefetch,
+               pf_pending.eq(1),
+               pf_line.eq(fill_line + 1)
+            ).Elif(pf_next & prefetch,
+               pf_pending.eq(1),
+               pf_line.eq(cur_line + 1)
+            ).Elif(pf_take | flushing,
+               pf_pending.eq(0)),
+            If(fill_start,
+               fill_line.eq(cur_line),
+               fill_way.eq(victim),
+               fill_pf.eq(prefetching)),
+            If(hit_count, self.hits.status.eq(self.hits.status + 1)),
+            If(miss_count, self.misses.status.eq(self.misses.status + 1)),
+            If(fill_update & fill_pf, self.prefetches.status.eq(self.prefetches.status + 1))
+        ]
+
+        self.comb += wishbone.dat_r.eq(Mux(forward, fill_data.data, hit_data))
+
+        def start_fill():
+            # The victim is invalidated while its data is replaced
+            return [
+                fill_start.eq(1),
+                lookup_entry.eq(0),
+                lookup_way.eq(victim),
+                lookup_update.eq(1)
+            ]
+
+        fsm.act("IDLE",
+            If(inv_pending & fill_idle,
+               NextValue(flush_set, 0),
+               NextState("FLUSH")
+            ).Elif(pf_pending & fill_idle,
+               # Prefetch while the HyperBus is free
+               pf_take.eq(1),
+               NextValue(cur_line, pf_line),
+               NextValue(prefetching, 1),
+               NextState("LOOKUP")
+            ).Elif(request,
+               NextValue(cur_line, req_line),
+               NextValue(prefetching, 0),
+               NextState("LOOKUP")
+            )
+        )
+        fsm.act("LOOKUP",
+            If(stale,
+               NextState("IDLE")
+            ).Elif(prefetching,
+               If(hit == 0, *start_fill()),
+               NextState("IDLE")
+            ).Elif(~request,
+               NextState("IDLE")
+            ).Elif(wishbone.we,
+               # Write through, updating the line on a hit
+               If(fill_idle,
+                  write_hit.eq(1),
+                  write_cmd.eq(1),
+                  If(port.cmd.ready, NextState("WRITE")))
+            ).Elif(hit != 0,
+               wishbone.ack.eq(1),
+               hit_count.eq(1),
+               If(~fill_update,
+                  lookup_way.eq(hit_way),
+                  lookup_update.eq(1),
+                  # First use of a prefetched line prefetches the next one
+                  lookup_entry.eq(Cat(cur_line[set_bits:], C(0, 1), C(1, 1))),
+                  pf_next.eq(prefetched != 0)),
+               NextState("IDLE")
+            ).Elif(~fill_idle,
+               # Wait for the running fill, unless it brings the line
+               If(fill_line == cur_line, NextState("MISS"))
+            ).Else(
+               miss_count.eq(1),
+               *start_fill(),
+               NextState("MISS")
+            )
+        )
+        fsm.act("MISS",
+            # Early restart: acknowledge the requested word as it arrives
+            If(filling & fill_data.valid & (fill_count == req_word) &
+               request & (req_line == fill_line),
+               forward.eq(1),
+               wishbone.ack.eq(1),
+               NextState("IDLE")
+            ).Elif(~request | fill_idle,
+               NextState("IDLE")
+            )
+        )
+        fsm.act("WRITE",
+            wdata_converter.sink.valid.eq(1),
+            If(wdata_converter.sink.ready,
+               wishbone.ack.eq(1),
+               NextState("IDLE")
+            )
+        )
+        fsm.act("FLUSH",
+            NextValue(flush_set, flush_set + 1),
+            If(flush_set == sets - 1, NextState("IDLE"))
+        )
+
+        # Line Fill --------------------------------------------------------------------------------
+        fill_fsm.act("IDLE",
+            If(fill_start,
+               NextValue(fill_count, 0),
+               NextState("CMD"))
+        )
+        fill_fsm.act("CMD",
+            If(port.cmd.ready, NextState("DATA"))
+        )
+        fill_fsm.act("DATA",
+            If(fill_data.valid,
+               NextValue(fill_count, fill_count + 1),
+               If(fill_count == words - 1,
+                  fill_update.eq(1),
+                  NextState("IDLE")))
+        )
@@ -0,0 +1,519 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
+from litex.soc.interconnect.csr_eventmanager import EventManager, EventSourcePulse
+
+# DMA engines moving data between a stream and consecutive native port
+# words.  A transfer of length words starting at word address base is
+# started by a pulse on start, and done is set once it has completed.  In
+# loop mode the transfer restarts at base when it reaches the end, until
+# loop is cleared.  offset is the number of words transferred in the
+# current pass.
+#
+# Transfers are split into bursts of at most max_burst words (pass
+# controller.max_burst, to keep CS# low for less than tCSM) and the FIFO
+# depth.  Bursts longer than the command length field allows are issued
+# without a length and ended with last.  A read burst is issued once the
+# FIFO has room for all of it, and a write burst once the FIFO holds all
+# of its data besides that of the bursts already issued, so the fixed
+# timing of the native port is always met.
+#
+# With with_csr, the engine is controlled through base and length (in
+# bytes), loop, start, done and offset (in bytes) CSRs.
+
+class _LiteHyperRAMDMA(Module, AutoCSR):
+    def __init__(self, port, max_burst, fifo_depth):
+        self.limit = min(max_burst, fifo_depth)
+        if self.limit < 1:
+            raise ValueError("Invalid maximum burst length")
+        # Longer bursts are ended by last
+        self.with_length = self.limit < 2**port.length_width
+
+        self.base   = Signal(port.address_width)
+        self.length = Signal(32)
+        self.loop   = Signal()
+        self.start  = Signal()
+        self.done   = Signal()
+        self.offset = Signal(32)
+
+    def add_csr(self, port):
+        shift = log2_int(port.data_width//8)
+        self._base   = CSRStorage(32, name="base", description="Base address in bytes.")
+        self._length = CSRStorage(32, name="length", description="Length in bytes.")
+        self._loop   = CSRStorage(name="loop", description="Restart at the end until cleared.")
+        self._start  = CSR(name="start")
+        self._start.description = "Write to start a transfer."
+        self._done   = CSRStatus(name="done", description="The transfer has completed.")
+        self._offset = CSRStatus(32, name="offset",
+                                 description="Bytes transferred in the current pass.")
+        self.comb += [
+            self.base.eq(self._base.storage[shift:]),
+            self.length.eq(self._length.storage[shift:]),
+            self.loop.eq(self._loop.storage),
+            self.start.eq(self._start.re),
+            self._done.status.eq(self.done),
+            self._offset.status.eq(self.offset << shift)
+        ]
+
+    def add_burst_end(self, count, beat, load):
+        # All bursts of a pass but the last one are limit words, so the end
+        # of a burst is known from the words transferred in the pass
+        position = Signal(max=max(self.limit, 2))
+        end      = Signal()
+        self.comb += end.eq((position == self.limit - 1) | (count == self.length - 1))
+        self.sync += If(load,
+                        position.eq(0)
+                     ).Elif(beat,
+                        If(end,
+                           position.eq(0)
+                        ).Else(
+                           position.eq(position + 1)))
+        return end
+
+# LiteHyperRAMDMAReader ------------------------------------------------------------------------------
+
+class LiteHyperRAMDMAReader(_LiteHyperRAMDMA):
+    def __init__(self, port, max_burst, fifo_depth=256, with_csr=False):
+        _LiteHyperRAMDMA.__init__(self, port, max_burst, fifo_depth)
+
+        self.source = source = stream.Endpoint([("data", port.data_width)])
+
+        self.submodules.fifo = fifo = stream.SyncFIFO([("data", port.data_width)], fifo_depth)
+        self.comb += fifo.source.connect(source)
+
+        addr      = Signal(port.address_width)
+        remaining = Signal(32)
+        chunk     = Signal(max=self.limit+1)
+        # Words requested and not yet received
+        reserved  = Signal(max=fifo_depth+1)
+        received  = Signal(32)
+        issue     = Signal()
+        load      = Signal()
+
+        self.comb += [
+            chunk.eq(Mux(remaining < self.limit, remaining, self.limit)),
+            port.cmd.we.eq(0),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            port.cmd.addr.eq(addr),
+            port.cmd.length.eq(chunk if self.with_length else 0),
+            port.rdata.last.eq(self.add_burst_end(received, port.rdata.valid, load)),
+            issue.eq(port.cmd.valid & port.cmd.ready),
+
+            fifo.sink.valid.eq(port.rdata.valid),
+            fifo.sink.data.eq(port.rdata.data),
+            fifo.sink.last.eq(received == self.length - 1)
+        ]
+        self.sync += [
+            reserved.eq(reserved + Mux(issue, chunk, 0) - port.rdata.valid),
+            If(load,
+               received.eq(0)
+            ).Elif(port.rdata.valid,
+               If(fifo.sink.last & self.loop,
+                  received.eq(0)
+               ).Else(
+                  received.eq(received + 1)))
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            self.done.eq(1),
+            If(self.start & (self.length != 0),
+               load.eq(1),
+               NextValue(addr, self.base),
+               NextValue(remaining, self.length),
+               NextState("RUN")
+            )
+        )
+        fsm.act("RUN",
+            port.cmd.valid.eq((remaining != 0) &
+                              (fifo_depth - fifo.level - reserved >= chunk)),
+            If(issue,
+               If((remaining == chunk) & self.loop,
+                  NextValue(addr, self.base),
+                  NextValue(remaining, self.length)
+               ).Else(
+                  NextValue(addr, addr + chunk),
+                  NextValue(remaining, remaining - chunk)
+               )
+            ),
+            # Done once all data has been taken from the stream
+            If((remaining == 0) & (reserved == 0) & ~fifo.source.valid,
+               NextState("IDLE"))
+        )
+        self.comb += self.offset.eq(received)
+
+        if with_csr:
+            self.add_csr(port)
+
+# LiteHyperRAMDMAWriter ------------------------------------------------------------------------------
+
+class LiteHyperRAMDMAWriter(_LiteHyperRAMDMA):
+    def __init__(self, port, max_burst, fifo_depth=256, with_csr=False):
+        _LiteHyperRAMDMA.__init__(self, port, max_burst, fifo_depth)
+
+        self.sink = sink = stream.Endpoint([("data", port.data_width)])
+
+        self.submodules.fifo = fifo = stream.SyncFIFO([("data", port.data_width)], fifo_depth)
+        self.comb += sink.connect(fifo.sink)
+
+        addr      = Signal(port.address_width)
+        remaining = Signal(32)
+        chunk     = Signal(max=self.limit+1)
+        # Words issued and not yet written
+        pending   = Signal(max=fifo_depth+1)
+        written   = Signal(32)
+        issue     = Signal()
+        load      = Signal()
+
+        self.comb += [
+            chunk.eq(Mux(remaining < self.limit, remaining, self.limit)),
+            port.cmd.we.eq(1),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            port.cmd.addr.eq(addr),
+            port.cmd.length.eq(chunk if self.with_length else 0),
+            issue.eq(port.cmd.valid & port.cmd.ready),
+
+            port.wdata.valid.eq(fifo.source.valid),
+            port.wdata.data.eq(fifo.source.data),
+            port.wdata.we.eq(2**(port.data_width//8) - 1),
+            port.wdata.last.eq(self.add_burst_end(written, port.wdata.ready, load)),
+            fifo.source.ready.eq(port.wdata.ready)
+        ]
+        self.sync += [
+            pending.eq(pending + Mux(issue, chunk, 0) - port.wdata.ready),
+            If(load,
+               written.eq(0)
+            ).Elif(port.wdata.ready,
+               If((written == self.length - 1) & self.loop,
+                  written.eq(0)
+               ).Else(
+                  written.eq(written + 1)))
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            self.done.eq(1),
+            If(self.start & (self.length != 0),
+               load.eq(1),
+               NextValue(addr, self.base),
+               NextValue(remaining, self.length),
+               NextState("RUN")
+            )
+        )
+        fsm.act("RUN",
+            # The FIFO holds the data of the issued bursts and of this one
+            port.cmd.valid.eq((remaining != 0) & (fifo.level >= pending + chunk)),
+            If(issue,
+               If((remaining == chunk) & self.loop,
+                  NextValue(addr, self.base),
+                  NextValue(remaining, self.length)
+               ).Else(
+                  NextValue(addr, addr + chunk),
+                  NextValue(remaining, remaining - chunk)
+               )
+            ),
+            If((remaining == 0) & (pending == 0),
+               NextState("IDLE"))
+        )
+        self.comb += self.offset.eq(written)
+
+        if with_csr:
+            self.add_csr(port)
+
+# Scatter-Gather DMA ---------------------------------------------------------------------------------
+
+# The scatter-gather engines work through a chain of descriptors in
+# memory, each of five little-endian 32-bit words at a 4-byte aligned
+# byte address:
+#
+#   0  address  Byte address of the first row
+#   1  length   Bytes per row
+#   2  control  Bits 0-15: number of rows, bit 16: last descriptor of the
+#               chain, bit 17: raise the desc event when completed
+#   3  stride   Bytes from the start of one row to the start of the next
+#               (added modulo the address space, so it may be negative)
+#   4  next     Byte address of the next descriptor
+#
+# A 1D transfer has one row, a 2D transfer (a tile of a frame buffer) one
+# row per line with stride set to the pitch, and a strided transfer (a
+# column) rows of one element.  Each row is transferred as linear bursts
+# split only at max_burst, as for the plain DMA engines.  Descriptors are
+# fetched through the same port once the previous one has completed.  On
+# ports wider than 32 bits the native words holding the descriptor are
+# fetched, and the descriptor is taken from them at its offset.
+#
+# The chain starting at desc is processed after a pulse on start, and done
+# is set when its last descriptor has completed.  count is the number of
+# descriptors completed, current the address of the descriptor being
+# processed and rows the number of rows not yet started.  The reader sets
+# last on the final word of each descriptor.
+#
+# With with_csr, these are CSRs, and the done (chain completed) and desc
+# (descriptor with bit 17 set completed) events raise the interrupt.
+
+DESC_LAST = 1 << 16
+DESC_IRQ  = 1 << 17
+
+class _LiteHyperRAMSGDMA(Module, AutoCSR):
+    def __init__(self, port, max_burst, fifo_depth):
+        self.limit = min(max_burst, fifo_depth)
+        if self.limit < 1:
+            raise ValueError("Invalid maximum burst length")
+        # Longer bursts are ended by last
+        self.with_length = self.limit < 2**port.length_width
+
+        self.desc    = Signal(32)
+        self.start   = Signal()
+        self.done    = Signal()
+        self.count   = Signal(32)
+        self.current = Signal(32)
+        self.rows    = Signal(16)
+
+        # Pulsed when a descriptor with DESC_IRQ / the last one completes
+        self.desc_irq  = Signal()
+        self.done_irq  = Signal()
+
+        # Data words issued, and end of a data burst
+        self.issued    = Signal(max=self.limit+1)
+        self.burst_end = Signal()
+
+    def add_descriptor_fsm(self, port, we, can_issue, drained, fetching, beat):
+        dw    = port.data_width
+        shift = log2_int(dw//8)
+        if dw > 32:
+            # The descriptor may start at any 32-bit word of the first
+            # native word
+            ratio  = dw//32
+            nwords = (ratio + 4 + ratio - 1)//ratio
+        else:
+            nwords = 5*32//dw
+
+        # Descriptor being processed
+        fetch    = Signal(nwords*dw)
+        desc     = Signal(5*32)
+        d_addr   = desc[0:32]
+        d_length = desc[32:64]
+        d_rows   = desc[64:80]
+        d_last   = desc[80]
+        d_irq    = desc[81]
+        d_stride = desc[96:128]
+        d_next   = desc[128:160]
+
+        addr      = Signal(port.address_width)
+        row_addr  = Signal(port.address_width)
+        remaining = Signal(32)
+        chunk     = Signal(max=self.limit+1)
+        fetched   = Signal(max=nwords+1)
+        issue     = Signal()
+
+        self.comb += [
+            chunk.eq(Mux(remaining < self.limit, remaining, self.limit)),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            issue.eq(port.cmd.valid & port.cmd.ready)
+        ]
+        # Descriptor words arrive lowest first and are shifted in from the top
+        self.sync += If(fetching & port.rdata.valid,
+                        fetch.eq(Cat(fetch[dw:], port.rdata.data)))
+        if dw > 32:
+            self.comb += Case(self.current[2:shift], {
+                i: desc.eq(fetch[32*i:32*i+5*32]) for i in range(ratio)})
+        else:
+            self.comb += desc.eq(fetch)
+
+        # All bursts of a row but the last one are limit words, so the end
+        # of a burst is known from the words transferred in the row
+        position = Signal(max=max(self.limit, 2))
+        row_pos  = Signal(32)
+        self.comb += self.burst_end.eq((position == self.limit - 1) |
+                                       (row_pos == d_length[shift:] - 1))
+        self.sync += If(beat,
+                        If(self.burst_end,
+                           position.eq(0)
+                        ).Else(
+                           position.eq(position + 1)),
+                        If(row_pos == d_length[shift:] - 1,
+                           row_pos.eq(0)
+                        ).Else(
+                           row_pos.eq(row_pos + 1)))
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            self.done.eq(1),
+            If(self.start,
+               NextValue(self.current, self.desc),
+               NextValue(self.count, 0),
+               NextState("FETCH")
+            )
+        )
+        # Wait for the previous descriptor to complete
+        fsm.act("FETCH",
+            port.cmd.valid.eq(drained),
+            port.cmd.we.eq(0),
+            port.cmd.addr.eq(self.current[shift:]),
+            port.cmd.length.eq(nwords),
+            If(issue,
+               NextValue(fetched, 0),
+               NextState("LOAD")
+            )
+        )
+        fsm.act("LOAD",
+            fetching.eq(1),
+            If(port.rdata.valid,
+               NextValue(fetched, fetched + 1),
+               If(fetched == nwords - 1,
+                  NextState("SETUP")
+               )
+            )
+        )
+        fsm.act("SETUP",
+            NextValue(position, 0),
+            NextValue(row_pos, 0),
+            NextValue(addr, d_addr[shift:]),
+            NextValue(row_addr, d_addr[shift:]),
+            NextValue(remaining, d_length[shift:]),
+            NextValue(self.rows, d_rows),
+            If((d_rows == 0) | (d_length[shift:] == 0),
+               NextState("END")
+            ).Else(
+               NextState("RUN")
+            )
+        )
+        fsm.act("RUN",
+            port.cmd.valid.eq(can_issue(chunk)),
+            port.cmd.we.eq(we),
+            port.cmd.addr.eq(addr),
+            port.cmd.length.eq(chunk if self.with_length else 0),
+            If(issue,
+               self.issued.eq(chunk),
+               NextValue(addr, addr + chunk),
+               NextValue(remaining, remaining - chunk),
+               If(remaining == chunk,
+                  # Row complete, continue with the next one
+                  NextValue(self.rows, self.rows - 1),
+                  NextValue(row_addr, row_addr + d_stride[shift:]),
+                  NextValue(addr, row_addr + d_stride[shift:]),
+                  NextValue(remaining, d_length[shift:]),
+                  If(self.rows == 1, NextState("END"))
+               )
+            )
+        )
+        fsm.act("END",
+            If(drained,
+               NextValue(self.count, self.count + 1),
+               self.desc_irq.eq(d_irq),
+               If(d_last,
+                  self.done_irq.eq(1),
+                  NextState("IDLE")
+               ).Else(
+                  NextValue(self.current, d_next),
+                  NextState("FETCH")
+               )
+            )
+        )
+        return fsm
+
+    def add_csr(self):
+        self._desc    = CSRStorage(32, name="desc",
+                                   description="Byte address of the first descriptor.")
+        self._start   = CSR(name="start")
+        self._start.description = "Write to start processing the chain."
+        self._done    = CSRStatus(name="done", description="The chain has completed.")
+        self._count   = CSRStatus(32, name="count", description="Descriptors completed.")
+        self._current = CSRStatus(32, name="current",
+                                  description="Byte address of the current descriptor.")
+        self._rows    = CSRStatus(16, name="rows",
+                                  description="Rows of the current descriptor not yet started.")
+        self.comb += [
+            self.desc.eq(self._desc.storage),
+            self.start.eq(self._start.re),
+            self._done.status.eq(self.done),
+            self._count.status.eq(self.count),
+            self._current.status.eq(self.current),
+            self._rows.status.eq(self.rows)
+        ]
+
+        self.submodules.ev = EventManager()
+        self.ev.done = EventSourcePulse(description="The chain has completed.")
+        self.ev.desc = EventSourcePulse(description="A descriptor with the IRQ bit has completed.")
+        self.ev.finalize()
+        self.comb += [
+            self.ev.done.trigger.eq(self.done_irq),
+            self.ev.desc.trigger.eq(self.desc_irq)
+        ]
+
+# LiteHyperRAMSGDMAReader ----------------------------------------------------------------------------
+
+class LiteHyperRAMSGDMAReader(_LiteHyperRAMSGDMA):
+    def __init__(self, port, max_burst, fifo_depth=256, with_csr=False):
+        _LiteHyperRAMSGDMA.__init__(self, port, max_burst, fifo_depth)
+
+        self.source = source = stream.Endpoint([("data", port.data_width)])
+
+        self.submodules.fifo = fifo = stream.SyncFIFO([("data", port.data_width)], fifo_depth)
+        self.comb += fifo.source.connect(source)
+
+        # Words requested and not yet received
+        reserved = Signal(max=fifo_depth+1)
+        fetching = Signal()
+        data     = Signal()
+        self.comb += data.eq(port.rdata.valid & ~fetching)
+
+        fsm = self.add_descriptor_fsm(port, 0,
+            can_issue = lambda chunk: fifo_depth - fifo.level - reserved >= chunk,
+            drained   = reserved == 0,
+            fetching  = fetching,
+            beat      = data)
+
+        self.comb += [
+            port.rdata.last.eq(self.burst_end),
+            fifo.sink.valid.eq(data),
+            fifo.sink.data.eq(port.rdata.data),
+            # All bursts of the descriptor are issued, this is the final word
+            fifo.sink.last.eq(fsm.ongoing("END") & (reserved == 1))
+        ]
+        self.sync += reserved.eq(reserved + self.issued - data)
+
+        if with_csr:
+            self.add_csr()
+
+# LiteHyperRAMSGDMAWriter ----------------------------------------------------------------------------
+
+class LiteHyperRAMSGDMAWriter(_LiteHyperRAMSGDMA):
+    def __init__(self, port, max_burst, fifo_depth=256, with_csr=False):
+        _LiteHyperRAMSGDMA.__init__(self, port, max_burst, fifo_depth)
+
+        self.sink = sink = stream.Endpoint([("data", port.data_width)])
+
+        self.submodules.fifo = fifo = stream.SyncFIFO([("data", port.data_width)], fifo_depth)
+        self.comb += sink.connect(fifo.sink)
+
+        # Words issued and not yet written
+        pending  = Signal(max=fifo_depth+1)
+        fetching = Signal()
+
+        self.add_descriptor_fsm(port, 1,
+            # The FIFO holds the data of the issued bursts and of this one
+            can_issue = lambda chunk: fifo.level >= pending + chunk,
+            drained   = pending == 0,
+            fetching  = fetching,
+            beat      = port.wdata.ready)
+
+        self.comb += [
+            port.rdata.last.eq(0),
+            port.wdata.valid.eq(fifo.source.valid),
+            port.wdata.data.eq(fifo.source.data),
+            port.wdata.we.eq(2**(port.data_width//8) - 1),
+            port.wdata.last.eq(self.burst_end),
+            fifo.source.ready.eq(port.wdata.ready)
+        ]
+        self.sync += pending.eq(pending + self.issued - port.wdata.ready)
+
+        if with_csr:
+            self.add_csr()
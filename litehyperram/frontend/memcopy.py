@@ -0,0 +1,175 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
+
+# LiteHyperRAMMemCopy ------------------------------------------------------------------------------
+
+# Copy and fill engine on a native port, controlled through CSRs.
+#
+# A copy reads bursts of up to max_burst words (and buffer_words) into an
+# on-chip buffer and writes them back at the destination.  src, dst and
+# length must be multiples of the native word size, otherwise the copy is
+# not started and error is set instead.  When the destination
+# starts within the source region the copy runs from the end downwards,
+# so overlapping regions are copied correctly in either direction.
+#
+# A fill writes the 32-bit pattern (as seen at 4-byte aligned addresses)
+# to length bytes at dst.  The region may start and end at any byte, the
+# bytes of partial words outside it are masked off using wdata.we.
+
+class LiteHyperRAMMemCopy(Module, AutoCSR):
+    def __init__(self, port, max_burst, buffer_words=256):
+        limit = min(max_burst, 2**port.length_width - 1, buffer_words)
+        if limit < 1:
+            raise ValueError("Invalid maximum burst length")
+
+        dw     = port.data_width
+        nbytes = dw//8
+        shift  = log2_int(nbytes)
+
+        self.src     = CSRStorage(32, name="src", description="Source byte address.")
+        self.dst     = CSRStorage(32, name="dst", description="Destination byte address.")
+        self.length  = CSRStorage(32, name="length", description="Length in bytes.")
+        self.fill    = CSRStorage(name="fill",
+                                  description="Fill the destination with pattern instead of copying.")
+        self.pattern = CSRStorage(32, name="pattern", description="Fill pattern.")
+        self.start   = CSR(name="start")
+        self.start.description = "Write to start the operation."
+        self.done    = CSRStatus(name="done", reset=1, description="The operation has completed.")
+        self.error   = CSRStatus(name="error",
+                                 description="The last copy was not started, as src, dst or length "
+                                             "was not a multiple of the native word size.")
+
+        self.submodules.fifo = fifo = stream.SyncFIFO([("data", dw)], max(limit, 2))
+
+        fill      = Signal()
+        backward  = Signal()
+        src       = Signal(port.address_width)
+        dst       = Signal(port.address_width)
+        total     = Signal(32)
+        remaining = Signal(32)
+        head_mask = Signal(nbytes)
+        tail_mask = Signal(nbytes)
+        offset    = Signal(32)
+        chunk     = Signal(max=limit+1)
+        cur_off   = Signal(32)
+        cur_chunk = Signal(max=limit+1)
+        count     = Signal(max=limit+1)
+
+        # Setup ------------------------------------------------------------------------------------
+        first = self.dst.storage
+        last  = Signal(32)
+        self.comb += last.eq(self.dst.storage + self.length.storage - 1)
+
+        self.comb += [
+            chunk.eq(Mux(remaining < limit, remaining, limit)),
+            # Chunks are taken from the end when copying backward
+            offset.eq(Mux(backward, remaining - chunk, total - remaining))
+        ]
+
+        # Datapath ---------------------------------------------------------------------------------
+        windex  = Signal(32)
+        pattern = Signal(dw)
+        we      = Signal(nbytes)
+        self.comb += [
+            windex.eq(cur_off + count),
+            we.eq(Mux(fill & (windex == 0), head_mask, 2**nbytes - 1) &
+                  Mux(fill & (windex == total - 1), tail_mask, 2**nbytes - 1)),
+            port.wdata.data.eq(Mux(fill, pattern, fifo.source.data)),
+            port.wdata.we.eq(we),
+            fifo.source.ready.eq(port.wdata.ready & ~fill),
+            fifo.sink.valid.eq(port.rdata.valid),
+            fifo.sink.data.eq(port.rdata.data),
+            port.rdata.last.eq(0),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            port.cmd.length.eq(chunk)
+        ]
+        if dw == 16:
+            self.comb += pattern.eq(Mux((dst + windex)[0], self.pattern.storage[16:],
+                                                            self.pattern.storage[:16]))
+        else:
+            self.comb += pattern.eq(Replicate(self.pattern.storage, dw//32))
+
+        # Control ----------------------------------------------------------------------------------
+        misaligned = Signal()
+        self.comb += misaligned.eq(~self.fill.storage &
+                                   ((self.src.storage | self.dst.storage |
+                                     self.length.storage)[:shift] != 0))
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(self.start.re,
+               NextValue(self.error.status, misaligned)
+            ),
+            If(self.start.re & (self.length.storage != 0) & ~misaligned,
+               NextValue(self.done.status, 0),
+               NextValue(fill, self.fill.storage),
+               NextValue(src, self.src.storage[shift:]),
+               NextValue(dst, first[shift:]),
+               If(self.fill.storage,
+                  NextValue(backward, 0),
+                  NextValue(total, last[shift:] - first[shift:] + 1),
+                  NextValue(remaining, last[shift:] - first[shift:] + 1),
+                  NextState("WRITE-CMD")
+               ).Else(
+                  NextValue(backward, (self.dst.storage > self.src.storage) &
+                                      (self.dst.storage < self.src.storage + self.length.storage)),
+                  NextValue(total, self.length.storage[shift:]),
+                  NextValue(remaining, self.length.storage[shift:]),
+                  NextState("READ-CMD")
+               ),
+               NextValue(head_mask, Cat(*[first[:shift] <= i for i in range(nbytes)])),
+               NextValue(tail_mask, Cat(*[last[:shift] >= i for i in range(nbytes)]))
+            )
+        )
+        fsm.act("READ-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(0),
+            port.cmd.addr.eq(src + offset),
+            If(port.cmd.ready,
+               NextValue(cur_off, offset),
+               NextValue(cur_chunk, chunk),
+               NextValue(count, 0),
+               NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            If(port.rdata.valid,
+               NextValue(count, count + 1),
+               If(count == cur_chunk - 1,
+                  NextState("WRITE-CMD")
+               )
+            )
+        )
+        fsm.act("WRITE-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(1),
+            port.cmd.addr.eq(dst + offset),
+            If(port.cmd.ready,
+               NextValue(cur_off, offset),
+               NextValue(cur_chunk, chunk),
+               NextValue(count, 0),
+               NextState("WRITE")
+            )
+        )
+        fsm.act("WRITE",
+            If(port.wdata.ready,
+               NextValue(count, count + 1),
+               If(count == cur_chunk - 1,
+                  NextValue(remaining, remaining - cur_chunk),
+                  If(remaining == cur_chunk,
+                     NextValue(self.done.status, 1),
+                     NextState("IDLE")
+                  ).Elif(fill,
+                     NextState("WRITE-CMD")
+                  ).Else(
+                     NextState("READ-CMD")
+                  )
+               )
+            )
+        )
@@ -8,26 +8,51 @@ from litex.soc.interconnect import stream
 
 # LiteHyperRAMWishbone2Native --------------------------------------------------------------------------
 
+# Incrementing bursts (cti 0b010) with linear addressing are performed as a
+# single HyperBus burst.  Wrapping bursts (bte != 0) of wrap_bytes, which
+# must match the burst length in CR0, are performed as a single wrapped
+# HyperBus burst starting at the requested word, so a cache refill gets
+# the critical word first.  Other wrapping bursts are performed as single
+# accesses.  A wait state (stb low) within a burst ends the HyperBus burst,
+# with a masked word for writes, and the burst continues with a new command
+# once stb is raised again.  Read data arriving during the wait state is
+# dropped and read again.
+
 class LiteHyperRAMWishbone2Native(Module):
-    def __init__(self, wishbone, port, base_address=0x00000000):
+    def __init__(self, wishbone, port, base_address=0x00000000, wrap_bytes=None):
         wishbone_data_width = len(wishbone.dat_w)
         port_data_width     = len(port.wdata.data)
         assert wishbone_data_width >= port_data_width
 
         adr_offset = base_address >> log2_int(port.data_width//8)
 
+        # Burst Decoding ---------------------------------------------------------------------------
+        burst   = Signal()
+        wrapped = Signal()
+        if wrap_bytes is not None:
+            bte = {4: 0b01, 8: 0b10, 16: 0b11}.get(wrap_bytes//(wishbone_data_width//8))
+            if bte is None or base_address % wrap_bytes:
+                raise ValueError("Unsupported wrap size")
+            self.comb += wrapped.eq((wishbone.cti == 0b010) & (wishbone.bte == bte))
+        self.comb += burst.eq(((wishbone.cti == 0b010) & (wishbone.bte == 0)) | wrapped)
+
         # Write Datapath ---------------------------------------------------------------------------
         wdata_converter = stream.StrideConverter(
             [("data", wishbone_data_width), ("we", wishbone_data_width//8)],
             [("data", port_data_width),     ("we", port_data_width//8)],
         )
         self.submodules += wdata_converter
+        # Ends the burst with a masked word
+        wdata_end = Signal()
         self.comb += [
             wdata_converter.sink.valid.eq(wishbone.cyc & wishbone.stb & wishbone.we),
             wdata_converter.sink.data.eq(wishbone.dat_w),
             wdata_converter.sink.we.eq(wishbone.sel),
-            wdata_converter.sink.last.eq(1),
-            wdata_converter.source.connect(port.wdata)
+            wdata_converter.sink.last.eq(~burst),
+            wdata_converter.source.connect(port.wdata, omit=["valid", "we", "last"]),
+            port.wdata.valid.eq(wdata_end | wdata_converter.source.valid),
+            port.wdata.we.eq(Mux(wdata_end, 0, wdata_converter.source.we)),
+            port.wdata.last.eq(wdata_end | wdata_converter.source.last)
         ]
 
         # Read Datapath ----------------------------------------------------------------------------
@@ -45,11 +70,14 @@ class LiteHyperRAMWishbone2Native(Module):
         # Control ----------------------------------------------------------------------------------
         ratio = wishbone_data_width//port_data_width
         count = Signal(max=max(ratio, 2))
+        flush = Signal()
         self.comb += [
             port.cmd.we.eq(wishbone.we),
             port.cmd.aspace.eq(0),
-            port.cmd.burst_type.eq(1),
-            port.cmd.addr.eq(wishbone.adr*ratio - adr_offset)
+            port.cmd.burst_type.eq(~wrapped),
+            port.cmd.addr.eq(wishbone.adr*ratio - adr_offset),
+            # Single accesses have a known length, bursts end with last
+            port.cmd.length.eq(Mux(burst, 0, ratio))
         ]
         self.submodules.fsm = fsm = FSM(reset_state="CMD")
         fsm.act("CMD",
@@ -64,16 +92,162 @@ class LiteHyperRAMWishbone2Native(Module):
             )
         )
         fsm.act("WAIT-WRITE",
+            If(wishbone.cyc & wishbone.stb,
+                If(wdata_converter.sink.ready,
+                    wishbone.ack.eq(1),
+                    # Incrementing bursts continue with the next beat
+                    If(~burst, NextState("CMD"))
+                )
+            ).Else(
+                # Wait state, or cycle ended, within a burst
+                wdata_end.eq(1),
+                If(port.wdata.ready, NextState("CMD"))
+            )
+        )
+        fsm.act("WAIT-READ",
+	    If((~burst & (count == (ratio - 1))) | ~wishbone.cyc,
+	       port.rdata.last.eq(1)),
+            If(port.rdata.valid,
+	       NextValue(count, Mux(count == (ratio - 1), 0, count + 1)),
+               # Wait state within a burst: end it here, and drop the word
+               If(~wishbone.stb,
+                  port.rdata.last.eq(1),
+                  NextValue(flush, 1))),
+	    wishbone.ack.eq(rdata_converter.source.valid & wishbone.stb & ~flush),
+            # The up-converter registers its output, so wait for the last
+            # word to leave it before accepting the next command
+            If(rdata_converter.source.valid & rdata_converter.source.last,
+               NextValue(flush, 0),
+               NextState("CMD"))
+        )
+
+# LiteHyperRAMPipelinedWishbone2Native ---------------------------------------------------------------
+
+# Pipelined (Wishbone B4) variant.  Up to outstanding requests are queued
+# (stall is asserted while the queue is full) and acknowledged in order.
+# As long as the next queued request continues the current one (same
+# direction, next address), it is added to the running HyperBus burst, up
+# to max_burst bus words.
+
+class LiteHyperRAMPipelinedWishbone2Native(Module):
+    def __init__(self, wishbone, port, base_address=0x00000000, outstanding=4, max_burst=64):
+        wishbone_data_width = len(wishbone.dat_w)
+        port_data_width     = len(port.wdata.data)
+        assert wishbone_data_width >= port_data_width
+
+        adr_offset = base_address >> log2_int(port.data_width//8)
+
+        self.stall = Signal()
+        if hasattr(wishbone, "stall"):
+            self.comb += wishbone.stall.eq(self.stall)
+
+        # Request Queue ----------------------------------------------------------------------------
+        request = stream.SyncFIFO([
+            ("adr", len(wishbone.adr)),
+            ("we",  1),
+            ("dat", wishbone_data_width),
+            ("sel", wishbone_data_width//8)
+        ], max(outstanding, 2))
+        self.submodules += request
+        self.comb += [
+            request.sink.valid.eq(wishbone.cyc & wishbone.stb),
+            request.sink.adr.eq(wishbone.adr),
+            request.sink.we.eq(wishbone.we),
+            request.sink.dat.eq(wishbone.dat_w),
+            request.sink.sel.eq(wishbone.sel),
+            self.stall.eq(~request.sink.ready)
+        ]
+
+        # Request being transferred
+        cur_adr = Signal(len(wishbone.adr))
+        cur_dat = Signal(wishbone_data_width)
+        cur_sel = Signal(wishbone_data_width//8)
+        head = request.source
+        count = Signal(max=max(max_burst, 2))
+        advance = Signal()
+        self.sync += If(advance,
+            cur_adr.eq(head.adr),
+            cur_dat.eq(head.dat),
+            cur_sel.eq(head.sel)
+        )
+        self.comb += head.ready.eq(advance)
+
+        # Write Datapath ---------------------------------------------------------------------------
+        wdata_converter = stream.StrideConverter(
+            [("data", wishbone_data_width), ("we", wishbone_data_width//8)],
+            [("data", port_data_width),     ("we", port_data_width//8)],
+        )
+        self.submodules += wdata_converter
+        self.comb += [
+            wdata_converter.sink.data.eq(cur_dat),
+            wdata_converter.sink.we.eq(cur_sel),
+            wdata_converter.source.connect(port.wdata)
+        ]
+
+        # Read Datapath ----------------------------------------------------------------------------
+        rdata_converter = stream.StrideConverter(
+            [("data", port_data_width)],
+            [("data", wishbone_data_width)],
+        )
+        self.submodules += rdata_converter
+        self.comb += [
+            port.rdata.connect(rdata_converter.sink),
+            rdata_converter.source.ready.eq(1),
+            wishbone.dat_r.eq(rdata_converter.source.data),
+        ]
+
+        # Control ----------------------------------------------------------------------------------
+        ratio = wishbone_data_width//port_data_width
+        chunk = Signal(max=max(ratio, 2))
+        follows = Signal()
+        self.comb += [
+            follows.eq(head.valid & (head.we == port.cmd.we) &
+                       (head.adr == cur_adr + 1) & (count != max_burst - 1)),
+            port.cmd.aspace.eq(0),
+            port.cmd.burst_type.eq(1),
+            port.cmd.addr.eq(head.adr*ratio - adr_offset),
+        ]
+        self.submodules.fsm = fsm = FSM(reset_state="CMD")
+        fsm.act("CMD",
+            port.cmd.valid.eq(head.valid),
+            port.cmd.we.eq(head.we),
+            If(port.cmd.valid & port.cmd.ready,
+               advance.eq(1),
+               NextValue(count, 0),
+               NextValue(chunk, 0),
+               If(head.we,
+                  NextState("WRITE")
+               ).Else(
+                  NextState("READ")
+               )
+            )
+        )
+        fsm.act("WRITE",
+            port.cmd.we.eq(1),
+            wdata_converter.sink.valid.eq(1),
+            wdata_converter.sink.last.eq(~follows),
             If(wdata_converter.sink.ready,
                 wishbone.ack.eq(1),
-                NextState("CMD")
+                NextValue(count, count + 1),
+                If(follows,
+                   advance.eq(1)
+                ).Else(
+                   NextState("CMD")
+                )
             )
         )
-        fsm.act("WAIT-READ",
-	    If(((wishbone.cti != 0b010) & (count == (ratio - 1))) | ~wishbone.cyc,
-	       port.rdata.last.eq(1),
-	       If(port.rdata.valid, NextState("CMD"))),
+        fsm.act("READ",
+            port.cmd.we.eq(0),
+            If(chunk == (ratio - 1),
+               port.rdata.last.eq(~follows)),
             If(port.rdata.valid,
-	       NextValue(count, Mux(count == (ratio - 1), 0, count + 1))),
-	    wishbone.ack.eq(rdata_converter.source.valid),
+               NextValue(chunk, Mux(chunk == (ratio - 1), 0, chunk + 1)),
+               If(chunk == (ratio - 1),
+                  NextValue(count, count + 1),
+                  advance.eq(follows))),
+            wishbone.ack.eq(rdata_converter.source.valid),
+            # The up-converter registers its output, so wait for the last
+            # word to leave it before accepting the next command
+            If(rdata_converter.source.valid & rdata_converter.source.last,
+               NextState("CMD"))
         )
@@ -3,6 +3,17 @@
 
 class HyperRAMModule:
     max_initial_latency = 6
+    # Supported wrapped burst lengths in bytes
+    burst_lengths = (16, 32, 64, 128)
+    tCSHI = 10e-9  # CS# high between transactions
+    tRWR = 40e-9   # Read-write recovery
+    tCSM = 4e-6    # Maximum CS# low time
+    tCSS = 3e-9    # CS# setup to first CK edge
+    tCSH = 0       # CS# hold after last CK edge
+    tREFI = 4e-6   # Internal refresh interval
+    tRP = 200e-9   # RESET# pulse width
+    tRPH = 200e-9  # RESET# high to CS# low
+    tVCS = 150e-6  # Power-up to first access
 
     def __init__(self):
         pass
@@ -37,6 +48,8 @@ class S27KS0641DP(HyperRAMModule):
     nbanks = 1
     nrows = 8192
     ncols = 512
+    tCSHI = 6e-9
+    tRWR = 36e-9
 
 class S27KS0641(S27KS0641DP):
     pass
@@ -46,6 +59,8 @@ class S70KS1281DP(HyperRAMModule):
     nbanks = 2
     nrows = 8192
     ncols = 512
+    tCSHI = 6e-9
+    tRWR = 36e-9
 
 class S70KS1281(S70KS1281DP):
     pass
@@ -67,12 +82,16 @@ class S27KS0641DG(HyperRAMModule):
     nbanks = 1
     nrows = 8192
     ncols = 512
+    tCSHI = 7.5e-9
+    tRWR = 37.5e-9
 
 class S70KS1281DG(HyperRAMModule):
     maxclock = 133000000
     nbanks = 2
     nrows = 8192
     ncols = 512
+    tCSHI = 7.5e-9
+    tRWR = 37.5e-9
 
 class S70KL1282DP(HyperRAMModule):
     maxclock = 166000000
@@ -80,6 +99,8 @@ class S70KL1282DP(HyperRAMModule):
     nbanks = 2
     nrows = 8192
     ncols = 512
+    tCSHI = 6e-9
+    tRWR = 36e-9
 
 class S70KL1282GA(HyperRAMModule):
     maxclock = 200000000
@@ -87,6 +108,10 @@ class S70KL1282GA(HyperRAMModule):
     nbanks = 2
     nrows = 8192
     ncols = 512
+    tCSHI = 5e-9
+    tRWR = 35e-9
+    tCSS = 4e-9
+    tRPH = 150e-9
     
 class S70KS1282GA(HyperRAMModule):
     maxclock = 200000000
@@ -94,6 +119,10 @@ class S70KS1282GA(HyperRAMModule):
     nbanks = 2
     nrows = 8192
     ncols = 512
+    tCSHI = 5e-9
+    tRWR = 35e-9
+    tCSS = 4e-9
+    tRPH = 150e-9
 
 class S70KS1282(S70KS1282GA):
     pass
@@ -1 +1,2 @@
-from litehyperram.phy.ecp5hyperramphy import ECP5HYPERRAMPHY, ECP5HYPERRAMPHY2x
+from litehyperram.phy.ecp5hyperramphy import ECP5HYPERRAMPHY, ECP5HYPERRAMPHY2x, ECP5HYPERRAMPHYDQS, ECP5HYPERRAMPHY4x
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x, HyperRAMPHYModelDQS, HyperRAMPHYModel4x
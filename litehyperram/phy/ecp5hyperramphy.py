@@ -36,8 +36,17 @@
 #  {node: '.F..G'}],
 #  edge: ['A-F', 'B-D', 'C-G', 'D<-|->E 1 Tclk', 'F<-|->G 1.5 Tclk']}
 
+# Both PHYs can drive several ganged devices, which share CK, CS# and
+# RESET#, but each have their own DQ and RWDS: pads.dq then has 8 bits and
+# pads.rwds 1 bit per device, and the DQ/RWDS signals below are widened
+# the same way, device 0 in the lowest bits.
+
+from functools import reduce
+from operator import and_
+
 from migen import *
 from migen.fhdl.specials import Tristate
+from migen.genlib.cdc import MultiReg
 
 class ECP5HYPERRAMPHY(Module):
     def __init__(self, pads, sys_clk_freq=100e6):
@@ -48,14 +57,15 @@ class ECP5HYPERRAMPHY(Module):
         self.clk_enable = Signal()
         self.pll_locked = Signal()
 
-        self.rwds_da = Signal()
-        self.rwds_db = Signal()
-        self.rwds_qa = Signal()
-        self.rwds_qb = Signal()
-        self.dq_da = Signal(8)
-        self.dq_db = Signal(8)
-        self.dq_qa = Signal(8)
-        self.dq_qb = Signal(8)
+        nchips = len(pads.rwds)
+        self.rwds_da = Signal(nchips)
+        self.rwds_db = Signal(nchips)
+        self.rwds_qa = Signal(nchips)
+        self.rwds_qb = Signal(nchips)
+        self.dq_da = Signal(8*nchips)
+        self.dq_db = Signal(8*nchips)
+        self.dq_qa = Signal(8*nchips)
+        self.dq_qb = Signal(8*nchips)
         self.rwds_oe = Signal()
         self.dq_oe = Signal()
         self.cs_n = pads.cs_n
@@ -66,11 +76,12 @@ class ECP5HYPERRAMPHY(Module):
         else:
             self.reset_n = Signal()
 
-        rx_q0 = [self.dq_qa[i] for i in range(8)] + [self.rwds_qa]
-        rx_q1 = [self.dq_qb[i] for i in range(8)] + [self.rwds_qb]
-        tx_d0 = [self.dq_da[i] for i in range(8)] + [self.rwds_da]
-        tx_d1 = [self.dq_db[i] for i in range(8)] + [self.rwds_db]
-        oe = [self.dq_oe] * 8 + [self.rwds_oe]
+        io = [pads.dq[i] for i in range(8*nchips)] + [pads.rwds[i] for i in range(nchips)]
+        rx_q0 = [self.dq_qa[i] for i in range(8*nchips)] + [self.rwds_qa[i] for i in range(nchips)]
+        rx_q1 = [self.dq_qb[i] for i in range(8*nchips)] + [self.rwds_qb[i] for i in range(nchips)]
+        tx_d0 = [self.dq_da[i] for i in range(8*nchips)] + [self.rwds_da[i] for i in range(nchips)]
+        tx_d1 = [self.dq_db[i] for i in range(8*nchips)] + [self.rwds_db[i] for i in range(nchips)]
+        oe = [self.dq_oe] * 8*nchips + [self.rwds_oe] * nchips
 
         # Clock output is delayed 90 degrees to convert TX aligned and RX
         # centered into TX centered and RX aligned from the perspective of
@@ -107,11 +118,11 @@ class ECP5HYPERRAMPHY(Module):
             i_D1   = 0,
             o_Q    = pads.ck_p if hasattr(pads, "ck_p") else pads.clk)
 
-        for i in range(9):
+        for i in range(9*nchips):
             d = Signal()
             q = Signal()
             self.specials += [
-                Tristate(pads.dq[i] if i < 8 else pads.rwds, q, oe[i], d),
+                Tristate(io[i], q, oe[i], d),
                 Instance("IDDRX1F",
                     i_SCLK = ClockSignal(),
                     i_RST  = ResetSignal(),
@@ -141,30 +152,31 @@ class ECP5HYPERRAMPHY2x(Module):
         self.clk_enable = Signal()
         self.pll_locked = Signal(reset=1)
 
-        self.rwds_da = Signal()
-        self.rwds_db = Signal()
-        self.rwds_dc = Signal()
-        self.rwds_dd = Signal()
-        self.rwds_qa = Signal()
-        self.rwds_qb = Signal()
-        self.rwds_qc = Signal()
-        self.rwds_qd = Signal()
-        self.rwds_qa_wa = Signal()
-        self.rwds_qb_wa = Signal()
-        self.rwds_qc_wa = Signal()
-        self.rwds_qd_wa = Signal()
-        self.dq_da = Signal(8)
-        self.dq_db = Signal(8)
-        self.dq_dc = Signal(8)
-        self.dq_dd = Signal(8)
-        self.dq_qa = Signal(8)
-        self.dq_qb = Signal(8)
-        self.dq_qc = Signal(8)
-        self.dq_qd = Signal(8)
-        self.dq_qa_wa = Signal(8)
-        self.dq_qb_wa = Signal(8)
-        self.dq_qc_wa = Signal(8)
-        self.dq_qd_wa = Signal(8)
+        nchips = len(pads.rwds)
+        self.rwds_da = Signal(nchips)
+        self.rwds_db = Signal(nchips)
+        self.rwds_dc = Signal(nchips)
+        self.rwds_dd = Signal(nchips)
+        self.rwds_qa = Signal(nchips)
+        self.rwds_qb = Signal(nchips)
+        self.rwds_qc = Signal(nchips)
+        self.rwds_qd = Signal(nchips)
+        self.rwds_qa_wa = Signal(nchips)
+        self.rwds_qb_wa = Signal(nchips)
+        self.rwds_qc_wa = Signal(nchips)
+        self.rwds_qd_wa = Signal(nchips)
+        self.dq_da = Signal(8*nchips)
+        self.dq_db = Signal(8*nchips)
+        self.dq_dc = Signal(8*nchips)
+        self.dq_dd = Signal(8*nchips)
+        self.dq_qa = Signal(8*nchips)
+        self.dq_qb = Signal(8*nchips)
+        self.dq_qc = Signal(8*nchips)
+        self.dq_qd = Signal(8*nchips)
+        self.dq_qa_wa = Signal(8*nchips)
+        self.dq_qb_wa = Signal(8*nchips)
+        self.dq_qc_wa = Signal(8*nchips)
+        self.dq_qd_wa = Signal(8*nchips)
         self.rwds_oe = Signal()
         self.dq_oe = Signal()
         self.cs_n = pads.cs_n
@@ -175,63 +187,99 @@ class ECP5HYPERRAMPHY2x(Module):
         else:
             self.reset_n = Signal()
 
-        rx_q0 = [self.dq_qa_wa[i] for i in range(8)] + [self.rwds_qa_wa]
-        rx_q1 = [self.dq_qb_wa[i] for i in range(8)] + [self.rwds_qb_wa]
-        rx_q2 = [self.dq_qc_wa[i] for i in range(8)] + [self.rwds_qc_wa]
-        rx_q3 = [self.dq_qd_wa[i] for i in range(8)] + [self.rwds_qd_wa]
-        tx_d0 = [self.dq_da[i] for i in range(8)] + [self.rwds_da]
-        tx_d1 = [self.dq_db[i] for i in range(8)] + [self.rwds_db]
-        tx_d2 = [self.dq_dc[i] for i in range(8)] + [self.rwds_dc]
-        tx_d3 = [self.dq_dd[i] for i in range(8)] + [self.rwds_dd]
-        oe = [self.dq_oe] * 8 + [self.rwds_oe]
+        io = [pads.dq[i] for i in range(8*nchips)] + [pads.rwds[i] for i in range(nchips)]
+        rx_q0 = [self.dq_qa_wa[i] for i in range(8*nchips)] + [self.rwds_qa_wa[i] for i in range(nchips)]
+        rx_q1 = [self.dq_qb_wa[i] for i in range(8*nchips)] + [self.rwds_qb_wa[i] for i in range(nchips)]
+        rx_q2 = [self.dq_qc_wa[i] for i in range(8*nchips)] + [self.rwds_qc_wa[i] for i in range(nchips)]
+        rx_q3 = [self.dq_qd_wa[i] for i in range(8*nchips)] + [self.rwds_qd_wa[i] for i in range(nchips)]
+        tx_d0 = [self.dq_da[i] for i in range(8*nchips)] + [self.rwds_da[i] for i in range(nchips)]
+        tx_d1 = [self.dq_db[i] for i in range(8*nchips)] + [self.rwds_db[i] for i in range(nchips)]
+        tx_d2 = [self.dq_dc[i] for i in range(8*nchips)] + [self.rwds_dc[i] for i in range(nchips)]
+        tx_d3 = [self.dq_dd[i] for i in range(8*nchips)] + [self.rwds_dd[i] for i in range(nchips)]
+        oe = [self.dq_oe] * 8*nchips + [self.rwds_oe] * nchips
+        chip = [i//8 for i in range(8*nchips)] + list(range(nchips))
 
 	# Align read data so that the first word with RWDS set on
-	# the negative edge of CK becomes the high word
-        word_align = Signal()
-        rwds_qc_save = Signal(8)
-        rwds_qd_save = Signal(8)
-        dq_qc_save = Signal(8)
-        dq_qd_save = Signal(8)
-        self.comb += \
-            If(word_align,
-                self.dq_qa.eq(dq_qc_save),
-                self.dq_qb.eq(dq_qd_save),
-                self.dq_qc.eq(self.dq_qa_wa),
-                self.dq_qd.eq(self.dq_qb_wa),
-                self.rwds_qa.eq(rwds_qc_save),
-                self.rwds_qb.eq(rwds_qd_save),
-                self.rwds_qc.eq(self.rwds_qa_wa),
-                self.rwds_qd.eq(self.rwds_qb_wa),
-            ).Elif(self.rwds_qc_wa & ~self.rwds_qa_wa,
-                self.dq_qa.eq(0),
-                self.dq_qb.eq(0),
-                self.dq_qc.eq(0),
-                self.dq_qd.eq(0),
-                self.rwds_qa.eq(0),
-                self.rwds_qb.eq(0),
-                self.rwds_qc.eq(0),
-                self.rwds_qd.eq(0)
-            ).Else(
-                self.dq_qa.eq(self.dq_qa_wa),
-                self.dq_qb.eq(self.dq_qb_wa),
-                self.dq_qc.eq(self.dq_qc_wa),
-                self.dq_qd.eq(self.dq_qd_wa),
-                self.rwds_qa.eq(self.rwds_qa_wa),
-                self.rwds_qb.eq(self.rwds_qb_wa),
-                self.rwds_qc.eq(self.rwds_qc_wa),
-                self.rwds_qd.eq(self.rwds_qd_wa)
-            )
-        self.sync += [
-            If(word_align,
-               If(~self.rwds_qc_wa, word_align.eq(0))
-            ).Elif(self.rwds_qc_wa & ~self.rwds_qa_wa,
-               word_align.eq(1)
-            ),
-            dq_qc_save.eq(self.dq_qc_wa),
-            dq_qd_save.eq(self.dq_qd_wa),
-            rwds_qc_save.eq(self.rwds_qc_wa),
-            rwds_qd_save.eq(self.rwds_qd_wa)
-        ]
+	# the negative edge of CK becomes the high word, for each device
+        for c in range(nchips):
+            dq = slice(8*c, 8*c+8)
+            word_align = Signal()
+            rwds_qc_save = Signal()
+            rwds_qd_save = Signal()
+            dq_qc_save = Signal(8)
+            dq_qd_save = Signal(8)
+            self.comb += \
+                If(word_align,
+                    self.dq_qa[dq].eq(dq_qc_save),
+                    self.dq_qb[dq].eq(dq_qd_save),
+                    self.dq_qc[dq].eq(self.dq_qa_wa[dq]),
+                    self.dq_qd[dq].eq(self.dq_qb_wa[dq]),
+                    self.rwds_qa[c].eq(rwds_qc_save),
+                    self.rwds_qb[c].eq(rwds_qd_save),
+                    self.rwds_qc[c].eq(self.rwds_qa_wa[c]),
+                    self.rwds_qd[c].eq(self.rwds_qb_wa[c]),
+                ).Elif(self.rwds_qc_wa[c] & ~self.rwds_qa_wa[c],
+                    self.dq_qa[dq].eq(0),
+                    self.dq_qb[dq].eq(0),
+                    self.dq_qc[dq].eq(0),
+                    self.dq_qd[dq].eq(0),
+                    self.rwds_qa[c].eq(0),
+                    self.rwds_qb[c].eq(0),
+                    self.rwds_qc[c].eq(0),
+                    self.rwds_qd[c].eq(0)
+                ).Else(
+                    self.dq_qa[dq].eq(self.dq_qa_wa[dq]),
+                    self.dq_qb[dq].eq(self.dq_qb_wa[dq]),
+                    self.dq_qc[dq].eq(self.dq_qc_wa[dq]),
+                    self.dq_qd[dq].eq(self.dq_qd_wa[dq]),
+                    self.rwds_qa[c].eq(self.rwds_qa_wa[c]),
+                    self.rwds_qb[c].eq(self.rwds_qb_wa[c]),
+                    self.rwds_qc[c].eq(self.rwds_qc_wa[c]),
+                    self.rwds_qd[c].eq(self.rwds_qd_wa[c])
+                )
+            self.sync += [
+                If(word_align,
+                   If(~self.rwds_qc_wa[c], word_align.eq(0))
+                ).Elif(self.rwds_qc_wa[c] & ~self.rwds_qa_wa[c],
+                   word_align.eq(1)
+                ),
+                dq_qc_save.eq(self.dq_qc_wa[dq]),
+                dq_qd_save.eq(self.dq_qd_wa[dq]),
+                rwds_qc_save.eq(self.rwds_qc_wa[c]),
+                rwds_qd_save.eq(self.rwds_qd_wa[c])
+            ]
+
+        # Delays of read capture (DQ and RWDS of each device) and of CK, as
+        # signed DELAYF tap offsets from the default of their DEL_MODE.
+        # Taps are moved one step at a time towards the targets, and
+        # delay_ready is set once all have reached them.
+        self.rx_delay = [Signal((8, True)) for _ in range(nchips)]
+        self.ck_delay = Signal((8, True))
+        self.delay_ready = Signal()
+
+        def delay_control(target):
+            current   = Signal((8, True))
+            move      = Signal()
+            direction = Signal()
+            ready     = Signal()
+            decrease  = Signal()
+            self.comb += [
+                decrease.eq(target < current),
+                ready.eq(~move & (current == target))
+            ]
+            # DIRECTION (0 = more delay) is set the cycle before MOVE
+            self.sync += If(move,
+                            move.eq(0)
+                         ).Elif((current != target) & (direction == decrease),
+                            move.eq(1),
+                            current.eq(Mux(decrease, current - 1, current + 1))
+                         ).Else(
+                            direction.eq(decrease))
+            return move, direction, ready
+
+        rx_control = [delay_control(delay) for delay in self.rx_delay]
+        ck_control = delay_control(self.ck_delay)
+        self.comb += self.delay_ready.eq(reduce(and_, [ready for _, _, ready in rx_control + [ck_control]]))
 
         clk = Signal()
         self.specials += [
@@ -248,18 +296,24 @@ class ECP5HYPERRAMPHY2x(Module):
             Instance("DELAYF",
                 p_DEL_MODE  = "ECLK_ALIGNED",
                 i_A         = clk,
+                i_LOADN     = ~ResetSignal("sys"),
+                i_MOVE      = ck_control[0],
+                i_DIRECTION = ck_control[1],
                 o_Z         = pads.ck_p if hasattr(pads, "ck_p") else pads.clk
             )
         ]
-        for i in range(9):
+        for i in range(9*nchips):
             d = Signal()
             q = Signal()
             d_delayed = Signal()
             self.specials += [
-                Tristate(pads.dq[i] if i < 8 else pads.rwds, q, oe[i], d),
+                Tristate(io[i], q, oe[i], d),
                 Instance("DELAYF",
                     p_DEL_MODE  = "ECLK_CENTERED",
                     i_A         = d,
+                    i_LOADN     = ~ResetSignal("sys"),
+                    i_MOVE      = rx_control[chip[i]][0],
+                    i_DIRECTION = rx_control[chip[i]][1],
                     o_Z         = d_delayed
                 ),
                 Instance("IDDRX2F",
@@ -287,3 +341,327 @@ class ECP5HYPERRAMPHY2x(Module):
         # Assume PSC is not needed (non DCARS part)
         if hasattr(pads, "psc_p"):
             self.comb += pads.psc_p.eq(0)
+
+
+
+# The following PHY has the interface of ECP5HYPERRAMPHY2x, but captures
+# read data on RWDS, using the DQS logic of the ECP5 I/O banks: RWDS of
+# each device goes to a DQSBUFM, which delays it by 90 degrees (with the
+# code from a DDRDLLA) and clocks DQ into the read FIFOs of IDDRX2DQA,
+# read out with ECLK/SCLK.  The device pads must be placed in a DQS group,
+# RWDS on its DQS pin.
+#
+# DATAVALID of the DQSBUFM marks the cycles with read data.  Since CK runs
+# for whole sys cycles, these hold a complete word, which is passed on
+# with rwds_qa/rwds_qc set.  RWDS levels are not seen otherwise, so the
+# latency indicated during CA is not known to the controller and fixed
+# latency must be used (strobed_rx).  The DQS read window is open while
+# CS# is low and neither DQ nor RWDS are driven, starting one cycle after
+# CA so that the release of the latency indication is not taken for a
+# strobe.  read_clk_sel sets READCLKSEL of the DQSBUFMs, to match the
+# round trip delay of the board.
+
+class ECP5HYPERRAMPHYDQS(Module):
+    def __init__(self, pads, read_clk_sel=0):
+
+        self.tx_latency = 3
+        # One more than IDDRX2F, for the read FIFO
+        self.rx_latency = 3
+        self.strobed_rx = True
+
+        self.clk_enable = Signal()
+        self.pll_locked = Signal()
+
+        nchips = len(pads.rwds)
+        self.rwds_da = Signal(nchips)
+        self.rwds_db = Signal(nchips)
+        self.rwds_dc = Signal(nchips)
+        self.rwds_dd = Signal(nchips)
+        self.rwds_qa = Signal(nchips)
+        self.rwds_qb = Signal(nchips)
+        self.rwds_qc = Signal(nchips)
+        self.rwds_qd = Signal(nchips)
+        self.dq_da = Signal(8*nchips)
+        self.dq_db = Signal(8*nchips)
+        self.dq_dc = Signal(8*nchips)
+        self.dq_dd = Signal(8*nchips)
+        self.dq_qa = Signal(8*nchips)
+        self.dq_qb = Signal(8*nchips)
+        self.dq_qc = Signal(8*nchips)
+        self.dq_qd = Signal(8*nchips)
+        self.rwds_oe = Signal()
+        self.dq_oe = Signal()
+        self.cs_n = pads.cs_n
+        if hasattr(pads, "reset_n"):
+            self.reset_n = pads.reset_n
+        elif hasattr(pads, "rst_n"):
+            self.reset_n = pads.rst_n
+        else:
+            self.reset_n = Signal()
+
+        # DDRDLLA initialization: once locked, the DQSBUFMs are paused while
+        # the delay code is updated, after which the PHY is ready
+        dll_lock = Signal()
+        dll_locked = Signal()
+        ddrdel = Signal()
+        pause = Signal()
+        update = Signal()
+        init_cnt = Signal(6)
+        self.specials += [
+            Instance("DDRDLLA",
+                i_CLK      = ClockSignal("sys2x"),
+                i_RST      = ResetSignal("sys"),
+                i_UDDCNTLN = ~update,
+                i_FREEZE   = 0,
+                o_DDRDEL   = ddrdel,
+                o_LOCK     = dll_lock
+            ),
+            MultiReg(dll_lock, dll_locked)
+        ]
+        self.sync += If(~dll_locked,
+                        init_cnt.eq(0)
+                     ).Elif(init_cnt != 2**len(init_cnt) - 1,
+                        init_cnt.eq(init_cnt + 1))
+        self.comb += [
+            pause.eq((init_cnt >= 8) & (init_cnt < 40)),
+            update.eq((init_cnt >= 16) & (init_cnt < 24)),
+            self.pll_locked.eq(init_cnt == 2**len(init_cnt) - 1)
+        ]
+
+        read_window = Signal()
+        self.sync += read_window.eq(~self.cs_n & ~self.dq_oe & ~self.rwds_oe)
+
+        self.specials += Instance("ODDRX2F",
+            i_SCLK = ClockSignal("sys"),
+            i_ECLK = ClockSignal("sys2x_90"),
+            i_RST  = ResetSignal("sys"),
+            i_D0   = 0,
+            i_D1   = self.clk_enable,
+            i_D2   = 0,
+            i_D3   = self.clk_enable,
+            o_Q    = pads.ck_p if hasattr(pads, "ck_p") else pads.clk
+        )
+
+        tx_d = [self.dq_da, self.dq_db, self.dq_dc, self.dq_dd]
+        rx_q = [self.dq_qa, self.dq_qb, self.dq_qc, self.dq_qd]
+        tx_rwds = [self.rwds_da, self.rwds_db, self.rwds_dc, self.rwds_dd]
+        for c in range(nchips):
+            rwds_i = Signal()
+            rwds_o = Signal()
+            dqsr90 = Signal()
+            rdpntr = Signal(3)
+            wrpntr = Signal(3)
+            datavalid = Signal()
+            self.specials += [
+                Tristate(pads.rwds[c], rwds_o, self.rwds_oe, rwds_i),
+                Instance("ODDRX2F",
+                    i_SCLK = ClockSignal("sys"),
+                    i_ECLK = ClockSignal("sys2x"),
+                    i_RST  = ResetSignal("sys"),
+                    i_D0   = tx_rwds[0][c],
+                    i_D1   = tx_rwds[1][c],
+                    i_D2   = tx_rwds[2][c],
+                    i_D3   = tx_rwds[3][c],
+                    o_Q    = rwds_o
+                ),
+                Instance("DQSBUFM",
+                    p_DQS_LI_DEL_ADJ = "MINUS",
+                    p_DQS_LI_DEL_VAL = 1,
+                    p_DQS_LO_DEL_ADJ = "MINUS",
+                    p_DQS_LO_DEL_VAL = 4,
+                    i_SCLK        = ClockSignal("sys"),
+                    i_ECLK        = ClockSignal("sys2x"),
+                    i_RST         = ResetSignal("sys"),
+                    i_DDRDEL      = ddrdel,
+                    i_PAUSE       = pause,
+                    i_DQSI        = rwds_i,
+                    i_READ0       = read_window,
+                    i_READ1       = read_window,
+                    i_READCLKSEL0 = read_clk_sel & 1,
+                    i_READCLKSEL1 = (read_clk_sel >> 1) & 1,
+                    i_READCLKSEL2 = (read_clk_sel >> 2) & 1,
+                    # Delays from DDRDEL only
+                    i_RDLOADN     = 0,
+                    i_RDMOVE      = 0,
+                    i_RDDIRECTION = 1,
+                    i_WRLOADN     = 0,
+                    i_WRMOVE      = 0,
+                    i_WRDIRECTION = 1,
+                    o_DQSR90      = dqsr90,
+                    **{"o_RDPNTR{}".format(i): rdpntr[i] for i in range(3)},
+                    **{"o_WRPNTR{}".format(i): wrpntr[i] for i in range(3)},
+                    o_DATAVALID   = datavalid
+                )
+            ]
+            self.comb += [
+                self.rwds_qa[c].eq(datavalid),
+                self.rwds_qc[c].eq(datavalid)
+            ]
+            for i in range(8*c, 8*c+8):
+                d = Signal()
+                q = Signal()
+                d_delayed = Signal()
+                self.specials += [
+                    Tristate(pads.dq[i], q, self.dq_oe, d),
+                    Instance("DELAYG",
+                        p_DEL_MODE = "DQS_ALIGNED_X2",
+                        i_A        = d,
+                        o_Z        = d_delayed
+                    ),
+                    Instance("IDDRX2DQA",
+                        i_SCLK   = ClockSignal("sys"),
+                        i_ECLK   = ClockSignal("sys2x"),
+                        i_RST    = ResetSignal("sys"),
+                        i_DQSR90 = dqsr90,
+                        **{"i_RDPNTR{}".format(j): rdpntr[j] for j in range(3)},
+                        **{"i_WRPNTR{}".format(j): wrpntr[j] for j in range(3)},
+                        i_D      = d_delayed,
+                        o_Q0     = rx_q[0][i],
+                        o_Q1     = rx_q[1][i],
+                        o_Q2     = rx_q[2][i],
+                        o_Q3     = rx_q[3][i]
+                    ),
+                    Instance("ODDRX2F",
+                        i_SCLK = ClockSignal("sys"),
+                        i_ECLK = ClockSignal("sys2x"),
+                        i_RST  = ResetSignal("sys"),
+                        i_D0   = tx_d[0][i],
+                        i_D1   = tx_d[1][i],
+                        i_D2   = tx_d[2][i],
+                        i_D3   = tx_d[3][i],
+                        o_Q    = q
+                    )
+                ]
+
+        # Assume PSC is not needed (non DCARS part)
+        if hasattr(pads, "psc_p"):
+            self.comb += pads.psc_p.eq(0)
+
+
+
+# The following PHY clocks out four CK cycles per sys cycle, for a sys
+# clock of a quarter of the HyperBus clock.  ECP5 has no X4 gearing, so a
+# 2:1 gearbox in the fabric passes each word to the X2 primitives (as in
+# ECP5HYPERRAMPHY2x) in two sys2x cycles, beats a-d first.  sys2x must be
+# twice and sys4x four times the sys clock, in phase with it, and sys4x_90
+# as sys4x but delayed 90 degrees.  The latencies include the gearbox.
+#
+# Words are not aligned to RWDS: the controller, which knows the initial
+# latency, takes care of data starting in the middle of a sys cycle.
+
+class ECP5HYPERRAMPHY4x(Module):
+    def __init__(self, pads):
+
+        self.tx_latency = 2
+        self.rx_latency = 2
+
+        self.clk_enable = Signal()
+        self.pll_locked = Signal(reset=1)
+
+        nchips = len(pads.rwds)
+        beats = "abcdefgh"
+        for b in beats:
+            setattr(self, "rwds_d" + b, Signal(nchips))
+            setattr(self, "rwds_q" + b, Signal(nchips))
+            setattr(self, "dq_d" + b, Signal(8*nchips))
+            setattr(self, "dq_q" + b, Signal(8*nchips))
+        self.rwds_oe = Signal()
+        self.dq_oe = Signal()
+        self.cs_n = pads.cs_n
+        if hasattr(pads, "reset_n"):
+            self.reset_n = pads.reset_n
+        elif hasattr(pads, "rst_n"):
+            self.reset_n = pads.rst_n
+        else:
+            self.reset_n = Signal()
+
+        io = [pads.dq[i] for i in range(8*nchips)] + [pads.rwds[i] for i in range(nchips)]
+        oe = [self.dq_oe] * 8*nchips + [self.rwds_oe] * nchips
+        tx_d = [Cat(getattr(self, "dq_d" + b), getattr(self, "rwds_d" + b)) for b in beats]
+        rx_q = [Cat(getattr(self, "dq_q" + b), getattr(self, "rwds_q" + b)) for b in beats]
+
+        # Gearbox: first is set in the sys2x cycle starting with a sys cycle.
+        # Beats a-d are passed on in the second half of the sys cycle, and
+        # e-h in the first half of the next.  Read beats of the first half
+        # are held until the end of the sys cycle.
+        toggle = Signal()
+        toggle_sys2x = Signal()
+        first = Signal()
+        self.sync += toggle.eq(~toggle)
+        self.sync.sys2x += toggle_sys2x.eq(toggle)
+        self.comb += first.eq(toggle != toggle_sys2x)
+
+        tx_x2 = [Signal(9*nchips) for _ in range(4)]
+        tx_hold = [Signal(9*nchips) for _ in range(4)]
+        rx_x2 = [Signal(9*nchips) for _ in range(4)]
+        rx_hold = [Signal(9*nchips) for _ in range(4)]
+        clk_enable_x2 = Signal()
+        self.sync.sys2x += [
+            If(first,
+               *[tx_x2[i].eq(tx_d[i]) for i in range(4)],
+               *[tx_hold[i].eq(tx_d[4+i]) for i in range(4)],
+               *[rx_hold[i].eq(rx_x2[i]) for i in range(4)],
+               clk_enable_x2.eq(self.clk_enable)
+            ).Else(
+               *[tx_x2[i].eq(tx_hold[i]) for i in range(4)]
+            )
+        ]
+        self.sync += [
+            *[rx_q[i].eq(rx_hold[i]) for i in range(4)],
+            *[rx_q[4+i].eq(rx_x2[i]) for i in range(4)]
+        ]
+
+        clk = Signal()
+        self.specials += [
+            Instance("ODDRX2F",
+                i_SCLK = ClockSignal("sys2x"),
+                i_ECLK = ClockSignal("sys4x_90"),
+                i_RST  = ResetSignal("sys"),
+                i_D0   = 0,
+                i_D1   = clk_enable_x2,
+                i_D2   = 0,
+                i_D3   = clk_enable_x2,
+                o_Q    = clk
+            ),
+            Instance("DELAYF",
+                p_DEL_MODE  = "ECLK_ALIGNED",
+                i_A         = clk,
+                o_Z         = pads.ck_p if hasattr(pads, "ck_p") else pads.clk
+            )
+        ]
+        for i in range(9*nchips):
+            d = Signal()
+            q = Signal()
+            d_delayed = Signal()
+            self.specials += [
+                Tristate(io[i], q, oe[i], d),
+                Instance("DELAYF",
+                    p_DEL_MODE  = "ECLK_CENTERED",
+                    i_A         = d,
+                    o_Z         = d_delayed
+                ),
+                Instance("IDDRX2F",
+                    i_SCLK = ClockSignal("sys2x"),
+                    i_ECLK = ClockSignal("sys4x"),
+                    i_RST  = ResetSignal("sys"),
+                    i_D    = d_delayed,
+                    o_Q0   = rx_x2[0][i],
+                    o_Q1   = rx_x2[1][i],
+                    o_Q2   = rx_x2[2][i],
+                    o_Q3   = rx_x2[3][i]
+                ),
+                Instance("ODDRX2F",
+                    i_SCLK = ClockSignal("sys2x"),
+                    i_ECLK = ClockSignal("sys4x"),
+                    i_RST  = ResetSignal("sys"),
+                    i_D0   = tx_x2[0][i],
+                    i_D1   = tx_x2[1][i],
+                    i_D2   = tx_x2[2][i],
+                    i_D3   = tx_x2[3][i],
+                    o_Q    = q
+                )
+            ]
+
+        # Assume PSC is not needed (non DCARS part)
+        if hasattr(pads, "psc_p"):
+            self.comb += pads.psc_p.eq(0)
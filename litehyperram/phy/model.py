@@ -0,0 +1,561 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+# HyperRAM simulation model ------------------------------------------------------------------------
+
+# The PHY models below have the same controller side interface as the ECP5
+# PHYs, but instead of driving pads they feed a behavioral model of the
+# HyperRAM device from a simulation generator.  Time on the HyperBus side is
+# counted in beats, one beat being one CK cycle carrying two bytes (A on the
+# rising edge, B on the falling edge).  The 1X model transfers one beat per
+# system clock and the 2X model two.
+#
+# Usage:
+#
+#   phy = HyperRAMPHYModel(module, sys_clk_freq)
+#   core = LiteHyperRAMCore(phy, module, sys_clk_freq)
+#   run_simulation(dut, [testbench(core.get_port()), phy.generator()])
+#   assert not phy.device.errors
+
+from collections import deque
+
+from migen import *
+
+
+class HyperRAMModel:
+    """Behavioral model and protocol checker for a HyperRAM device
+
+    The model decodes CA words, implements memory and register space for
+    each die of the module, and applies the initial latency configured in
+    CR0, doubled in fixed latency mode or when a refresh collides with the
+    start of a transaction in variable latency mode.  Protocol and timing
+    violations are appended to ``errors``, and bus usage is counted in
+    ``stats``.
+
+    ``read_skew`` is the number of beats between the end of the initial
+    latency and the first read data beat.  It models the device output
+    delay and round trip through the board, and the default matches the
+    capture window assumed by the 1X READ_DELAY state of the controller.
+    """
+
+    burst_words = { 0b00: 64, 0b01: 32, 0b10: 8, 0b11: 16 }
+    il_decode = { 0b1110: 3, 0b1111: 4, 0b0000: 5, 0b0001: 6, 0b0010: 7 }
+
+    cr0_reset = 0x8f1f
+    cr1_reset = 0xffc1
+
+    def __init__(self, module, clk_freq, read_skew=2, refresh_interval=None,
+                 refresh_duration=40e-9, tcsm=None, trwr=None, tcshi=None,
+                 tcss=None, trph=None, verbose=False):
+        self.module = module
+        self.clk_freq = clk_freq
+        self.read_skew = read_skew
+        # Timings default to those of the module
+        self.tcsm = module.tCSM if tcsm is None else tcsm
+        self.trwr = module.tRWR if trwr is None else trwr
+        self.tcshi = module.tCSHI if tcshi is None else tcshi
+        self.tcss = module.tCSS if tcss is None else tcss
+        self.trph = module.tRPH if trph is None else trph
+        if refresh_interval is None:
+            refresh_interval = module.tREFI
+        self.verbose = verbose
+
+        self.die_bits = log2_int(module.nrows * module.ncols)
+        self.size = module.nbanks << self.die_bits
+        self.mem = {}
+        self.errors = []
+
+        self.refresh_period = (int(refresh_interval * clk_freq)
+                               if refresh_interval else None)
+        self.refresh_beats = int(refresh_duration * clk_freq)
+        self.next_refresh = self.refresh_period
+        self.refresh_pending = False
+        self.refresh_busy_until = 0
+
+        self.time = 0
+        self.state = "IDLE"
+        self.reset_n = True
+        self.reset_time = None
+        self.cs_fall = None
+        self.cs_rise = None
+        self.stats = dict.fromkeys([
+            "beats", "idle", "ca", "latency", "data", "stall", "overhead",
+            "reads", "writes", "reg_reads", "reg_writes",
+            "read_words", "write_words", "refresh_collisions"], 0)
+        self.reset()
+
+    def reset(self):
+        self.cr0 = [self.cr0_reset] * self.module.nbanks
+        self.cr1 = [self.cr1_reset] * self.module.nbanks
+
+    def error(self, msg):
+        msg = "{:.1f} ns: {}".format(self.time * 1e9 / self.clk_freq, msg)
+        if self.verbose:
+            print("HyperRAM: " + msg)
+        self.errors.append(msg)
+
+    def ns(self, beats):
+        return beats * 1e9 / self.clk_freq
+
+    # Configuration --------------------------------------------------------------------------------
+
+    def initial_latency(self, die):
+        return self.il_decode.get((self.cr0[die] >> 4) & 0xf, 6)
+
+    def fixed_latency(self, die):
+        return bool(self.cr0[die] & 0x0008)
+
+    def read_register(self, addr):
+        die = addr >> self.die_bits
+        reg = addr & ((1 << self.die_bits) - 1)
+        if reg == 0x000:
+            return ((die << 14) |
+                    ((log2_int(self.module.nrows) - 1) << 8) |
+                    ((log2_int(self.module.ncols) - 1) << 4) | 0b0001)
+        elif reg == 0x001:
+            return 0x0001
+        elif reg == 0x800:
+            return self.cr0[die]
+        elif reg == 0x801:
+            return self.cr1[die]
+        self.error("Read from unknown register 0x{:x}".format(addr))
+        return 0
+
+    def write_register(self, addr, value):
+        die = addr >> self.die_bits
+        reg = addr & ((1 << self.die_bits) - 1)
+        if reg == 0x800:
+            if ((value >> 4) & 0xf) not in self.il_decode:
+                self.error("Reserved initial latency in CR0 0x{:04x}".format(value))
+            self.cr0[die] = value
+        elif reg == 0x801:
+            self.cr1[die] = value
+        else:
+            self.error("Write to read-only register 0x{:x}".format(addr))
+
+    # Bursts ---------------------------------------------------------------------------------------
+
+    def next_address(self):
+        if self.linear:
+            self.addr = (self.addr + 1) % self.size
+            return
+        n = self.burst_words[self.cr0[self.die] & 0b11]
+        base = self.addr & ~(n - 1)
+        self.wrap_count += 1
+        if self.wrap_count == n and not (self.cr0[self.die] & 0b100):
+            # Hybrid burst, continue linearly after one wrap
+            self.linear = True
+            self.addr = (self.wrap_start & ~(n - 1)) + n
+        else:
+            self.addr = base | ((self.addr + 1) & (n - 1))
+
+    # Transactions ---------------------------------------------------------------------------------
+
+    def begin(self):
+        t = self.time
+        if self.cs_rise is not None and self.ns(t - self.cs_rise) < self.tcshi * 1e9:
+            self.error("tCSHI violated ({:.1f} ns)".format(self.ns(t - self.cs_rise)))
+        if self.reset_time is not None:
+            if self.ns(t - self.reset_time) < self.trph * 1e9:
+                self.error("tRPH violated ({:.1f} ns)".format(self.ns(t - self.reset_time)))
+            self.reset_time = None
+        collision = self.refresh_pending or t < self.refresh_busy_until
+        self.refresh_pending = False
+        self.double_latency = any(self.fixed_latency(die)
+                                  for die in range(self.module.nbanks))
+        if collision and not self.double_latency:
+            self.double_latency = True
+            self.stats["refresh_collisions"] += 1
+        self.cs_fall = t
+        self.ca = []
+        self.state = "CA"
+
+    def end(self):
+        t = self.time
+        if self.state == "CA":
+            self.error("CS# deasserted during command-address")
+        if self.ns(t - self.cs_fall) > self.tcsm * 1e9:
+            self.error("tCSM violated ({:.1f} ns)".format(self.ns(t - self.cs_fall)))
+        self.cs_rise = t
+        self.state = "IDLE"
+
+    def decode(self):
+        ca = (self.ca[0] << 32) | (self.ca[1] << 16) | self.ca[2]
+        self.read = bool(ca & (1 << 47))
+        self.aspace = bool(ca & (1 << 46))
+        self.linear = bool(ca & (1 << 45))
+        self.addr = (((ca >> 16) & ((1 << 29) - 1)) << 3 | (ca & 0b111)) % self.size
+        self.die = self.addr >> self.die_bits
+        self.wrap_start = self.addr
+        self.wrap_count = 0
+        if self.cs_rise is not None and self.ns(self.time - self.cs_rise) < self.trwr * 1e9:
+            self.error("tRWR violated ({:.1f} ns)".format(self.ns(self.time - self.cs_rise)))
+        if self.read:
+            self.stats["reg_reads" if self.aspace else "reads"] += 1
+        else:
+            self.stats["reg_writes" if self.aspace else "writes"] += 1
+        if self.aspace and not self.read:
+            if not self.linear:
+                self.error("Register write with wrapped burst")
+            self.state = "REG_WRITE"
+            return
+        latency = self.initial_latency(self.die)
+        if self.double_latency:
+            latency *= 2
+        # The latency count starts with the last CA beat
+        self.countdown = latency - 1 + (self.read_skew if self.read else 0)
+        self.state = "LATENCY" if self.countdown else ("READ" if self.read else "WRITE")
+
+    def step(self, reset_n, cs_n, ck, dq, rwds, dq_oe, rwds_oe):
+        """Advance the model by one beat
+
+        Returns ``(dq, rwds, dq_drive, rwds_drive)`` for the device side of
+        the bus during this beat.
+        """
+        t = self.time
+        stats = self.stats
+        stats["beats"] += 1
+        out = (0, 0, False, False)
+
+        if self.refresh_period is not None and t >= self.next_refresh:
+            self.next_refresh += self.refresh_period
+            if cs_n:
+                self.refresh_busy_until = t + self.refresh_beats
+            else:
+                self.refresh_pending = True
+
+        if not reset_n:
+            if self.reset_n:
+                self.reset()
+                self.state = "IDLE"
+            if not cs_n:
+                self.error("CS# asserted during reset")
+            self.reset_n = False
+            stats["idle"] += 1
+            self.time += 1
+            return out
+        if not self.reset_n:
+            self.reset_n = True
+            self.reset_time = t
+
+        if cs_n:
+            if self.state != "IDLE":
+                self.end()
+            if ck:
+                self.error("CK toggling while CS# is deasserted")
+            stats["idle"] += 1
+            self.time += 1
+            return out
+
+        if self.state == "IDLE":
+            self.begin()
+
+        if self.state == "CA":
+            out = (0, 0b11 if self.double_latency else 0, False, True)
+            if not ck:
+                stats["overhead"] += 1
+            else:
+                stats["ca"] += 1
+                if not self.ca and self.ns(t - self.cs_fall + 0.25) < self.tcss * 1e9:
+                    self.error("tCSS violated")
+                if not dq_oe:
+                    self.error("Command-address not driven")
+                self.ca.append(dq)
+                if len(self.ca) == 3:
+                    self.decode()
+        elif self.state == "LATENCY":
+            if self.read:
+                out = (0, 0, False, True)
+            if not ck:
+                stats["stall"] += 1
+            else:
+                stats["latency"] += 1
+                if not self.read and rwds_oe and rwds != 0b11:
+                    self.error("Write data before end of initial latency")
+                self.countdown -= 1
+                if self.countdown == 0:
+                    self.state = "READ" if self.read else "WRITE"
+        elif self.state == "READ":
+            if not ck:
+                out = (0, 0, False, True)
+                stats["stall"] += 1
+            else:
+                if self.aspace:
+                    data = self.read_register(self.addr)
+                else:
+                    data = self.mem.get(self.addr, 0)
+                out = (data, 0b10, True, True)
+                stats["data"] += 1
+                stats["read_words"] += 1
+                if not self.aspace:
+                    self.next_address()
+        elif self.state == "WRITE":
+            if not ck:
+                stats["stall"] += 1
+            else:
+                if not rwds_oe:
+                    self.error("RWDS not driven during write data")
+                if not dq_oe:
+                    self.error("DQ not driven during write data")
+                old = self.mem.get(self.addr, 0)
+                mask = (0xff00 if rwds & 0b10 else 0) | (0x00ff if rwds & 0b01 else 0)
+                self.mem[self.addr] = (old & mask) | (dq & ~mask & 0xffff)
+                stats["data"] += 1
+                if mask != 0xffff:
+                    stats["write_words"] += 1
+                self.next_address()
+        elif self.state == "REG_WRITE":
+            if not ck:
+                stats["stall"] += 1
+            else:
+                self.write_register(self.addr, dq)
+                stats["data"] += 1
+                self.state = "REG_DONE"
+        else:
+            stats["overhead"] += 1
+
+        if out[2] and dq_oe:
+            self.error("Contention on DQ")
+        if out[3] and rwds_oe:
+            self.error("Contention on RWDS")
+        self.time += 1
+        return out
+
+    def utilization(self):
+        return self.stats["data"] / max(self.stats["beats"], 1)
+
+
+# HyperRAM PHY models ------------------------------------------------------------------------------
+
+# With nchips > 1 the models drive that many ganged devices, sharing CK and
+# CS# like the ECP5 PHYs; device is then the first of devices.
+#
+# The 2X model has the delay controls of ECP5HYPERRAMPHY2x.  The taps take
+# effect at once, and with rx_eye=(first, last) read data of a device is
+# corrupted while its rx_delay is outside that range of taps.  With
+# rwds_eye, the RWDS strobes of read data are lost outside its range.
+#
+# The DQS model has the interface of ECP5HYPERRAMPHYDQS: RWDS is only seen
+# while the device toggles it with read data, and read data is passed
+# without word alignment, rx_skew cycles after rx_latency.
+#
+# The 4X model has the interface of ECP5HYPERRAMPHY4x, four CK cycles per
+# sys cycle.
+
+class HyperRAMPHYModel(Module):
+    nbeats = 1
+    strobed_rx = False
+
+    def __init__(self, module, sys_clk_freq=100e6, nchips=1, **kwargs):
+
+        self.tx_latency = 2
+        self.rx_latency = 1
+
+        self.clk_enable = Signal()
+        self.pll_locked = Signal(reset=1)
+
+        self.nchips = nchips
+        self.rwds_da = Signal(nchips)
+        self.rwds_db = Signal(nchips)
+        self.rwds_qa = Signal(nchips)
+        self.rwds_qb = Signal(nchips)
+        self.dq_da = Signal(8*nchips)
+        self.dq_db = Signal(8*nchips)
+        self.dq_qa = Signal(8*nchips)
+        self.dq_qb = Signal(8*nchips)
+        self.rwds_oe = Signal()
+        self.dq_oe = Signal()
+        self.cs_n = Signal(reset=1)
+        self.reset_n = Signal()
+
+        self.tx_d = [(self.dq_da, self.rwds_da), (self.dq_db, self.rwds_db)]
+        self.rx_q = [(self.dq_qa, self.rwds_qa), (self.dq_qb, self.rwds_qb)]
+
+        self.devices = [HyperRAMModel(module, sys_clk_freq * self.nbeats, **kwargs)
+                        for _ in range(nchips)]
+        self.device = self.devices[0]
+
+        self.rx_delay = []
+        self.rx_eye = None
+        self.rwds_eye = None
+        self.rx_skew = 0
+
+    @passive
+    def generator(self):
+        nbeats = self.nbeats
+        tx_signals = [s for pair in self.tx_d for s in pair]
+        rx_signals = [s for pair in self.rx_q for s in pair]
+        tx_pipe = deque([[0] * (1 + len(tx_signals))] * self.tx_latency)
+        rx_pipe = deque([[0] * len(rx_signals)] * (self.rx_latency + self.rx_skew - 1))
+        while True:
+            values = yield [self.reset_n, self.cs_n, self.clk_enable,
+                            self.dq_oe, self.rwds_oe] + tx_signals
+            reset_n, cs_n, clk_enable, dq_oe, rwds_oe = values[:5]
+            tx_pipe.append([clk_enable] + values[5:])
+            tx = tx_pipe.popleft()
+            ck = tx[0]
+            if self.rx_eye is not None or self.rwds_eye is not None:
+                delays = yield self.rx_delay
+                in_eye = lambda eye: [eye is None or eye[0] <= delay <= eye[1]
+                                      for delay in delays]
+                eye = in_eye(self.rx_eye)
+                rwds_eye = in_eye(self.rwds_eye)
+            rx = [0] * len(rx_signals)
+            for i in range(nbeats):
+                dq_a, rwds_a, dq_b, rwds_b = tx[1+4*i:5+4*i]
+                for c, device in enumerate(self.devices):
+                    dq = ((dq_a >> 8*c & 0xff) << 8) | (dq_b >> 8*c & 0xff)
+                    rwds = ((rwds_a >> c & 1) << 1) | (rwds_b >> c & 1)
+                    dev_dq, dev_rwds, dq_drive, rwds_drive = device.step(
+                        reset_n, cs_n, ck, dq, rwds, dq_oe, rwds_oe)
+                    # Input buffers see whoever is driving the pad
+                    if dq_oe:
+                        dev_dq = dq
+                    elif not dq_drive:
+                        dev_dq = 0
+                    elif self.rx_eye is not None and not eye[c]:
+                        dev_dq ^= 0xffff
+                    if rwds_oe:
+                        dev_rwds = rwds
+                    elif not rwds_drive or (self.strobed_rx and dev_rwds != 0b10):
+                        dev_rwds = 0
+                    elif self.rwds_eye is not None and dq_drive and not rwds_eye[c]:
+                        # Read data strobes are lost
+                        dev_rwds = 0
+                    rx[4*i+0] |= (dev_dq >> 8) << 8*c
+                    rx[4*i+1] |= (dev_rwds >> 1) << c
+                    rx[4*i+2] |= (dev_dq & 0xff) << 8*c
+                    rx[4*i+3] |= (dev_rwds & 1) << c
+            rx_pipe.append(rx)
+            rx = rx_pipe.popleft()
+            yield [s.eq(v) for s, v in zip(rx_signals, rx)]
+            yield
+
+
+class HyperRAMPHYModel2x(HyperRAMPHYModel):
+    nbeats = 2
+
+    def __init__(self, module, sys_clk_freq=100e6, rx_eye=None, rwds_eye=None, **kwargs):
+        HyperRAMPHYModel.__init__(self, module, sys_clk_freq, **kwargs)
+
+        self.tx_latency = 3
+        self.rx_latency = 2
+
+        self.rx_delay = [Signal((8, True)) for _ in range(self.nchips)]
+        self.ck_delay = Signal((8, True))
+        self.delay_ready = Signal(reset=1)
+        self.rx_eye = rx_eye
+        self.rwds_eye = rwds_eye
+
+        nchips = self.nchips
+        self.rwds_dc = Signal(nchips)
+        self.rwds_dd = Signal(nchips)
+        self.rwds_qc = Signal(nchips)
+        self.rwds_qd = Signal(nchips)
+        self.rwds_qa_wa = Signal(nchips)
+        self.rwds_qb_wa = Signal(nchips)
+        self.rwds_qc_wa = Signal(nchips)
+        self.rwds_qd_wa = Signal(nchips)
+        self.dq_dc = Signal(8*nchips)
+        self.dq_dd = Signal(8*nchips)
+        self.dq_qc = Signal(8*nchips)
+        self.dq_qd = Signal(8*nchips)
+        self.dq_qa_wa = Signal(8*nchips)
+        self.dq_qb_wa = Signal(8*nchips)
+        self.dq_qc_wa = Signal(8*nchips)
+        self.dq_qd_wa = Signal(8*nchips)
+
+        self.tx_d += [(self.dq_dc, self.rwds_dc), (self.dq_dd, self.rwds_dd)]
+        self.rx_q = [(self.dq_qa_wa, self.rwds_qa_wa), (self.dq_qb_wa, self.rwds_qb_wa),
+                     (self.dq_qc_wa, self.rwds_qc_wa), (self.dq_qd_wa, self.rwds_qd_wa)]
+
+        # Same word alignment as ECP5HYPERRAMPHY2x
+        for c in range(nchips):
+            dq = slice(8*c, 8*c+8)
+            word_align = Signal()
+            rwds_qc_save = Signal()
+            rwds_qd_save = Signal()
+            dq_qc_save = Signal(8)
+            dq_qd_save = Signal(8)
+            self.comb += \
+                If(word_align,
+                    self.dq_qa[dq].eq(dq_qc_save),
+                    self.dq_qb[dq].eq(dq_qd_save),
+                    self.dq_qc[dq].eq(self.dq_qa_wa[dq]),
+                    self.dq_qd[dq].eq(self.dq_qb_wa[dq]),
+                    self.rwds_qa[c].eq(rwds_qc_save),
+                    self.rwds_qb[c].eq(rwds_qd_save),
+                    self.rwds_qc[c].eq(self.rwds_qa_wa[c]),
+                    self.rwds_qd[c].eq(self.rwds_qb_wa[c]),
+                ).Elif(self.rwds_qc_wa[c] & ~self.rwds_qa_wa[c],
+                    self.dq_qa[dq].eq(0),
+                    self.dq_qb[dq].eq(0),
+                    self.dq_qc[dq].eq(0),
+                    self.dq_qd[dq].eq(0),
+                    self.rwds_qa[c].eq(0),
+                    self.rwds_qb[c].eq(0),
+                    self.rwds_qc[c].eq(0),
+                    self.rwds_qd[c].eq(0)
+                ).Else(
+                    self.dq_qa[dq].eq(self.dq_qa_wa[dq]),
+                    self.dq_qb[dq].eq(self.dq_qb_wa[dq]),
+                    self.dq_qc[dq].eq(self.dq_qc_wa[dq]),
+                    self.dq_qd[dq].eq(self.dq_qd_wa[dq]),
+                    self.rwds_qa[c].eq(self.rwds_qa_wa[c]),
+                    self.rwds_qb[c].eq(self.rwds_qb_wa[c]),
+                    self.rwds_qc[c].eq(self.rwds_qc_wa[c]),
+                    self.rwds_qd[c].eq(self.rwds_qd_wa[c])
+                )
+            self.sync += [
+                If(word_align,
+                   If(~self.rwds_qc_wa[c], word_align.eq(0))
+                ).Elif(self.rwds_qc_wa[c] & ~self.rwds_qa_wa[c],
+                   word_align.eq(1)
+                ),
+                dq_qc_save.eq(self.dq_qc_wa[dq]),
+                dq_qd_save.eq(self.dq_qd_wa[dq]),
+                rwds_qc_save.eq(self.rwds_qc_wa[c]),
+                rwds_qd_save.eq(self.rwds_qd_wa[c])
+            ]
+
+
+class HyperRAMPHYModelDQS(HyperRAMPHYModel):
+    nbeats = 2
+    strobed_rx = True
+
+    def __init__(self, module, sys_clk_freq=100e6, rx_skew=0, **kwargs):
+        HyperRAMPHYModel.__init__(self, module, sys_clk_freq, **kwargs)
+
+        self.tx_latency = 3
+        self.rx_latency = 3
+        self.rx_skew = rx_skew
+
+        nchips = self.nchips
+        self.rwds_dc = Signal(nchips)
+        self.rwds_dd = Signal(nchips)
+        self.rwds_qc = Signal(nchips)
+        self.rwds_qd = Signal(nchips)
+        self.dq_dc = Signal(8*nchips)
+        self.dq_dd = Signal(8*nchips)
+        self.dq_qc = Signal(8*nchips)
+        self.dq_qd = Signal(8*nchips)
+
+        self.tx_d += [(self.dq_dc, self.rwds_dc), (self.dq_dd, self.rwds_dd)]
+        self.rx_q += [(self.dq_qc, self.rwds_qc), (self.dq_qd, self.rwds_qd)]
+
+
+class HyperRAMPHYModel4x(HyperRAMPHYModel):
+    nbeats = 4
+
+    def __init__(self, module, sys_clk_freq=100e6, **kwargs):
+        HyperRAMPHYModel.__init__(self, module, sys_clk_freq, **kwargs)
+
+        self.tx_latency = 2
+        self.rx_latency = 2
+
+        nchips = self.nchips
+        for b in "cdefgh":
+            for name, width in [("rwds_d", 1), ("rwds_q", 1), ("dq_d", 8), ("dq_q", 8)]:
+                setattr(self, name + b, Signal(width*nchips))
+            self.tx_d.append((getattr(self, "dq_d" + b), getattr(self, "rwds_d" + b)))
+            self.rx_q.append((getattr(self, "dq_q" + b), getattr(self, "rwds_q" + b)))
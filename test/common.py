@@ -0,0 +1,170 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+from migen import *
+
+from litehyperram import modules
+from litehyperram.core import LiteHyperRAMCore
+from litehyperram.phy.model import HyperRAMPHYModel
+
+# Core on a PHY model ------------------------------------------------------------------------------
+
+class CoreDesign(Module):
+    def __init__(self, phy_cls=HyperRAMPHYModel, module=None, sys_clk_freq=50e6,
+                 phy_kwargs={}, **kwargs):
+        self.clock_domains.cd_sys = ClockDomain("sys")
+        self.module = modules.S27KL0641DA() if module is None else module
+        self.submodules.phy = phy_cls(self.module, sys_clk_freq, **phy_kwargs)
+        self.submodules.core = LiteHyperRAMCore(self.phy, self.module, sys_clk_freq, **kwargs)
+
+def run(dut, generators):
+    run_simulation(dut, generators + [dut.phy.generator()])
+
+def device_errors(phy):
+    return [error for device in phy.devices for error in device.errors]
+
+def pattern(n, width, seed=0):
+    return [(0x9e3779b97f4a7c15 * (seed*n + i + 1) >> 7) & (2**width - 1) for i in range(n)]
+
+# Native port transactions -------------------------------------------------------------------------
+
+def wait_setup(core):
+    while not (yield core.register_space.setup_done):
+        yield
+
+def native_write(port, addr, data, we=None, length=True, aspace=0):
+    nbytes = port.data_width//8
+    yield port.cmd.valid.eq(1)
+    yield port.cmd.we.eq(1)
+    yield port.cmd.addr.eq(addr)
+    yield port.cmd.length.eq(len(data) if length else 0)
+    yield port.cmd.burst_type.eq(1)
+    yield port.cmd.aspace.eq(aspace)
+    yield port.wdata.valid.eq(1)
+    yield port.wdata.data.eq(data[0])
+    yield port.wdata.we.eq(2**nbytes - 1 if we is None else we[0])
+    yield port.wdata.last.eq(not length and len(data) == 1)
+    yield
+    while not (yield port.cmd.ready):
+        yield
+    yield port.cmd.valid.eq(0)
+    i = 0
+    while i < len(data):
+        if (yield port.wdata.ready):
+            i += 1
+            if i < len(data):
+                yield port.wdata.data.eq(data[i])
+                yield port.wdata.we.eq(2**nbytes - 1 if we is None else we[i])
+                yield port.wdata.last.eq(not length and i == len(data) - 1)
+        yield
+    yield port.wdata.valid.eq(0)
+    yield port.wdata.last.eq(0)
+
+def native_read(port, addr, n, length=True, aspace=0):
+    data = []
+    yield port.cmd.valid.eq(1)
+    yield port.cmd.we.eq(0)
+    yield port.cmd.addr.eq(addr)
+    yield port.cmd.length.eq(n if length else 0)
+    yield port.cmd.burst_type.eq(1)
+    yield port.cmd.aspace.eq(aspace)
+    yield port.rdata.ready.eq(1)
+    yield port.rdata.last.eq(not length and n == 1)
+    yield
+    while not (yield port.cmd.ready):
+        yield
+    yield port.cmd.valid.eq(0)
+    while len(data) < n:
+        if (yield port.rdata.valid):
+            data.append((yield port.rdata.data))
+            yield port.rdata.last.eq(not length and len(data) == n - 1)
+        yield
+    yield port.rdata.last.eq(0)
+    return data
+
+# Elastic port transactions, with random stalls ----------------------------------------------------
+
+def elastic_write(port, addr, data, rng, length=True):
+    yield port.cmd.valid.eq(1)
+    yield port.cmd.we.eq(1)
+    yield port.cmd.addr.eq(addr)
+    yield port.cmd.length.eq(len(data) if length else 0)
+    yield port.cmd.burst_type.eq(1)
+    yield port.cmd.aspace.eq(0)
+    yield
+    while not (yield port.cmd.ready):
+        yield
+    yield port.cmd.valid.eq(0)
+    i = 0
+    while i < len(data):
+        valid = rng.random() > 0.3
+        yield port.wdata.valid.eq(valid)
+        yield port.wdata.data.eq(data[i])
+        yield port.wdata.we.eq(2**(port.data_width//8) - 1)
+        yield port.wdata.last.eq(not length and i == len(data) - 1)
+        yield
+        if valid and (yield port.wdata.ready):
+            i += 1
+    yield port.wdata.valid.eq(0)
+    yield port.wdata.last.eq(0)
+
+def elastic_read(port, addr, n, rng, length=True):
+    data = []
+    yield port.cmd.valid.eq(1)
+    yield port.cmd.we.eq(0)
+    yield port.cmd.addr.eq(addr)
+    yield port.cmd.length.eq(n if length else 0)
+    yield port.cmd.burst_type.eq(1)
+    yield port.cmd.aspace.eq(0)
+    yield
+    while not (yield port.cmd.ready):
+        yield
+    yield port.cmd.valid.eq(0)
+    while len(data) < n:
+        ready = rng.random() > 0.3
+        yield port.rdata.ready.eq(ready)
+        yield port.rdata.last.eq(not length and len(data) == n - 1)
+        yield
+        if ready and (yield port.rdata.valid):
+            data.append((yield port.rdata.data))
+    yield port.rdata.ready.eq(0)
+    yield port.rdata.last.eq(0)
+    return data
+
+# Wishbone transactions ----------------------------------------------------------------------------
+
+def wb_address(adr, i, bte=0):
+    # Address of beat i of a burst, wrapping at 4, 8 or 16 words for bte
+    # 0b01, 0b10 or 0b11
+    if not bte:
+        return adr + i
+    wrap = 2 << bte
+    return (adr & ~(wrap - 1)) | ((adr + i) & (wrap - 1))
+
+def wb_burst(bus, adr, n, data=None, bte=0, rng=None):
+    # Classic incrementing or wrapping burst, with random wait states
+    result = []
+    for i in range(n):
+        a = wb_address(adr, i, bte)
+        yield bus.cyc.eq(1)
+        yield bus.stb.eq(1)
+        yield bus.we.eq(data is not None)
+        yield bus.adr.eq(a)
+        yield bus.sel.eq(0xf)
+        yield bus.cti.eq(0b111 if i == n - 1 else 0b010)
+        yield bus.bte.eq(bte)
+        if data is not None:
+            yield bus.dat_w.eq(data[i])
+        yield
+        while not (yield bus.ack):
+            yield
+        if data is None:
+            result.append((yield bus.dat_r))
+        if rng is not None and i != n - 1 and rng.random() < 0.3:
+            yield bus.stb.eq(0)
+            for _ in range(rng.randrange(1, 4)):
+                yield
+    yield bus.cyc.eq(0)
+    yield bus.stb.eq(0)
+    yield
+    return result
@@ -0,0 +1,162 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect.axi import AXIInterface, AXILiteInterface
+from litex.soc.interconnect.axi import BURST_FIXED, BURST_INCR, BURST_WRAP
+
+from litehyperram.frontend.axi import LiteHyperRAMAXI2Native
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class AXIDesign(CoreDesign):
+    def __init__(self, phy_cls, lite=False, **kwargs):
+        CoreDesign.__init__(self, phy_cls, **kwargs)
+        if lite:
+            self.bus = AXILiteInterface(data_width=32, address_width=32)
+        else:
+            self.bus = AXIInterface(data_width=32, address_width=32, id_width=4)
+        self.submodules.axi = LiteHyperRAMAXI2Native(self.bus, self.core.new_port(),
+                                                     wrap_bytes=32)
+
+
+def beat_addresses(addr, n, burst):
+    # Byte addresses of the beats of a burst of 32-bit words
+    if burst == BURST_FIXED:
+        return [addr]*n
+    if burst == BURST_WRAP:
+        base = addr - addr % (4*n)
+        return [base + (addr - base + 4*i) % (4*n) for i in range(n)]
+    return [addr + 4*i for i in range(n)]
+
+def send_addr(ch, requests, rng, lite, after=None):
+    # AW or AR requests, as (id, addr, beats, burst), with random gaps and
+    # without waiting for responses
+    if after is not None:
+        while not after():
+            yield
+    for id, addr, n, burst in requests:
+        yield ch.valid.eq(1)
+        yield ch.addr.eq(addr)
+        if not lite:
+            yield ch.id.eq(id)
+            yield ch.len.eq(n - 1)
+            yield ch.burst.eq(burst)
+            yield ch.size.eq(2)
+        yield
+        while not (yield ch.ready):
+            yield
+        yield ch.valid.eq(0)
+        for _ in range(rng.randrange(3)):
+            yield
+
+def send_w(w, bursts, rng, lite):
+    # Write data of each burst, as a list of (data, strb)
+    for beats in bursts:
+        i = 0
+        while i < len(beats):
+            valid = rng.random() > 0.3
+            yield w.valid.eq(valid)
+            yield w.data.eq(beats[i][0])
+            yield w.strb.eq(beats[i][1])
+            if not lite:
+                yield w.last.eq(i == len(beats) - 1)
+            yield
+            if valid and (yield w.ready):
+                i += 1
+    yield w.valid.eq(0)
+
+def receive(ch, n, rng, fields, result):
+    # n responses from B or R, with random backpressure
+    while len(result) < n:
+        ready = rng.random() > 0.3
+        yield ch.ready.eq(ready)
+        yield
+        if ready and (yield ch.valid):
+            values = []
+            for field in fields:
+                values.append((yield getattr(ch, field)))
+            result.append(tuple(values))
+    yield ch.ready.eq(0)
+
+
+class TestAXI(unittest.TestCase):
+    def transfers(self, phy_cls, writes, reads, lite=False):
+        dut = AXIDesign(phy_cls, lite)
+        bus = dut.bus
+        rng = random.Random(4)
+        ref = {a: 0 for a in range(0, 0x300, 4)}
+        bursts = []
+        for id, addr, n, burst in writes:
+            beats = [(d, rng.randrange(1, 16) if rng.random() < 0.3 else 0xf)
+                     for d in pattern(n, 32, seed=id + addr)]
+            bursts.append(beats)
+            for a, (d, strb) in zip(beat_addresses(addr, n, burst), beats):
+                mask = sum(0xff << 8*b for b in range(4) if strb >> b & 1)
+                ref[a] = (ref[a] & ~mask) | (d & mask)
+        b, r = [], []
+        setup = []
+
+        def generator(dut):
+            # Known contents, written around the frontend
+            yield from wait_setup(dut.core)
+            port = dut.core.get_port()
+            yield from native_write(port, 0, [0]*(0x300*8//port.data_width), length=False)
+            setup.append(True)
+
+        b_fields = ["resp"] if lite else ["id", "resp"]
+        r_fields = ["data", "resp"] if lite else ["id", "data", "resp", "last"]
+        nbeats = sum(n for id, addr, n, burst in reads)
+        run(dut, [generator(dut),
+                  send_addr(bus.aw, writes, rng, lite, lambda: setup),
+                  send_w(bus.w, bursts, rng, lite),
+                  receive(bus.b, len(writes), rng, b_fields, b),
+                  # Reads once all writes are done
+                  send_addr(bus.ar, reads, rng, lite, lambda: len(b) == len(writes)),
+                  receive(bus.r, nbeats, rng, r_fields, r)])
+
+        # Responses in request order
+        expected_b = [(0,) if lite else (id, 0) for id, addr, n, burst in writes]
+        expected_r = []
+        for id, addr, n, burst in reads:
+            for i, a in enumerate(beat_addresses(addr, n, burst)):
+                expected_r.append((ref[a], 0) if lite else (id, ref[a], 0, i == n - 1))
+        self.assertEqual(b, expected_b)
+        self.assertEqual(r, expected_r)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    # (id, addr, beats, burst)
+    writes = [(1, 0x000, 4, BURST_INCR),
+              # Wrapped burst of wrap_bytes, starting mid-line
+              (2, 0x048, 8, BURST_WRAP),
+              # Shorter wrapped burst, split at the boundary
+              (3, 0x0a8, 4, BURST_WRAP),
+              (4, 0x0c0, 3, BURST_FIXED),
+              # Longer than max_burst
+              (5, 0x100, 100, BURST_INCR),
+              # Overlapping the first one, and applied after it
+              (6, 0x008, 4, BURST_INCR)]
+    reads = [(7, 0x000, 16, BURST_INCR),
+             (2, 0x058, 8, BURST_WRAP),
+             (2, 0x0ac, 4, BURST_WRAP),
+             (0, 0x0c0, 3, BURST_FIXED),
+             (9, 0x0f8, 110, BURST_INCR),
+             (7, 0x040, 2, BURST_WRAP),
+             (15, 0x0a0, 1, BURST_INCR)]
+
+    def test_axi4_1x(self):
+        self.transfers(HyperRAMPHYModel, self.writes, self.reads)
+
+    def test_axi4_2x(self):
+        self.transfers(HyperRAMPHYModel2x, self.writes, self.reads)
+
+    def test_axi_lite(self):
+        writes = [(0, 4*i + 0x20, 1, BURST_INCR) for i in (0, 3, 1, 7, 3, 2)]
+        reads = [(0, 4*i + 0x20, 1, BURST_INCR) for i in range(10)]
+        self.transfers(HyperRAMPHYModel, writes, reads, lite=True)
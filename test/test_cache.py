@@ -0,0 +1,89 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+
+from litehyperram.frontend.cache import LiteHyperRAMCachedWishbone2Native
+
+from test.common import *
+
+
+class CacheDesign(CoreDesign):
+    def __init__(self, **kwargs):
+        CoreDesign.__init__(self)
+        self.bus = wishbone.Interface(data_width=32)
+        self.submodules.cache = LiteHyperRAMCachedWishbone2Native(self.bus, self.core.get_port(),
+                                                                  **kwargs)
+
+
+class TestCache(unittest.TestCase):
+    def test_data(self):
+        dut = CacheDesign()
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            data = pattern(64, 32)
+            yield from wb_burst(dut.bus, 0, 64, data)
+            ref.update(enumerate(data))
+            # Misses, hits, and write hits updating the line
+            for i, adr in enumerate([3, 12, 3, 40, 13, 63, 0]):
+                got = yield from wb_burst(dut.bus, adr, 1)
+                if got[0] != ref[adr]:
+                    errors.append((adr, got[0], ref[adr]))
+                yield from wb_burst(dut.bus, adr ^ 1, 1, [i])
+                ref[adr ^ 1] = i
+            for adr in range(64):
+                got = yield from wb_burst(dut.bus, adr, 1)
+                if got[0] != ref[adr]:
+                    errors.append((adr, got[0], ref[adr]))
+
+        run(dut, [generator(dut)])
+        self.assertEqual(errors, [])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_lru_fill_set(self):
+        # A fill must age the ways of its own set, even when lookups in
+        # another set run until it completes
+        dut = CacheDesign(ways=4, prefetch=False)
+        sets = 4096//(32*4)
+        missed = []
+
+        def line(s, tag):
+            return (s + tag*sets)*8
+
+        def read(dut, adr, settle=0):
+            misses = yield dut.cache.misses.status
+            yield from wb_burst(dut.bus, adr, 1)
+            missed.append((adr, (yield dut.cache.misses.status) != misses))
+            # Fills complete after the requested word, making their way
+            # the most recently used again
+            for _ in range(settle):
+                yield
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            # Set 1, oldest first: tags 3, 0, 1, 2
+            for tag in [0, 1, 2, 3, 0, 1, 2]:
+                yield from read(dut, line(1, tag), 40)
+            # Set 0, oldest first: tags 3, 2, 1, 0
+            for tag in [0, 1, 2, 3, 3, 2, 1, 0]:
+                yield from read(dut, line(0, tag), 40)
+            # Replaces tag 3 in set 1, while set 0 is looked up
+            yield from read(dut, line(1, 4))
+            for _ in range(12):
+                yield from read(dut, line(0, 0))
+            # Replaces tag 0, the oldest in set 1
+            yield from read(dut, line(1, 5), 40)
+            del missed[:]
+            for tag in [1, 2, 4, 5, 0]:
+                yield from read(dut, line(1, tag), 40)
+
+        run(dut, [generator(dut)])
+        self.assertEqual([m for _, m in missed], [False, False, False, False, True])
+        self.assertEqual(device_errors(dut.phy), [])
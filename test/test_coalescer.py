@@ -0,0 +1,189 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class CoalescerDesign(CoreDesign):
+    def __init__(self, window=4, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.port = self.core.new_port(coalesce=True, window=window)
+
+
+def wr(addr, data, aspace=0, wait=None):
+    return (1, addr, data, aspace, wait)
+
+def rd(addr, n, aspace=0, wait=None):
+    return (0, addr, n, aspace, wait)
+
+def commands(port, cmds):
+    # Each command is presented as soon as the previous one is accepted, or
+    # wait cycles after the last word of the previous one, and data follows
+    # without gaps.  Returns the words read by each command.
+    nbytes = port.data_width//8
+    got = [[] for _ in cmds]
+
+    def present(k):
+        we, addr, x, aspace, wait = cmds[k]
+        yield port.cmd.valid.eq(1)
+        yield port.cmd.we.eq(we)
+        yield port.cmd.addr.eq(addr)
+        yield port.cmd.length.eq(len(x) if we else x)
+        yield port.cmd.burst_type.eq(1)
+        yield port.cmd.aspace.eq(aspace)
+
+    def word(k, i):
+        if cmds[k][0]:
+            yield port.wdata.data.eq(cmds[k][2][i])
+            yield port.wdata.we.eq(2**nbytes - 1)
+
+    def size(k):
+        return len(cmds[k][2]) if cmds[k][0] else cmds[k][2]
+
+    yield port.wdata.valid.eq(1)
+    yield port.rdata.ready.eq(1)
+    yield from present(0)
+    yield from word(0, 0)
+    issued = 0      # Commands accepted
+    presented = True
+    k, i = 0, 0     # Command and word transferred next
+    done = None     # Cycle the last word of command k-1 was transferred
+    cycle = 0
+    while k < len(cmds):
+        yield
+        cycle += 1
+        if presented and (yield port.cmd.ready):
+            issued += 1
+            presented = False
+            yield port.cmd.valid.eq(0)
+        if cmds[k][0]:
+            beat = yield port.wdata.ready
+        else:
+            beat = yield port.rdata.valid
+            if beat:
+                got[k].append((yield port.rdata.data))
+        if beat:
+            i += 1
+            if i == size(k):
+                k, i = k + 1, 0
+                done = cycle
+                if k < len(cmds):
+                    yield from word(k, 0)
+            else:
+                yield from word(k, i)
+        if issued < len(cmds) and not presented:
+            wait = cmds[issued][4]
+            if (wait is None and issued == k + 1) or \
+               (wait is not None and issued == k and cycle - done >= wait):
+                yield from present(issued)
+                presented = True
+    yield port.wdata.valid.eq(0)
+    yield port.rdata.ready.eq(0)
+    yield
+    return got
+
+
+class TestCoalescer(unittest.TestCase):
+    def sequence(self, cmds, window=4, **kwargs):
+        # Runs cmds after writing known data, and returns the HyperBus reads
+        # and writes they took
+        dut = CoalescerDesign(window, **kwargs)
+        port = dut.port
+        ref = dict(enumerate(pattern(512, port.data_width, seed=7)))
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for a in range(0, 512, 64):
+                yield from native_write(port, a, [ref[a + j] for j in range(64)])
+            device = dict(dut.phy.device.stats)
+            got = yield from commands(port, cmds)
+            result["device"] = {k: dut.phy.device.stats[k] - device[k]
+                                for k in ["reads", "writes", "reg_reads"]}
+            result["got"] = got
+            result["mem"] = yield from native_read(port, 0, 256, length=False)
+
+        expected = []
+        for we, addr, x, aspace, wait in cmds:
+            if aspace:
+                expected.append(None)
+            elif we:
+                expected.append([])
+                ref.update(zip(range(addr, addr + len(x)), x))
+            else:
+                expected.append([ref[addr + j] for j in range(x)])
+
+        run(dut, [generator(dut)])
+        # Each read gets exactly its own words
+        got = [g if e is not None else None for g, e in zip(result["got"], expected)]
+        self.assertEqual(got, expected)
+        self.assertEqual(result["mem"], [ref[a] for a in range(256)])
+        self.assertEqual(device_errors(dut.phy), [])
+        return result["device"], dut.core.controller.max_burst
+
+    def test_sequential_writes(self):
+        device, _ = self.sequence([wr(16*i, pattern(16, 16, seed=i)) for i in range(4)])
+        self.assertEqual(device["writes"], 1)
+
+    def test_sequential_reads(self):
+        device, _ = self.sequence([rd(3 + 5*i, 5) for i in range(6)])
+        self.assertEqual(device["reads"], 1)
+
+    def test_sequential_2x(self):
+        # Controller words are 32 bits, and commands can be a single word
+        device, _ = self.sequence([wr(8 + i, [0x1000 + i]) for i in range(8)] +
+                                  [rd(8 + 2*i, 2) for i in range(4)],
+                                  phy_cls=HyperRAMPHYModel2x)
+        self.assertEqual((device["writes"], device["reads"]), (1, 1))
+
+    def test_address_gap(self):
+        device, _ = self.sequence([wr(0, pattern(8, 16)), wr(9, pattern(8, 16, seed=1)),
+                                   rd(0, 8), rd(9, 8)])
+        self.assertEqual((device["writes"], device["reads"]), (2, 2))
+
+    def test_late_write(self):
+        # Write data can not wait, so a write must be merged as the previous
+        # one ends
+        device, _ = self.sequence([wr(0, pattern(8, 16)), wr(8, pattern(8, 16, seed=1), wait=1)])
+        self.assertEqual(device["writes"], 2)
+
+    def test_direction_change(self):
+        device, _ = self.sequence([wr(0, pattern(8, 16)), rd(8, 8), wr(16, pattern(8, 16, seed=1)),
+                                   rd(24, 8)])
+        self.assertEqual((device["writes"], device["reads"]), (2, 2))
+
+    def test_aspace_change(self):
+        # A register read (ID0) in between memory reads
+        device, _ = self.sequence([rd(0, 8), rd(0, 1, aspace=1), rd(8, 8)])
+        self.assertEqual((device["reads"], device["reg_reads"]), (2, 1))
+
+    def test_window(self):
+        # The read burst waits for a late command within the window
+        device, _ = self.sequence([rd(0, 8), rd(8, 8, wait=2)])
+        self.assertEqual(device["reads"], 1)
+        # but not beyond it
+        device, _ = self.sequence([rd(0, 8), rd(8, 8, wait=16)])
+        self.assertEqual(device["reads"], 2)
+        # and waits add up
+        device, _ = self.sequence([rd(8*i, 8, wait=3) for i in range(4)])
+        self.assertEqual(device["reads"], 2)
+
+    def test_no_window(self):
+        device, _ = self.sequence([rd(0, 8), rd(8, 8, wait=1)], window=0)
+        self.assertEqual(device["reads"], 2)
+
+    def test_max_burst(self):
+        # Bursts are not merged beyond max_burst
+        n = 6
+        cmds = [wr(64*i, pattern(64, 16, seed=i)) for i in range(n)]
+        cmds += [rd(64*i, 64) for i in range(n)]
+        device, max_burst = self.sequence(cmds)
+        per_burst = max_burst//64
+        expected = (n + per_burst - 1)//per_burst
+        self.assertEqual((device["writes"], device["reads"]), (expected, expected))
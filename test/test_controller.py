@@ -0,0 +1,86 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x, HyperRAMPHYModel4x
+
+from test.common import *
+from test.test_coalescer import wr, rd, commands
+
+
+class TestController(unittest.TestCase):
+    def long_bursts(self, phy_cls, sys_clk_freq=50e6):
+        dut = CoreDesign(phy_cls, sys_clk_freq=sys_clk_freq)
+        port = dut.core.get_port()
+        max_burst = dut.core.controller.max_burst
+        # Beyond max_burst without a length, and with one (up to the
+        # largest length)
+        bursts = [(0, 3*max_burst + 5, False),
+                  (1024, min(2**port.length_width - 1, 2*max_burst + 1), True)]
+        result = {"data": [], "device": []}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for i, (addr, n, length) in enumerate(bursts):
+                data = pattern(n, port.data_width, seed=i)
+                since = dict(dut.phy.device.stats)
+                yield from native_write(port, addr, data, length=length)
+                got = yield from native_read(port, addr, n, length=length)
+                result["data"].append(got == data)
+                result["device"].append((dut.phy.device.stats["writes"] - since["writes"],
+                                         dut.phy.device.stats["reads"] - since["reads"]))
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["data"], [True]*len(bursts))
+        # Split into bursts of max_burst words, none exceeding tCSM
+        splits = [(n + max_burst - 1)//max_burst for addr, n, length in bursts]
+        self.assertEqual(result["device"], [(s, s) for s in splits])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_long_bursts_1x(self):
+        self.long_bursts(HyperRAMPHYModel)
+
+    def test_long_bursts_2x(self):
+        self.long_bursts(HyperRAMPHYModel2x)
+
+    def test_long_bursts_4x(self):
+        self.long_bursts(HyperRAMPHYModel4x, sys_clk_freq=25e6)
+
+    def back_to_back(self, pipelined, phy_cls=HyperRAMPHYModel, sys_clk_freq=50e6):
+        dut = CoreDesign(phy_cls, sys_clk_freq=sys_clk_freq, pipelined=pipelined)
+        port = dut.core.get_port()
+        old = pattern(8, port.data_width, seed=1)
+        new = pattern(8, port.data_width, seed=2)
+        # Read after write and write after read, each command waiting as
+        # the previous one ends
+        cmds = [wr(0, old), rd(0, 8), wr(0, new), rd(0, 8), rd(4, 1), wr(5, new[:1]),
+                rd(5, 1), wr(32, old[:3]), wr(40, new[:2]), rd(32, 3), rd(40, 2)]
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            start = dut.phy.device.time
+            result["got"] = yield from commands(port, cmds)
+            result["time"] = dut.phy.device.time - start
+
+        run(dut, [generator(dut)])
+        got = result["got"]
+        self.assertEqual([got[1], got[3], got[4], got[6], got[9], got[10]],
+                         [old, new, new[4:5], new[:1], old[:3], new[:2]])
+        # tRWR and tCSHI are checked by the model
+        self.assertEqual(device_errors(dut.phy), [])
+        return result["time"]
+
+    def test_back_to_back_1x(self):
+        self.assertLess(self.back_to_back(True), self.back_to_back(False))
+
+    def test_back_to_back_2x(self):
+        self.assertLess(self.back_to_back(True, HyperRAMPHYModel2x),
+                        self.back_to_back(False, HyperRAMPHYModel2x))
+
+    def test_back_to_back_4x(self):
+        self.assertLess(self.back_to_back(True, HyperRAMPHYModel4x, 25e6),
+                        self.back_to_back(False, HyperRAMPHYModel4x, 25e6))
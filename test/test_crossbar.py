@@ -0,0 +1,168 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from test.common import *
+from test.test_latency import reg_access
+
+
+class CrossbarDesign(CoreDesign):
+    def __init__(self, arbitration, weights=(1, 1), **kwargs):
+        CoreDesign.__init__(self, arbitration=arbitration, **kwargs)
+        # data_port, then the new_port() ports in order
+        self.ports = [self.core.get_port()] + [self.core.new_port(weight=w) for w in weights]
+
+
+def requester(dut, port, addr, n, result, setup=True):
+    # Keeps a two word read waiting until n of them have been accepted
+    if setup:
+        yield from wait_setup(dut.core)
+    yield port.cmd.valid.eq(1)
+    yield port.cmd.we.eq(0)
+    yield port.cmd.addr.eq(addr)
+    yield port.cmd.length.eq(2)
+    yield port.cmd.burst_type.eq(1)
+    yield port.cmd.aspace.eq(0)
+    yield port.rdata.ready.eq(1)
+    accepted = 0
+    data = []
+    while accepted < n or len(data) < 2*n:
+        yield
+        if accepted < n and (yield port.cmd.ready):
+            accepted += 1
+            if accepted == n:
+                yield port.cmd.valid.eq(0)
+        if (yield port.rdata.valid):
+            data.append((yield port.rdata.data))
+    result.append(data)
+
+def max_wait(grants, port):
+    # Most grants to other ports before a grant to port
+    waits, count = [], 0
+    for g in grants:
+        if g == port:
+            waits.append(count)
+            count = 0
+        else:
+            count += 1
+    return max(waits)
+
+@passive
+def monitor(dut, result):
+    # Ports whose commands are accepted by the controller (0 for the
+    # register space), and cycles with stall set
+    crossbar = dut.core.crossbar
+    ports = [crossbar.reg_port] + crossbar.masters
+    result["grants"] = grants = []
+    result["stall"] = stall = []
+    result["early"] = 0
+    while True:
+        for i, port in enumerate(ports):
+            if (yield port.cmd.valid) and (yield port.cmd.ready):
+                grants.append(i)
+                if i != 0 and not (yield dut.core.register_space.setup_done):
+                    result["early"] += 1
+        if (yield crossbar.stall):
+            stall.append((yield dut.core.register_space.setup_done))
+        yield
+
+
+class TestCrossbar(unittest.TestCase):
+    def arbitrate(self, arbitration, weights=(1, 1), n=12):
+        dut = CrossbarDesign(arbitration, weights)
+        result = {}
+        data = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for i, port in enumerate(dut.ports):
+                yield from native_write(port, 16*i, [0x100*i, 0x100*i + 1])
+
+        def start(dut, i):
+            # All ports request in the same cycle, after the data is written
+            yield from wait_setup(dut.core)
+            for _ in range(200):
+                yield
+            yield from requester(dut, dut.ports[i], 16*i, n, data, setup=False)
+
+        run(dut, [generator(dut), monitor(dut, result)] +
+                 [start(dut, i) for i in range(len(dut.ports))])
+        self.assertEqual(sorted(data), [[0x100*i, 0x100*i + 1]*n for i in range(len(dut.ports))])
+        self.assertEqual(device_errors(dut.phy), [])
+        # Grants of the requests, after the writes and the setup
+        grants = [g for g in result["grants"] if g != 0][len(dut.ports):]
+        self.assertEqual(len(grants), n*len(dut.ports))
+        return grants
+
+    def test_round_robin(self):
+        grants = self.arbitrate("round-robin")
+        # Ports take turns, and none is skipped
+        self.assertEqual(grants, [1, 2, 3]*12)
+
+    def test_fixed(self):
+        grants = self.arbitrate("fixed")
+        self.assertEqual(grants, [1]*12 + [2]*12 + [3]*12)
+
+    def test_weighted(self):
+        # Each command is two beats, so the data port (weight 1) runs into
+        # debt, and is served in every other round
+        grants = self.arbitrate("weighted", weights=(2, 4), n=16)
+        for r in range(4):
+            window = grants[7*r:7*(r + 1)]
+            self.assertEqual([window.count(i) for i in (1, 2, 3)], [1, 2, 4])
+        for i, wait in zip((1, 2, 3), (6, 3, 2)):
+            self.assertLessEqual(max_wait(grants, i), wait)
+
+    def test_weighted_equal(self):
+        # Same as round-robin with equal weights
+        grants = self.arbitrate("weighted")
+        self.assertEqual(grants, [1, 2, 3]*12)
+
+    def test_lockout(self):
+        dut = CrossbarDesign("round-robin")
+        result = {}
+        data = []
+
+        run(dut, [monitor(dut, result)] +
+                 [requester(dut, port, 0, 2, data, setup=False) for port in dut.ports])
+        # The ports wait for the device setup, and are stalled meanwhile
+        self.assertEqual(result["early"], 0)
+        self.assertIn(0, result["stall"])
+        self.assertEqual(len(data), 3)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_register_access(self):
+        dut = CrossbarDesign("round-robin")
+        result = {}
+        data = []
+        marks = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield
+            marks["start"] = len(result["grants"])
+            # Issued while the ports keep requesting
+            marks["cr0"] = yield from reg_access(dut.core.register_space)
+            marks["end"] = len(result["grants"])
+            # A port requesting during a register access is stalled
+            access = dut.core.register_space.access
+            yield access.r.eq(1 << 19 | 1 << 30)
+            yield access.re.eq(1)
+            yield
+            yield access.re.eq(0)
+            yield
+            yield
+            yield from native_read(dut.ports[1], 16, 2)
+
+        run(dut, [generator(dut), monitor(dut, result)] +
+                 [requester(dut, port, 16*i, 8, data) for i, port in enumerate(dut.ports)])
+        grants = result["grants"][marks["start"]:marks["end"]]
+        # The register read only gets the bus once no user port requests
+        self.assertEqual(grants, [1, 2, 3]*8 + [0])
+        self.assertEqual(marks["cr0"], dut.phy.device.cr0[0])
+        self.assertEqual(result["grants"][-2:], [0, 2])
+        self.assertIn(1, result["stall"])
+        self.assertEqual(device_errors(dut.phy), [])
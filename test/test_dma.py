@@ -0,0 +1,120 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram.frontend.dma import LiteHyperRAMDMAReader, LiteHyperRAMDMAWriter
+
+from test.common import *
+
+
+class DMADesign(CoreDesign):
+    def __init__(self, max_burst, fifo_depth, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.submodules.writer = LiteHyperRAMDMAWriter(self.core.get_port(), max_burst,
+                                                       fifo_depth)
+        self.submodules.reader = LiteHyperRAMDMAReader(self.core.new_port(), max_burst,
+                                                       fifo_depth)
+        self.port = self.core.new_port()
+
+
+def stream_send(sink, data, rng):
+    for i, d in enumerate(data):
+        while rng.random() < 0.2:
+            yield sink.valid.eq(0)
+            yield
+        yield sink.valid.eq(1)
+        yield sink.data.eq(d)
+        yield
+        while not (yield sink.ready):
+            yield
+    yield sink.valid.eq(0)
+
+def stream_receive(source, n, rng):
+    data = []
+    lasts = []
+    while len(data) < n:
+        ready = rng.random() > 0.2
+        yield source.ready.eq(ready)
+        yield
+        if ready and (yield source.valid):
+            data.append((yield source.data))
+            lasts.append((yield source.last))
+    yield source.ready.eq(0)
+    return data, lasts
+
+def dma_run(dma, base, length, loop=0):
+    yield dma.base.eq(base)
+    yield dma.length.eq(length)
+    yield dma.loop.eq(loop)
+    yield dma.start.eq(1)
+    yield
+    yield dma.start.eq(0)
+    yield
+
+
+class TestDMA(unittest.TestCase):
+    def transfer(self, max_burst, fifo_depth, length, **kwargs):
+        dut = DMADesign(max_burst, fifo_depth, **kwargs)
+        rng = random.Random(length)
+        data = pattern(length, 16)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield from dma_run(dut.writer, 100, length)
+            yield from stream_send(dut.writer.sink, data, rng)
+            while not (yield dut.writer.done):
+                yield
+            yield from dma_run(dut.reader, 100, length)
+            result["data"], result["last"] = yield from stream_receive(dut.reader.source,
+                                                                        length, rng)
+            for _ in range(8):
+                yield
+            result["done"] = yield dut.reader.done
+            got = yield from native_read(dut.port, 99, 2)
+            result["around"] = got
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["data"], data)
+        self.assertEqual(result["last"], [0]*(length - 1) + [1])
+        self.assertEqual(result["done"], 1)
+        # Nothing written before base
+        self.assertEqual(result["around"], [0, data[0]])
+        # Bursts are only split at max_burst
+        bursts = -(-length//max_burst)
+        self.assertEqual(dut.phy.device.stats["writes"], bursts)
+        self.assertEqual(dut.phy.device.stats["reads"], bursts + 1)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_bursts_with_length(self):
+        self.transfer(16, 64, 100)
+
+    def test_bursts_ended_by_last(self):
+        # Bursts longer than the length field, ended by last
+        self.transfer(40, 64, 150, length_width=4)
+
+    def test_loop(self):
+        dut = DMADesign(8, 32)
+        data = pattern(20, 16)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield from native_write(dut.port, 0, data)
+            yield from dma_run(dut.reader, 0, 20, loop=1)
+            result["data"], _ = yield from stream_receive(dut.reader.source, 50,
+                                                          random.Random(0))
+            yield dut.reader.loop.eq(0)
+            # The current pass completes
+            while not (yield dut.reader.done):
+                yield dut.reader.source.ready.eq(1)
+                yield
+            yield dut.reader.source.ready.eq(0)
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["data"], (data*3)[:50])
+        self.assertEqual(device_errors(dut.phy), [])
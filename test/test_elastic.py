@@ -0,0 +1,55 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class ElasticDesign(CoreDesign):
+    def __init__(self, depth=None, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.port = self.core.new_port(elastic=True, depth=depth)
+
+
+class TestElastic(unittest.TestCase):
+    def stalls(self, depth=None, **kwargs):
+        dut = ElasticDesign(depth, **kwargs)
+        rng = random.Random(2)
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for i in range(8):
+                addr = rng.randrange(0, 128)
+                # Longer than the FIFOs, so that bursts are ended and resumed
+                n = rng.randrange(1, 40)
+                length = i % 2 == 0
+                data = pattern(n, dut.port.data_width, seed=i)
+                yield from elastic_write(dut.port, addr, data, rng, length)
+                ref.update(zip(range(addr, addr + n), data))
+                got = yield from elastic_read(dut.port, addr, n, rng, length)
+                if got != data:
+                    errors.append((i, addr, got, data))
+            # Everything written is intact
+            got = yield from elastic_read(dut.port, 0, 168, rng)
+            errors.extend((a, got[a], d) for a, d in ref.items() if got[a] != d)
+
+        run(dut, [generator(dut)])
+        self.assertEqual(errors, [])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_stalls_1x(self):
+        self.stalls(phy_cls=HyperRAMPHYModel)
+
+    def test_stalls_2x(self):
+        self.stalls(phy_cls=HyperRAMPHYModel2x)
+
+    def test_stalls_small_fifo(self):
+        self.stalls(depth=4, phy_cls=HyperRAMPHYModel)
@@ -0,0 +1,64 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram import modules
+from litehyperram.core import LiteHyperRAMMultiCore
+from litehyperram.phy.model import HyperRAMPHYModel
+
+from test.common import *
+
+
+class MultiCoreDesign(Module):
+    def __init__(self, nchannels, granularity=None, sys_clk_freq=50e6):
+        self.clock_domains.cd_sys = ClockDomain("sys")
+        module = modules.S27KL0641DA()
+        self.phys = [HyperRAMPHYModel(module, sys_clk_freq) for _ in range(nchannels)]
+        self.submodules += self.phys
+        self.submodules.core = LiteHyperRAMMultiCore(self.phys, module, sys_clk_freq,
+                                                     granularity)
+        self.port = self.core.get_port()
+
+
+class TestInterleave(unittest.TestCase):
+    def transfers(self, nchannels, granularity):
+        dut = MultiCoreDesign(nchannels, granularity)
+        rng = random.Random(nchannels)
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            for core in dut.core.cores:
+                yield from wait_setup(core)
+            for i in range(6):
+                # Across several granules, with and without a length
+                addr = rng.randrange(0, 4*granularity)
+                n = rng.randrange(1, 3*granularity)
+                length = i % 2 == 0
+                data = pattern(n, 16, seed=i)
+                yield from elastic_write(dut.port, addr, data, rng, length)
+                ref.update(zip(range(addr, addr + n), data))
+                got = yield from elastic_read(dut.port, addr, n, rng, length)
+                if got != data:
+                    errors.append((i, addr, got, data))
+
+        run_simulation(dut, [generator(dut)] + [phy.generator() for phy in dut.phys])
+        self.assertEqual(errors, [])
+        # Each granule is on the channel given by the address bits above it
+        g = log2_int(granularity)
+        n = log2_int(nchannels)
+        for a, d in ref.items():
+            channel = (a >> g) & (nchannels - 1)
+            offset = (a & (granularity - 1)) | (a >> (g + n)) << g
+            self.assertEqual(dut.phys[channel].device.mem.get(offset), d)
+        self.assertEqual([error for phy in dut.phys for error in device_errors(phy)], [])
+
+    def test_two_channels(self):
+        self.transfers(2, 16)
+
+    def test_four_channels(self):
+        self.transfers(4, 32)
@@ -0,0 +1,82 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram import modules
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+def reg_access(register_space, value=0, we=0, die_nr=0):
+    # CR0 read or write through the access CSR
+    access = register_space.access
+    yield access.r.eq(value | 1 << 19 | die_nr << 27 | we << 29 | 1 << 30)
+    yield access.re.eq(1)
+    yield
+    yield access.re.eq(0)
+    # busy is set once the strobe has been seen
+    yield
+    yield
+    while (yield access.fields.busy):
+        yield
+    return (yield access.fields.reg_value)
+
+def with_latency(cr0, code, fixed):
+    return (cr0 & ~0xf8) | code << 4 | fixed << 3
+
+
+class TestLatency(unittest.TestCase):
+    # CR0 latency code and fixed latency bit written, and the code and
+    # latency expected to be used: variable latency 5, then an unsupported
+    # latency and a reserved code, both asking for fixed latency, and back
+    # to variable latency 4
+    writes = [(0b0000, 0, 0b0000, 5), (0b0010, 1, 0b0000, 5),
+              (0b0011, 1, 0b0000, 5), (0b1111, 0, 0b1111, 4)]
+
+    def switch(self, phy_cls, module=None):
+        dut = CoreDesign(phy_cls, module, dynamic_latency=True)
+        rs = dut.core.register_space
+        port = dut.core.get_port()
+        nbanks = dut.module.nbanks
+        die_words = 2**port.address_width//nbanks
+        data = pattern(16, port.data_width)
+        result = {"cr0": [], "latency": [], "data": []}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            cr0 = yield from reg_access(rs)
+            for code, fixed, _, _ in self.writes:
+                # All dies are written before the next memory access
+                for die in reversed(range(nbanks)):
+                    yield from reg_access(rs, with_latency(cr0, code, fixed), we=1, die_nr=die)
+                result["latency"].append(((yield rs.latency), (yield rs.fixed_latency)))
+                for die in range(nbanks):
+                    result["cr0"].append((yield from reg_access(rs, die_nr=die)))
+                    yield from native_write(port, die*die_words + 8, data)
+                    got = yield from native_read(port, die*die_words + 8, len(data))
+                    result["data"].append(got == data)
+            result["initial"] = cr0
+
+        run(dut, [generator(dut)])
+        forced = nbanks > 1
+        cr0 = result["initial"]
+        self.assertEqual(result["latency"],
+                         [(latency, fixed | forced) for _, fixed, _, latency in self.writes])
+        self.assertEqual(result["cr0"], [with_latency(cr0, code, fixed | forced)
+                                         for _, fixed, code, _ in self.writes
+                                         for die in range(nbanks)])
+        self.assertEqual(result["data"], [True]*len(self.writes)*nbanks)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_switch_1x(self):
+        self.switch(HyperRAMPHYModel)
+
+    def test_switch_2x(self):
+        self.switch(HyperRAMPHYModel2x)
+
+    def test_switch_dual_die(self):
+        self.switch(HyperRAMPHYModel, modules.S70KL1281DA())
@@ -0,0 +1,89 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram.frontend.memcopy import LiteHyperRAMMemCopy
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x, HyperRAMPHYModel4x
+
+from test.common import *
+
+
+class MemCopyDesign(CoreDesign):
+    def __init__(self, buffer_words=256, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.submodules.memcopy = LiteHyperRAMMemCopy(self.core.get_port(), 16, buffer_words)
+        self.port = self.core.new_port()
+
+
+def memcopy_run(memcopy, src, dst, length, fill=0, pattern=0):
+    yield memcopy.src.storage.eq(src)
+    yield memcopy.dst.storage.eq(dst)
+    yield memcopy.length.storage.eq(length)
+    yield memcopy.fill.storage.eq(fill)
+    yield memcopy.pattern.storage.eq(pattern)
+    yield memcopy.start.re.eq(1)
+    yield
+    yield memcopy.start.re.eq(0)
+    yield
+    while not (yield memcopy.done.status):
+        yield
+
+def to_bytes(words, nbytes):
+    return [(w >> (8*k)) & 0xff for w in words for k in range(nbytes)]
+
+
+class TestMemCopy(unittest.TestCase):
+    def operations(self, **kwargs):
+        dut = MemCopyDesign(**kwargs)
+        port = dut.port
+        nbytes = port.data_width//8
+        n = 64
+        data = pattern(n, port.data_width)
+        ref = to_bytes(data, nbytes)
+        result = {}
+
+        def copy(src, dst, length):
+            ref[dst:dst + length] = ref[src:src + length]
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield from native_write(port, 0, data)
+            # Forward, and overlapping in both directions
+            for src, dst, length in [(0, 40, 16), (8, 16, 24), (16, 8, 24)]:
+                src, dst, length = src*nbytes, dst*nbytes, length*nbytes
+                yield from memcopy_run(dut.memcopy, src, dst, length)
+                copy(src, dst, length)
+            # Fill, starting and ending within words
+            start, length = 3*nbytes + 1, 5*nbytes + 2
+            yield from memcopy_run(dut.memcopy, 0, start, length, fill=1, pattern=0x44332211)
+            for a in range(start, start + length):
+                ref[a] = 0x11*(a % 4 + 1)
+            result["error"] = yield dut.memcopy.error.status
+            # Misaligned copies are not started
+            result["rejected"] = []
+            half = nbytes//2
+            for src, dst, length in [(half, 0, nbytes), (0, half, nbytes), (0, nbytes, half)]:
+                yield from memcopy_run(dut.memcopy, src, dst, length)
+                result["rejected"].append((yield dut.memcopy.error.status))
+            result["data"] = yield from native_read(port, 0, n)
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["error"], 0)
+        self.assertEqual(result["rejected"], [1, 1, 1])
+        self.assertEqual(to_bytes(result["data"], nbytes), ref)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_16bit(self):
+        self.operations(phy_cls=HyperRAMPHYModel)
+
+    def test_32bit(self):
+        self.operations(phy_cls=HyperRAMPHYModel2x)
+
+    def test_64bit(self):
+        self.operations(phy_cls=HyperRAMPHYModel4x, sys_clk_freq=25e6)
+
+    def test_small_buffer(self):
+        self.operations(buffer_words=4, phy_cls=HyperRAMPHYModel2x)
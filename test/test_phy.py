@@ -0,0 +1,67 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram import modules
+from litehyperram.phy.model import HyperRAMPHYModelDQS, HyperRAMPHYModel4x
+
+from test.common import *
+
+
+class TestPHYModels(unittest.TestCase):
+    def transfers(self, phy_cls, module=None, sys_clk_freq=50e6, **phy_kwargs):
+        dut = CoreDesign(phy_cls, module, sys_clk_freq, phy_kwargs)
+        port = dut.core.get_port()
+        nbytes = port.data_width//8
+        rng = random.Random(3)
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for i in range(12):
+                # In either half of the address space (die of dual die parts)
+                addr = rng.randrange(0, 256) + rng.randrange(2)*2**(port.address_width - 1)
+                n = rng.randrange(1, 20)
+                length = i % 3 != 2
+                data = pattern(n, port.data_width, seed=i)
+                # Byte enables on every other burst
+                we = [rng.randrange(2**nbytes) for _ in range(n)] if i % 2 else None
+                yield from native_write(port, addr, data, we, length)
+                for j, d in enumerate(data):
+                    mask = sum(0xff << 8*k for k in range(nbytes)
+                               if we is None or we[j] >> k & 1)
+                    ref[addr + j] = (ref.get(addr + j, 0) & ~mask) | (d & mask)
+                got = yield from native_read(port, addr, n, length)
+                expected = [ref[addr + j] for j in range(n)]
+                if got != expected:
+                    errors.append((i, addr, got, expected))
+
+        run(dut, [generator(dut)])
+        self.assertEqual(errors, [])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_dqs(self):
+        for rx_skew in range(3):
+            with self.subTest(rx_skew=rx_skew):
+                self.transfers(HyperRAMPHYModelDQS, rx_skew=rx_skew)
+
+    def test_dqs_dual_die(self):
+        self.transfers(HyperRAMPHYModelDQS, modules.S70KL1281DA())
+
+    def test_dqs_ganged(self):
+        self.transfers(HyperRAMPHYModelDQS, nchips=2)
+
+    def test_4x(self):
+        # Quarter rate, CK at 4 times the sys clock
+        self.transfers(HyperRAMPHYModel4x, sys_clk_freq=25e6)
+
+    def test_4x_dual_die(self):
+        self.transfers(HyperRAMPHYModel4x, modules.S70KL1281DA(), sys_clk_freq=25e6)
+
+    def test_4x_ganged(self):
+        self.transfers(HyperRAMPHYModel4x, sys_clk_freq=25e6, nchips=2)
@@ -0,0 +1,112 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram.frontend.dma import LiteHyperRAMSGDMAReader, LiteHyperRAMSGDMAWriter
+from litehyperram.frontend.dma import DESC_LAST, DESC_IRQ
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x, HyperRAMPHYModel4x
+
+from test.common import *
+from test.test_dma import stream_send, stream_receive
+
+
+class SGDMADesign(CoreDesign):
+    def __init__(self, max_burst, fifo_depth, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.submodules.writer = LiteHyperRAMSGDMAWriter(self.core.get_port(), max_burst,
+                                                         fifo_depth)
+        self.submodules.reader = LiteHyperRAMSGDMAReader(self.core.new_port(), max_burst,
+                                                         fifo_depth)
+        self.port = self.core.new_port()
+
+
+def descriptor_image(base, descs, nbytes):
+    # Native words holding a chain of descriptors at byte address base
+    image = 0
+    words = [w for desc in descs for w in desc]
+    for i, w in enumerate(words):
+        image |= w << (32*i)
+    start = base - base % nbytes
+    image <<= 8*(base - start)
+    n = -(-(base - start + 4*len(words))//nbytes)
+    return start//nbytes, [(image >> (8*nbytes*i)) & (2**(8*nbytes) - 1) for i in range(n)]
+
+def chain(base, rows):
+    # rows: (address, length, count, stride) per descriptor, all in bytes
+    descs = []
+    for i, (addr, length, count, stride) in enumerate(rows):
+        control = count | (DESC_LAST | DESC_IRQ if i == len(rows) - 1 else 0)
+        descs.append([addr, length, control, stride & 0xffffffff, base + 20*(i + 1)])
+    return descs
+
+def sgdma_run(dma, desc):
+    yield dma.desc.eq(desc)
+    yield dma.start.eq(1)
+    yield
+    yield dma.start.eq(0)
+    yield
+
+
+class TestSGDMA(unittest.TestCase):
+    def transfer(self, max_burst, desc_base, **kwargs):
+        dut = SGDMADesign(max_burst, 64, **kwargs)
+        port = dut.port
+        nbytes = port.data_width//8
+        rng = random.Random(desc_base)
+        # A 1D transfer, then a 2D one of 3 rows of 6 words at a pitch of 16
+        rows = [(0x1000, 20*nbytes, 1, 0), (0x2000, 6*nbytes, 3, 16*nbytes)]
+        n = 20 + 3*6
+        data = pattern(n, port.data_width)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for base in [desc_base, desc_base + 0x100]:
+                addr, words = descriptor_image(base, chain(base, rows), nbytes)
+                yield from native_write(port, addr, words, length=False)
+            writes = dut.phy.device.stats["writes"]
+            yield from sgdma_run(dut.writer, desc_base)
+            yield from stream_send(dut.writer.sink, data, rng)
+            while not (yield dut.writer.done):
+                yield
+            result["writes"] = dut.phy.device.stats["writes"] - writes
+            result["count"] = yield dut.writer.count
+            yield from sgdma_run(dut.reader, desc_base + 0x100)
+            result["data"], result["last"] = yield from stream_receive(dut.reader.source,
+                                                                        n, rng)
+            while not (yield dut.reader.done):
+                yield
+            # Rows of the 2D transfer, and the gaps between them
+            result["2d"] = yield from native_read(port, 0x2000//nbytes, 2*16 + 6,
+                                                 length=False)
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["data"], data)
+        self.assertEqual(result["last"], [0]*19 + [1] + [0]*17 + [1])
+        self.assertEqual(result["count"], 2)
+        gap = [0]*10
+        self.assertEqual(result["2d"], data[20:26] + gap + data[26:32] + gap + data[32:38])
+        # Rows are only split at max_burst
+        self.assertEqual(result["writes"], -(-20//max_burst) + 3*(-(-6//max_burst)))
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_16bit(self):
+        self.transfer(8, 0x104, phy_cls=HyperRAMPHYModel)
+
+    def test_32bit(self):
+        self.transfer(8, 0x104, phy_cls=HyperRAMPHYModel2x)
+
+    def test_64bit(self):
+        self.transfer(8, 0x104, phy_cls=HyperRAMPHYModel4x, sys_clk_freq=25e6)
+
+    def test_128bit(self):
+        self.transfer(8, 0x10c, phy_cls=HyperRAMPHYModel4x, sys_clk_freq=25e6,
+                      phy_kwargs={"nchips": 2})
+
+    def test_bursts_ended_by_last(self):
+        # Bursts longer than the length field, ended by last
+        self.transfer(16, 0x100, phy_cls=HyperRAMPHYModel2x, length_width=3)
@@ -0,0 +1,67 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+def pulse(csr):
+    yield csr.re.eq(1)
+    yield
+    yield csr.re.eq(0)
+    yield
+
+def counters(stats):
+    names = ["cycles", "reads", "writes", "read_beats", "write_beats", "idle_cycles",
+             "turnaround_cycles", "latency_cycles", "refresh_collisions", "stall_cycles"]
+    names += ["latency_hist{}".format(i) for i in range(16)]
+    yield from pulse(stats.snapshot)
+    values = {}
+    for name in names:
+        values[name] = yield getattr(stats, name).status
+    return values
+
+
+class TestStats(unittest.TestCase):
+    def counters(self, phy_cls):
+        dut = CoreDesign(phy_cls, with_stats=True)
+        port = dut.core.get_port()
+        result = {}
+
+        def generator(dut):
+            # Waits for the lockout until the device is set up
+            yield from native_write(port, 0, pattern(4, port.data_width))
+            result["setup"] = yield from counters(dut.core.stats)
+            yield from pulse(dut.core.stats.clear)
+            device = dict(dut.phy.device.stats)
+            for i in range(3):
+                yield from native_write(port, 32*i, pattern(8, port.data_width, seed=i))
+            for i in range(5):
+                yield from native_read(port, 32*i, 6)
+            result["run"] = yield from counters(dut.core.stats)
+            result["device"] = {k: dut.phy.device.stats[k] - device[k]
+                                for k in ["reads", "writes"]}
+
+        run(dut, [generator(dut)])
+        setup, c = result["setup"], result["run"]
+        self.assertGreater(setup["stall_cycles"], 0)
+        self.assertEqual(c["stall_cycles"], 0)
+        self.assertEqual((c["reads"], c["writes"]), (5, 3))
+        self.assertEqual(result["device"], {"reads": 5, "writes": 3})
+        self.assertEqual((c["read_beats"], c["write_beats"]), (5*6, 3*8))
+        # Every cycle is accounted for once, and every command has a latency
+        self.assertEqual(c["cycles"], c["read_beats"] + c["write_beats"] + c["idle_cycles"] +
+                                      c["turnaround_cycles"] + c["latency_cycles"])
+        self.assertEqual(sum(c["latency_hist{}".format(i)] for i in range(16)), 8)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_counters_1x(self):
+        self.counters(HyperRAMPHYModel)
+
+    def test_counters_2x(self):
+        self.counters(HyperRAMPHYModel2x)
@@ -0,0 +1,80 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class TrainingDesign(CoreDesign):
+    def __init__(self, **kwargs):
+        CoreDesign.__init__(self, HyperRAMPHYModel2x, with_training=True, **kwargs)
+        # As the CSR bank of a SoC does, so that the trained delays are
+        # written to rx_delay<n>
+        for csr in self.core.training.rx_delay:
+            csr.finalize(32, "little")
+            self.submodules += csr
+
+
+def signed8(v):
+    return v - 256 if v & 0x80 else v
+
+
+class TestTraining(unittest.TestCase):
+    def train(self, eye, nchips=1, rwds_eye=None):
+        dut = TrainingDesign(phy_kwargs={"rx_eye": eye, "rwds_eye": rwds_eye,
+                                         "nchips": nchips})
+        training = dut.core.training
+        port = dut.core.get_port()
+        data = pattern(16, port.data_width)
+        result = {"timeouts": 0}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield training.start.re.eq(1)
+            yield
+            yield training.start.re.eq(0)
+            yield
+            while not (yield training.done.status):
+                result["timeouts"] += yield dut.core.controller.read_timeout
+                yield
+            result["window"] = []
+            result["delay"] = []
+            for i in range(nchips):
+                window = yield training.rx_window[i].status
+                result["window"].append((signed8(window & 0xff), window >> 8))
+                result["delay"].append(signed8((yield training.rx_delay[i].storage)))
+            # Reads are correct at the trained delay
+            yield from native_write(port, 64, data)
+            result["data"] = yield from native_read(port, 64, len(data))
+
+        run(dut, [generator(dut)])
+        first, last = eye
+        self.assertEqual(result["window"], [(first, last - first + 1)]*nchips)
+        self.assertEqual(result["delay"], [first + (last - first + 1)//2]*nchips)
+        self.assertEqual(result["data"], data)
+        if rwds_eye is not None:
+            # Every tap outside rwds_eye timed out, and the sweep went on
+            self.assertEqual(result["timeouts"], 64 - (rwds_eye[1] - rwds_eye[0] + 1))
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_centred(self):
+        self.train((-5, 12))
+
+    def test_edge(self):
+        # The eye reaches the end of the taps swept
+        self.train((20, 31))
+
+    def test_ganged(self):
+        self.train((-12, -3), nchips=2)
+
+    def test_lost_strobes(self):
+        # Taps further out lose RWDS, and reads at them time out
+        self.train((-5, 12), rwds_eye=(-10, 20))
+
+    def test_lost_strobes_ganged(self):
+        self.train((-12, -3), nchips=2, rwds_eye=(-16, 0))
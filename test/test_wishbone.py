@@ -0,0 +1,109 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+
+from litehyperram.frontend.wishbone import LiteHyperRAMWishbone2Native
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class WishboneDesign(CoreDesign):
+    def __init__(self, phy_cls, wrap_bytes=32, **kwargs):
+        # The device wraps at the same size (a single device)
+        CoreDesign.__init__(self, phy_cls, burst_length=wrap_bytes, **kwargs)
+        self.bus = wishbone.Interface(data_width=32)
+        self.submodules.wishbone = LiteHyperRAMWishbone2Native(self.bus, self.core.get_port(),
+                                                               wrap_bytes=wrap_bytes)
+
+
+class TestWishbone(unittest.TestCase):
+    def wait_states(self, phy_cls):
+        dut = WishboneDesign(phy_cls)
+        rng = random.Random(1)
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            for i in range(8):
+                adr = rng.randrange(0, 256)
+                n = rng.randrange(2, 12)
+                bte = 0b10 if i % 2 else 0
+                data = pattern(n, 32, seed=i)
+                yield from wb_burst(dut.bus, adr, n, data, bte, rng)
+                for j in range(n):
+                    ref[wb_address(adr, j, bte)] = data[j]
+                got = yield from wb_burst(dut.bus, adr, n, None, bte, rng)
+                for j in range(n):
+                    a = wb_address(adr, j, bte)
+                    if got[j] != ref[a]:
+                        errors.append((i, a, got[j], ref[a]))
+            # Everything written is intact
+            for adr in sorted(ref):
+                got = yield from wb_burst(dut.bus, adr, 1)
+                if got[0] != ref[adr]:
+                    errors.append(("final", adr, got[0], ref[adr]))
+
+        run(dut, [generator(dut)])
+        self.assertEqual(errors, [])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_wait_states_1x(self):
+        self.wait_states(HyperRAMPHYModel)
+
+    def test_wait_states_2x(self):
+        self.wait_states(HyperRAMPHYModel2x)
+
+    def wrapped(self, phy_cls, bte):
+        wrap = 2 << bte
+        dut = WishboneDesign(phy_cls, wrap_bytes=4*wrap)
+        base = 2*wrap
+        old = pattern(2*wrap, 32, seed=2)
+        # A whole line, and a partial one, written starting mid-line
+        writes = [(base + wrap - 3, pattern(wrap, 32)),
+                  (base + wrap + 1, pattern(wrap//2, 32, seed=1))]
+        reads = [(base + wrap//2 + 1, wrap), (base + 2*wrap - 1, 3)]
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield from wb_burst(dut.bus, base, 2*wrap, old)
+            for adr, data in writes:
+                yield from wb_burst(dut.bus, adr, len(data), data, bte)
+            result["linear"] = yield from wb_burst(dut.bus, base, 2*wrap)
+            result["wrapped"] = []
+            for adr, n in reads:
+                result["wrapped"].append((yield from wb_burst(dut.bus, adr, n, None, bte)))
+
+        run(dut, [generator(dut)])
+        mem = dict(zip(range(base, base + 2*wrap), old))
+        for adr, data in writes:
+            for j, d in enumerate(data):
+                mem[wb_address(adr, j, bte)] = d
+        # Written in wrap order
+        self.assertEqual(result["linear"], [mem[a] for a in range(base, base + 2*wrap)])
+        # and read back in wrap order, critical word first
+        self.assertEqual(result["wrapped"],
+                         [[mem[wb_address(adr, j, bte)] for j in range(n)] for adr, n in reads])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_wrap4(self):
+        self.wrapped(HyperRAMPHYModel, 0b01)
+
+    def test_wrap8(self):
+        self.wrapped(HyperRAMPHYModel, 0b10)
+
+    def test_wrap16(self):
+        self.wrapped(HyperRAMPHYModel, 0b11)
+
+    def test_wrap_2x(self):
+        for bte in (0b01, 0b10, 0b11):
+            with self.subTest(bte=bte):
+                self.wrapped(HyperRAMPHYModel2x, bte)
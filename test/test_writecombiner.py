@@ -0,0 +1,192 @@
+# This file is Copyright (c) 2022 Marcus Comstedt <marcus@mc.pp.se>
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litehyperram.phy.model import HyperRAMPHYModel, HyperRAMPHYModel2x
+
+from test.common import *
+
+
+class WriteCombinerDesign(CoreDesign):
+    def __init__(self, coalesce=False, timeout=64, **kwargs):
+        CoreDesign.__init__(self, **kwargs)
+        self.port = self.core.new_port(write_combine=True, coalesce=coalesce, timeout=timeout)
+        self.combiner = self.core.write_combiner0
+
+
+def merge(old, new, we, nbytes):
+    mask = sum(0xff << 8*b for b in range(nbytes) if we >> b & 1)
+    return (old & ~mask) | (new & mask)
+
+def device_counts(phy, since):
+    return tuple(phy.device.stats[k] - since[k] for k in ["reads", "writes"])
+
+
+class TestWriteCombiner(unittest.TestCase):
+    def test_partial_words(self):
+        dut = WriteCombinerDesign()
+        port = dut.port
+        old = pattern(16, 16, seed=1)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            # Known contents, written around the combiner
+            yield from native_write(dut.core.get_port(), 16, old)
+            since = dict(dut.phy.device.stats)
+            # Word 20 in two halves, word 22 in one
+            yield from native_write(port, 20, [0x1111], we=[0b01])
+            yield from native_write(port, 20, [0x2222], we=[0b10])
+            yield from native_write(port, 21, [0x3333, 0x4444], we=[0b11, 0b10])
+            # Word 20 is complete, and read from the buffer
+            result["forwarded"] = yield from native_read(port, 20, 2)
+            result["buffered"] = device_counts(dut.phy, since)
+            # Word 22 is not, so the buffer is written first
+            result["read"] = yield from native_read(port, 20, 3)
+            result["flushed"] = device_counts(dut.phy, since)
+            result["mem"] = [dut.phy.device.mem.get(16 + i) for i in range(16)]
+
+        run(dut, [generator(dut)])
+        expected = list(old)
+        expected[4] = 0x2211
+        expected[5] = 0x3333
+        expected[6] = merge(old[6], 0x4444, 0b10, 2)
+        self.assertEqual(result["forwarded"], expected[4:6])
+        self.assertEqual(result["buffered"], (0, 0))
+        self.assertEqual(result["read"], expected[4:7])
+        # One burst for the three writes
+        self.assertEqual(result["flushed"], (1, 1))
+        self.assertEqual(result["mem"], expected)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_timeout(self):
+        dut = WriteCombinerDesign(timeout=16)
+        port = dut.port
+        data = pattern(4, 16)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            since = dict(dut.phy.device.stats)
+            yield from native_write(port, 8, data[:2])
+            yield from native_write(port, 10, data[2:])
+            result["before"] = device_counts(dut.phy, since)
+            for _ in range(40):
+                yield
+            result["after"] = device_counts(dut.phy, since)
+            result["mem"] = [dut.phy.device.mem.get(8 + i) for i in range(4)]
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["before"], (0, 0))
+        self.assertEqual(result["after"], (0, 1))
+        self.assertEqual(result["mem"], data)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_flush_csr(self):
+        dut = WriteCombinerDesign(timeout=None)
+        port = dut.port
+        data = pattern(4, 16)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            since = dict(dut.phy.device.stats)
+            yield from native_write(port, 8, data)
+            for _ in range(200):
+                yield
+            # Held without a timeout
+            result["before"] = device_counts(dut.phy, since)
+            yield dut.combiner.flush.re.eq(1)
+            yield
+            yield dut.combiner.flush.re.eq(0)
+            for _ in range(40):
+                yield
+            result["after"] = device_counts(dut.phy, since)
+            result["mem"] = [dut.phy.device.mem.get(8 + i) for i in range(4)]
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["before"], (0, 0))
+        self.assertEqual(result["after"], (0, 1))
+        self.assertEqual(result["mem"], data)
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_read_after_write(self):
+        dut = WriteCombinerDesign(timeout=None)
+        port = dut.port
+        data = pattern(8, 16, seed=2)
+        result = {}
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            since = dict(dut.phy.device.stats)
+            yield from native_write(port, 32, data)
+            # Another block is read past the buffer
+            yield from native_read(port, 64, 4)
+            result["other"] = device_counts(dut.phy, since)
+            # A read overlapping the block, but not covered by the buffer,
+            # sees the data written
+            result["read"] = yield from native_read(port, 36, 8)
+            result["overlap"] = device_counts(dut.phy, since)
+            # Same for a read without a length starting below the block
+            yield from native_write(port, 40, data[:2])
+            result["unknown"] = yield from native_read(port, 30, 12, length=False)
+            result["end"] = device_counts(dut.phy, since)
+            # A write to another block flushes too
+            yield from native_write(port, 48, data[:2])
+            yield from native_write(port, 64, data[:2])
+            for _ in range(20):
+                yield
+            result["mem"] = [dut.phy.device.mem.get(48 + i) for i in range(2)]
+
+        run(dut, [generator(dut)])
+        self.assertEqual(result["other"], (1, 0))
+        self.assertEqual(result["read"][:4], data[4:])
+        self.assertEqual(result["overlap"], (2, 1))
+        self.assertEqual(result["unknown"][2:], data[:8] + data[:2])
+        self.assertEqual(result["end"], (3, 2))
+        self.assertEqual(result["mem"], data[:2])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def with_coalescer(self, phy_cls):
+        dut = WriteCombinerDesign(coalesce=True, timeout=32, phy_cls=phy_cls)
+        port = dut.port
+        nbytes = port.data_width//8
+        rng = random.Random(5)
+        ref = {}
+        errors = []
+
+        def generator(dut):
+            yield from wait_setup(dut.core)
+            yield from native_write(port, 0, [0]*128, length=False)
+            ref.update((a, 0) for a in range(128))
+            for i in range(40):
+                # Small writes and reads over a few blocks
+                addr = rng.randrange(0, 120)
+                n = rng.randrange(1, 9)
+                if rng.random() < 0.6:
+                    data = pattern(n, port.data_width, seed=i)
+                    we = [rng.randrange(1, 2**nbytes) for _ in range(n)]
+                    yield from native_write(port, addr, data, we, length=rng.random() < 0.9)
+                    for j in range(n):
+                        ref[addr + j] = merge(ref[addr + j], data[j], we[j], nbytes)
+                else:
+                    got = yield from native_read(port, addr, n, length=rng.random() < 0.9)
+                    expected = [ref[addr + j] for j in range(n)]
+                    if got != expected:
+                        errors.append((i, addr, got, expected))
+            got = yield from native_read(port, 0, 128, length=False)
+            errors.extend((a, got[a], d) for a, d in ref.items() if got[a] != d)
+
+        run(dut, [generator(dut)])
+        self.assertEqual(errors, [])
+        self.assertEqual(device_errors(dut.phy), [])
+
+    def test_coalescer_1x(self):
+        self.with_coalescer(HyperRAMPHYModel)
+
+    def test_coalescer_2x(self):
+        self.with_coalescer(HyperRAMPHYModel2x)